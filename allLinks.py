@@ -1,14 +1,177 @@
-from bs4 import BeautifulSoup
-import requests
+import argparse
+import hashlib
+import sqlite3
+import time
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 
-url = "https://www.ellindecoratie.nl/" 
-headers = {'User-Agent': 'Mozilla/5.0'}
-response = requests.get(url, headers=headers)
-soup = BeautifulSoup(response.text, 'html.parser')
+from downloader import make_session
+from parsing import LINKS_ONLY, make_soup
+from scheduler import add_scheduler_arguments, open_scheduler
+from warc import add_warc_arguments, open_session
 
-# print(soup)
-print(response.status_code)  
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "yclid", "dclid", "mc_cid", "mc_eid", "_ga", "_gl"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
 
-links = soup.find_all('a')
-for link in links:
-    print(link.get('href'))
\ No newline at end of file
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    depth INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    status INTEGER,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, id);
+"""
+
+
+def normalize_url(href, base_url):
+    # Resolve against the page, then strip everything that doesn't change the resource
+    url = urljoin(base_url, href.strip())
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    if parts.port and parts.port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{parts.port}"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS]
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def url_key(url):
+    # 8-byte digest: a 50k-page seen-set stays well under a few MB
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+
+
+class Crawler:
+    """Breadth-first same-site crawler whose frontier lives in SQLite.
+
+    Stopping the process and starting it again with the same ``db_path``
+    resumes where it left off.
+    """
+
+    def __init__(self, start_url, db_path="crawl.sqlite", headers=None, max_depth=3,
+                 max_pages=500, same_host=True, delay=0.0, session=None):
+        self.start_url = normalize_url(start_url, start_url)
+        self.host = urlsplit(self.start_url).netloc
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.same_host = same_host
+        self.delay = delay
+        self.session = session or make_session(headers, pool_size=1)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(_SCHEMA)
+        # A page that was being fetched when the last run stopped gets fetched again
+        with self.db:
+            self.db.execute("UPDATE frontier SET state = 'queued' WHERE state = 'fetching'")
+        self.seen = {url_key(url) for (url,) in self.db.execute("SELECT url FROM frontier")}
+        self.enqueue([self.start_url], 0)
+
+    def close(self):
+        self.db.close()
+
+    def allowed(self, url):
+        return not self.same_host or urlsplit(url).netloc == self.host
+
+    def enqueue(self, urls, depth):
+        new = []
+        for url in urls:
+            key = url_key(url)
+            if key in self.seen or not self.allowed(url):
+                continue
+            self.seen.add(key)
+            new.append((url, depth))
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO frontier (url, depth) VALUES (?, ?)", new)
+        return len(new)
+
+    def pages_done(self):
+        return self.db.execute("SELECT COUNT(*) FROM frontier WHERE state != 'queued'").fetchone()[0]
+
+    def next_url(self):
+        return self.db.execute(
+            "SELECT id, url, depth FROM frontier WHERE state = 'queued' AND depth <= ? ORDER BY id LIMIT 1",
+            (self.max_depth,),
+        ).fetchone()
+
+    def mark(self, row_id, state, status=None):
+        with self.db:
+            self.db.execute("UPDATE frontier SET state = ?, status = ?, updated_at = ? WHERE id = ?",
+                            (state, status, time.time(), row_id))
+
+    def extract_links(self, html, page_url):
+        # Only <a> tags are built, the rest of the page is skipped while parsing
+        soup = make_soup(html, parse_only=LINKS_ONLY)
+        links = []
+        for a in soup.find_all("a", href=True):
+            url = normalize_url(a["href"], page_url)
+            if url:
+                links.append(url)
+        return links
+
+    def crawl(self):
+        """Yield ``(url, status_code)`` for every page fetched until a limit is hit."""
+        done = self.pages_done()
+        while done < self.max_pages:
+            row = self.next_url()
+            if row is None:
+                break
+            row_id, url, depth = row
+            self.mark(row_id, "fetching")
+            try:
+                response = self.session.get(url, timeout=30)
+            except Exception as e:
+                print(f"❌ Failed to fetch {url}. Error: {e}")
+                self.mark(row_id, "failed")
+                done += 1
+                continue
+            content_type = response.headers.get("Content-Type", "")
+            if response.ok and "html" in content_type and depth < self.max_depth:
+                self.enqueue(self.extract_links(response.text, response.url), depth + 1)
+            self.mark(row_id, "done" if response.ok else "failed", response.status_code)
+            done += 1
+            yield url, response.status_code
+            if self.delay:
+                time.sleep(self.delay)
+
+    def crawled_urls(self):
+        return [url for (url,) in self.db.execute(
+            "SELECT url FROM frontier WHERE state = 'done' AND status = 200 ORDER BY id")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl a site and list its pages.")
+    parser.add_argument("url", nargs="?", default="https://www.ellindecoratie.nl/")
+    parser.add_argument("--db", default="crawl.sqlite", help="frontier database, reused to resume")
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--max-pages", type=int, default=500)
+    parser.add_argument("--all-hosts", action="store_true", help="follow links to other hosts")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait between requests")
+    parser.add_argument("--output", help="write crawled page URLs here, for make.py --batch")
+    add_warc_arguments(parser)
+    add_scheduler_arguments(parser)
+    args = parser.parse_args()
+
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    # The scheduler adds robots.txt Crawl-delay and Retry-After on top of --delay
+    session = open_session(args, headers, pool_size=1, scheduler=open_scheduler(args, headers))
+    crawler = Crawler(args.url, db_path=args.db, headers=headers, max_depth=args.max_depth,
+                      max_pages=args.max_pages, same_host=not args.all_hosts, delay=args.delay,
+                      session=session)
+    try:
+        for url, status in crawler.crawl():
+            print(status, url)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                for url in crawler.crawled_urls():
+                    f.write(url + "\n")
+    finally:
+        crawler.close()
+        if session is not None:
+            session.close()
+
+
+if __name__ == "__main__":
+    main()
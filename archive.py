@@ -0,0 +1,167 @@
+import os
+import shutil
+import threading
+import warnings
+import zipfile
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of one process are kept apart
+    fcntl = None
+
+# Already-compressed formats: deflating them again costs CPU and saves nothing
+STORED_EXTENSIONS = frozenset([".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".zip", ".gz"])
+COPY_CHUNK = 1024 * 1024
+
+# Absolute archive path -> [lock, number of archives using or waiting for it]
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+class ImageArchive:
+    """An images ZIP that is updated in place instead of rebuilt.
+
+    Opening an existing archive reads only its central directory. add()
+    appends an entry only when the file is new or its contents changed:
+    a file with the same size and mtime is skipped without being read, and
+    one with the same size but a new mtime (e.g. downloaded again) is only
+    read to compare its CRC. Replaced or removed entries are dropped by
+    rewriting the archive once, on close.
+
+    Only one ImageArchive can have a given path open at a time: opening
+    it waits until the previous one is closed, whether that one belongs
+    to another thread or (through flock on ``<zip_path>.lock``) another
+    process. Two writers appending to the same file would corrupt it.
+    """
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self._entries = {}
+        self._stale = False
+        self._zip = None
+        self._lock_file = _lock_path(zip_path)
+        try:
+            self._open()
+        except BaseException:
+            _unlock_path(zip_path, self._lock_file)
+            raise
+
+    def _open(self):
+        zip_path = self.zip_path
+        mode = "w"
+        if os.path.exists(zip_path):
+            try:
+                with zipfile.ZipFile(zip_path) as existing:
+                    for info in existing.infolist():
+                        if not info.is_dir():
+                            self._entries[info.filename] = (info.file_size, info.date_time, info.CRC)
+                mode = "a"
+            except zipfile.BadZipFile:
+                pass
+        self._zip = zipfile.ZipFile(zip_path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, path, arcname=None):
+        """Add ``path`` unless an identical entry is already stored; return True if written."""
+        info = zipfile.ZipInfo.from_file(path, arcname or os.path.basename(path))
+        known = self._entries.get(info.filename)
+        if known is not None and known[0] == info.file_size:
+            if known[1] == info.date_time or known[2] == _file_crc(path):
+                return False
+        if known is not None:
+            # The old copy stays in the file until close() compacts it
+            self._stale = True
+        ext = os.path.splitext(info.filename)[1].lower()
+        info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)  # "Duplicate name" for replaced entries
+            with open(path, "rb") as src, self._zip.open(info, "w") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+        self._entries[info.filename] = (info.file_size, info.date_time, info.CRC)
+        return True
+
+    def sync(self, folder):
+        """Make the archive mirror the files directly inside ``folder``."""
+        present = set()
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path) and not name.endswith(".part"):
+                present.add(name)
+                self.add(path, name)
+        removed = set(self._entries) - present
+        for name in removed:
+            del self._entries[name]
+        if removed:
+            self._stale = True
+
+    def close(self):
+        if self._zip is None:
+            return
+        try:
+            self._zip.close()
+            if self._stale:
+                self._compact()
+        finally:
+            self._zip = None
+            _unlock_path(self.zip_path, self._lock_file)
+
+    def _compact(self):
+        # Keep the newest copy of each live entry. Only needed when files were
+        # replaced or deleted, which is rare next to plain additions
+        tmp_path = f"{self.zip_path}.tmp"
+        with zipfile.ZipFile(self.zip_path) as src, zipfile.ZipFile(tmp_path, "w") as dst:
+            latest = {info.filename: info for info in src.infolist() if info.filename in self._entries}
+            for info in latest.values():
+                copy_info = zipfile.ZipInfo(info.filename, info.date_time)
+                copy_info.compress_type = info.compress_type
+                copy_info.external_attr = info.external_attr
+                with src.open(info) as reader, dst.open(copy_info, "w") as writer:
+                    shutil.copyfileobj(reader, writer, COPY_CHUNK)
+        os.replace(tmp_path, self.zip_path)
+        self._stale = False
+
+
+def _lock_path(zip_path):
+    # Threads queue on a lock per path; other processes on an flock of a sidecar file
+    key = os.path.abspath(zip_path)
+    with _path_locks_guard:
+        entry = _path_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    entry[0].acquire()
+    if fcntl is None:
+        return None
+    try:
+        lock_file = open(f"{zip_path}.lock", "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    except BaseException:
+        _unlock_path(zip_path, None)
+        raise
+    return lock_file
+
+
+def _unlock_path(zip_path, lock_file):
+    if lock_file is not None:
+        # Closing the file drops the flock. The file is left in place: deleting
+        # it would let a process that already opened it lock a different file
+        lock_file.close()
+    key = os.path.abspath(zip_path)
+    with _path_locks_guard:
+        entry = _path_locks[key]
+        entry[0].release()
+        entry[1] -= 1
+        if not entry[1]:
+            del _path_locks[key]
+
+
+def _file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
@@ -0,0 +1,226 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import time
+import warnings
+from collections import namedtuple
+
+from downloader import (ALLOWED_CONTENT_TYPES, CHUNK_SIZE, DEFAULT_PER_HOST, DEFAULT_WORKERS,
+                        MAX_IMAGE_BYTES, DownloadRejected, ImageResult, NotModified,
+                        download_images, local_filename, make_session)
+from scheduler import retry_after_seconds, scheduled_session
+
+try:
+    import aiohttp
+except ImportError:  # optional: without it requests runs in worker threads
+    aiohttp = None
+
+# ``content`` is the raw body; ``text`` is it decoded with the response's charset
+PageResponse = namedtuple("PageResponse", ["status", "headers", "content", "text"])
+
+
+class AsyncHttp:
+    """Page, image and webhook I/O for the asyncio pipeline.
+
+    Uses one aiohttp session with a connection limit per host when aiohttp
+    is installed. Otherwise it warns once and runs the same requests code
+    the threaded modes use in worker threads, which still lets stages
+    overlap. A requests ``session`` passed in (such as a WARC recording or
+    replaying one) is always used that way, and left open on exit. With a
+    scheduler.HostScheduler aiohttp requests wait for a slot from it; a
+    session passed in is expected to be scheduled already. Use as
+    ``async with AsyncHttp(headers) as http``.
+    """
+
+    def __init__(self, headers=None, connections=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, timeout=30,
+                 session=None, scheduler=None):
+        self.headers = headers or {}
+        self.connections = connections
+        self.per_host = per_host
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self._session = session
+        self._own_session = session is None
+        self._threaded = aiohttp is None or session is not None
+
+    async def __aenter__(self):
+        if not self._own_session:
+            return self
+        if aiohttp is not None:
+            connections, per_host = self.connections, self.per_host
+            if self.scheduler is not None:
+                # The scheduler sets each host's concurrency; the connector only caps it at the scheduler's maximum
+                per_host = self.scheduler.max_per_host
+                connections = max(connections, per_host)
+            connector = aiohttp.TCPConnector(limit=connections, limit_per_host=per_host)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        else:
+            warnings.warn("aiohttp is not installed; the async pipeline runs requests in threads")
+            if self.scheduler is not None:
+                self._session = scheduled_session(self.scheduler, self.headers, pool_size=self.connections)
+            else:
+                self._session = make_session(self.headers, pool_size=self.connections)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if not self._own_session:
+            return
+        if aiohttp is not None:
+            await self._session.close()
+        else:
+            self._session.close()
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, url, method="GET"):
+        # Yields a dict for the caller to fill from the response as soon as its headers arrive
+        if self.scheduler is None:
+            yield {}
+            return
+        host = await self.scheduler.acquire_async(url, method)
+        outcome = {"start": time.monotonic()}
+        try:
+            yield outcome
+        finally:
+            if "status" in outcome:
+                self.scheduler.release(host, outcome["latency"], outcome["status"],
+                                       retry_after=outcome["retry_after"])
+            else:
+                self.scheduler.release(host, error=True)
+
+    @staticmethod
+    def _observe(outcome, response):
+        if "start" in outcome:
+            outcome.update(status=response.status, latency=time.monotonic() - outcome["start"],
+                           retry_after=retry_after_seconds(response))
+
+    async def get_page(self, url, headers=None):
+        if self._threaded:
+            response = await asyncio.to_thread(self._session.get, url, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            return PageResponse(response.status_code, response.headers, response.content, response.text)
+        async with self._slot(url) as slot, self._session.get(url, headers=headers) as response:
+            self._observe(slot, response)
+            response.raise_for_status()
+            content = await response.read()
+            text = content.decode(response.get_encoding(), errors="replace") if content else ""
+            return PageResponse(response.status, response.headers, content, text)
+
+    async def post_multipart(self, url, fields, files):
+        """POST text ``fields`` and ``files`` (name -> (filename, path, content type)); return the status."""
+        if self._threaded:
+            return await asyncio.to_thread(self._post_multipart_sync, url, fields, files)
+        form = aiohttp.FormData()
+        for name, value in fields.items():
+            form.add_field(name, value, content_type="text/plain")
+        opened = []
+        try:
+            for name, (filename, path, content_type) in files.items():
+                f = open(path, "rb")
+                opened.append(f)
+                form.add_field(name, f, filename=filename, content_type=content_type)
+            async with self._slot(url, "POST") as slot, self._session.post(url, data=form) as response:
+                self._observe(slot, response)
+                await response.read()
+                return response.status
+        finally:
+            for f in opened:
+                f.close()
+
+    def _post_multipart_sync(self, url, fields, files):
+        multipart = {name: (None, value, "text/plain") for name, value in fields.items()}
+        opened = []
+        try:
+            for name, (filename, path, content_type) in files.items():
+                f = open(path, "rb")
+                opened.append(f)
+                multipart[name] = (filename, f, content_type)
+            return self._session.post(url, files=multipart, timeout=self.timeout).status_code
+        finally:
+            for f in opened:
+                f.close()
+
+    async def download_images(self, urls, images_folder, store=None, max_bytes=MAX_IMAGE_BYTES,
+                              allowed_types=ALLOWED_CONTENT_TYPES, state=None):
+        """Like downloader.download_images(): a list of ImageResult aligned with ``urls``.
+
+        With a fetch_state.FetchState as ``state`` images already stored are
+        revalidated with a conditional request, as download_images() does.
+        """
+        if self._threaded:
+            return await asyncio.to_thread(download_images, urls, images_folder, session=self._session,
+                                           per_host=self.per_host, timeout=self.timeout,
+                                           max_bytes=max_bytes, allowed_types=allowed_types,
+                                           store=store, state=state)
+        os.makedirs(images_folder, exist_ok=True)
+        taken = set()
+        paths = {}
+        for url in urls:
+            if url not in paths:
+                paths[url] = os.path.join(images_folder, local_filename(url, taken))
+
+        async def download(url):
+            try:
+                if store is not None:
+                    known = store.lookup(url)
+                    if known is None or state is not None:
+                        tmp_path = store.temp_path()
+                        try:
+                            size, sha256 = await self._fetch_image(url, tmp_path, max_bytes, allowed_types,
+                                                                   state=state, conditional=bool(known))
+                            known = await asyncio.to_thread(store.add_file, url, tmp_path, sha256, size)
+                        except NotModified:
+                            pass
+                    sha256, size = known
+                    store.link(sha256, paths[url])
+                else:
+                    path = paths[url]
+                    # Only ask for a 304 when the previous copy is still here to fall back on
+                    known = state.get(url) if state is not None and os.path.exists(path) else None
+                    try:
+                        size, sha256 = await self._fetch_image(url, path, max_bytes, allowed_types,
+                                                               state=state, conditional=bool(known))
+                    except NotModified:
+                        size, sha256 = os.path.getsize(path), known[2]
+                return ImageResult(url, paths[url], True, None, size, sha256)
+            except Exception as e:
+                return ImageResult(url, None, False, e, 0, None)
+
+        unique = list(paths)
+        done = dict(zip(unique, await asyncio.gather(*(download(url) for url in unique))))
+        return [done[url] for url in urls]
+
+    async def _fetch_image(self, url, local_path, max_bytes, allowed_types, state=None, conditional=False):
+        # The same checks and fetch state handling as downloader.fetch_image(), on an aiohttp stream
+        headers = state.conditional_headers(url) if state is not None and conditional else None
+        async with self._slot(url) as slot, self._session.get(url, headers=headers) as response:
+            self._observe(slot, response)
+            if response.status == 304:
+                raise NotModified(url)
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if allowed_types is not None and content_type not in allowed_types:
+                raise DownloadRejected(f"content type {content_type or 'missing'!r} not allowed")
+            length = response.headers.get("Content-Length", "")
+            if max_bytes and length.isdigit() and int(length) > max_bytes:
+                raise DownloadRejected(f"{length} bytes exceeds limit of {max_bytes}")
+            digest = hashlib.sha256()
+            size = 0
+            part_path = local_path + ".part"
+            try:
+                with open(part_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if max_bytes and size > max_bytes:
+                            raise DownloadRejected(f"body exceeds limit of {max_bytes} bytes")
+                        digest.update(chunk)
+                        f.write(chunk)
+                os.replace(part_path, local_path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+        if state is not None:
+            state.record(url, response.headers, digest.hexdigest())
+        return size, digest.hexdigest()
@@ -0,0 +1,153 @@
+import gzip
+import os
+import xml.etree.ElementTree as ET
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import requests
+
+DEFAULT_FETCH_WORKERS = 8
+# Sitemap indexes only list sitemaps, but a broken site can nest them; don't follow them forever
+MAX_SITEMAP_DEPTH = 3
+
+# ``result`` is whatever the last stage returned; ``error`` is set instead when a stage failed
+BatchResult = namedtuple("BatchResult", ["url", "result", "error"])
+
+
+class FetchFailed(Exception):
+    pass
+
+
+def read_url_list(path, headers=None):
+    """Return the URLs in a plain list file (one per line) or a sitemap.xml.
+
+    The sitemaps a <sitemapindex> lists are read in turn (fetched with
+    ``headers`` when they are URLs, otherwise opened relative to the
+    index) and their page URLs returned in order. Sitemaps may be gzipped.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(b"\x1f\x8b"):
+        data = gzip.decompress(data)
+    if data.lstrip().startswith(b"<"):
+        return _sitemap_urls(data, path, os.path.dirname(path), headers, set(), 0)
+    urls = []
+    for line in data.decode("utf-8").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            urls.append(line)
+    return urls
+
+
+def _sitemap_urls(data, location, base_dir, headers, seen, depth):
+    root = ET.fromstring(data)
+    kind = root.tag.rsplit("}", 1)[-1]
+    # <loc> elements, namespace ignored
+    locs = [el.text.strip() for el in root.iter() if el.tag.rsplit("}", 1)[-1] == "loc" and el.text]
+    if kind == "urlset":
+        return locs
+    if kind != "sitemapindex":
+        raise ValueError(f"{location}: expected <urlset> or <sitemapindex>, found <{kind}>")
+    if depth >= MAX_SITEMAP_DEPTH:
+        raise ValueError(f"{location}: sitemap indexes nested more than {MAX_SITEMAP_DEPTH} deep")
+    urls = []
+    for loc in locs:
+        if loc in seen:
+            continue
+        seen.add(loc)
+        urls.extend(_sitemap_urls(_read_sitemap(loc, base_dir, headers), loc, base_dir, headers, seen, depth + 1))
+    return urls
+
+
+def _read_sitemap(loc, base_dir, headers):
+    if loc.startswith(("http://", "https://")):
+        response = requests.get(loc, headers=headers, timeout=30)
+        response.raise_for_status()
+        data = response.content
+    else:
+        with open(os.path.join(base_dir, loc), "rb") as f:
+            data = f.read()
+    # sitemap.xml.gz files are served as-is, not with Content-Encoding
+    return gzip.decompress(data) if data.startswith(b"\x1f\x8b") else data
+
+
+def _unique(urls):
+    seen = set()
+    for url in urls:
+        if url not in seen:
+            seen.add(url)
+            yield url
+
+
+def run_batch(urls, fetch, extract, finish=None,
+              fetch_workers=DEFAULT_FETCH_WORKERS, parse_workers=None, finish_key=None):
+    """Run ``fetch`` -> ``extract`` -> ``finish`` over ``urls``, yielding as pages complete.
+
+    ``fetch(url)`` and ``finish(page)`` do network I/O and run on a thread
+    pool; ``extract(html, url)`` is CPU-bound and runs on a process pool, so
+    it must be a picklable top-level function, or None when ``fetch``
+    already returns the page. Fetches keep going while earlier pages are
+    parsed. A failure in any stage is reported as a BatchResult with
+    ``error`` set and does not stop the batch. A URL listed more than
+    once is processed once. Pages whose ``finish_key(url)`` is the same
+    (e.g. they write the same image folder) are finished one at a time.
+    """
+    parse_workers = parse_workers or os.cpu_count() or 1
+    # Limit pages in flight so queued HTML doesn't pile up in memory
+    max_in_flight = fetch_workers + parse_workers * 2
+    url_iter = _unique(urls)
+    pending = {}
+    # Keys with a finish running, and the pages waiting for them to be free
+    finishing = set()
+    waiting = {}
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=parse_workers) as cpu_pool:
+
+        def submit_next():
+            for url in url_iter:
+                pending[io_pool.submit(fetch, url)] = ("fetch", url)
+                return
+
+        def submit_finish(page, url):
+            key = finish_key(url) if finish_key is not None else None
+            if key is not None:
+                if key in finishing:
+                    waiting.setdefault(key, deque()).append((page, url))
+                    return
+                finishing.add(key)
+            pending[io_pool.submit(finish, page)] = ("finish", url)
+
+        def finished(url):
+            key = finish_key(url) if finish_key is not None else None
+            queued = waiting.get(key)
+            if not queued:
+                finishing.discard(key)
+                return
+            page, next_url = queued.popleft()
+            if not queued:
+                del waiting[key]
+            pending[io_pool.submit(finish, page)] = ("finish", next_url)
+
+        for _ in range(max_in_flight):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, url = pending.pop(future)
+                if stage == "finish":
+                    finished(url)
+                error = future.exception()
+                if error is None and stage == "fetch" and future.result() is None:
+                    error = FetchFailed(f"could not fetch {url}")
+                if error is not None:
+                    yield BatchResult(url, None, error)
+                    submit_next()
+                elif stage == "fetch" and extract is not None:
+                    pending[cpu_pool.submit(extract, future.result(), url)] = ("extract", url)
+                elif stage in ("fetch", "extract") and finish is not None:
+                    submit_finish(future.result(), url)
+                else:
+                    yield BatchResult(url, future.result(), None)
+                    submit_next()
@@ -0,0 +1,78 @@
+"""Compare the single-pass extract_fields() with the per-field scans it replaced.
+
+    python benchmarks/bench_extract.py [--items N] [--repeat R]
+"""
+import argparse
+import time
+
+import common  # noqa: F401 -- puts the repository root on sys.path
+from corpus import build_page
+
+from bs4 import BeautifulSoup
+from extractor import extract_fields
+
+
+def extract_meta(soup, fallback_title):
+    # make.py's extract_meta() before extract_fields() replaced it
+    meta_og = soup.find("meta", property="og:title")
+    meta_name = soup.find("meta", attrs={"name": "title"})
+    meta_desc_tag = soup.find("meta", attrs={"name": "description"})
+    meta_title = (meta_og.get("content") or meta_name.get("content")).strip() if (meta_og or meta_name) else fallback_title
+    meta_description = meta_desc_tag.get("content").strip() if meta_desc_tag else "Meta description not found"
+    return meta_title, meta_description
+
+
+def extract_all_meta(soup):
+    # make-v2.py's extract_all_meta() before extract_fields() replaced it
+    meta_tags = {}
+    for meta in soup.find_all("meta"):
+        key = meta.get("name") or meta.get("property")
+        content = meta.get("content")
+        if key and content:
+            meta_tags[key] = content.strip()
+    return meta_tags
+
+
+def legacy_fields(soup):
+    # What process_url did before: one scan per field
+    h1_tag = soup.find("h1")
+    page_title = h1_tag.get_text(strip=True) if h1_tag and h1_tag.get_text(strip=True) else (
+        soup.title.get_text(strip=True) if soup.title else "Title not found")
+    meta_title, meta_description = extract_meta(soup, page_title)
+    return {
+        "page_title": page_title,
+        "meta_title": meta_title,
+        "meta_description": meta_description,
+        "meta_tags": extract_all_meta(soup),
+        "image_srcs": [img.get("src") for img in soup.find_all("img") if img.get("src")],
+        "links": [a.get("href") for a in soup.find_all("a") if a.get("href") is not None],
+    }
+
+
+def best_of(repeat, func, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'html KB':>9} {'legacy ms':>10} {'single ms':>10} {'speedup':>8}")
+    for items in args.items:
+        html = build_page(items)
+        soup = BeautifulSoup(html, "html.parser")
+        assert legacy_fields(soup) == extract_fields(soup), "extractors disagree"
+        legacy = best_of(args.repeat, legacy_fields, soup)
+        single = best_of(args.repeat, extract_fields, soup)
+        print(f"{items:>8} {len(html) / 1024:>9.0f} {legacy * 1000:>10.1f} {single * 1000:>10.1f} {legacy / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
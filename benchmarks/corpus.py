@@ -0,0 +1,72 @@
+"""Generate the offline benchmark corpus: HTML pages plus the images they use.
+
+    python benchmarks/corpus.py OUTPUT_DIR
+"""
+import argparse
+import os
+import random
+
+# name: (repeated page items, distinct images, bytes per image)
+SIZES = {
+    "small": (20, 5, 20 * 1024),
+    "medium": (400, 40, 60 * 1024),
+    "huge": (5000, 120, 150 * 1024),
+}
+
+_JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def build_page(items, image_count=None):
+    # Shaped like the ellindecoratie.nl CMS pages: big nested menu, product grid, meta tags
+    image_count = image_count or items
+    parts = [
+        "<!DOCTYPE html><html><head><title>Boomstam decoratie</title>",
+        '<meta name="description" content="Boomstam decoratie">',
+        '<meta property="og:title" content="Boomstam decoratie">',
+        '<meta name="keywords" content="boomstam, tafel">',
+        '<meta name="robots" content="INDEX,FOLLOW">',
+        "<style>.product { float: left; }</style>",
+        "</head><body class='cms-index-index'><div class='wrapper'>",
+        "<h1>Boomstam <span>decoratie</span></h1><ul class='nav'>",
+    ]
+    for i in range(items):
+        parts.append(f"<li><a href='/category/{i}'>Category {i}</a><ul><li><a href='/p/{i}'>Item</a></li></ul></li>")
+    parts.append("</ul>")
+    for i in range(items):
+        parts.append(
+            f"<div class='product'><div class='img'><img src='images/img{i % image_count}.jpg' alt=''></div>"
+            f"<p>Product {i} <strong>eiken</strong> &amp; <em>tafel</em></p>\n  <script>track({i});</script></div>"
+        )
+    parts.append("</div></body></html>")
+    return "".join(parts)
+
+
+def write_corpus(root, sizes=SIZES):
+    """Write one page per size and its images under ``root``; return {size: page path}."""
+    rng = random.Random(0)
+    pages = {}
+    for name, (items, image_count, image_bytes) in sizes.items():
+        image_dir = os.path.join(root, name, "images")
+        os.makedirs(image_dir, exist_ok=True)
+        for i in range(image_count):
+            path = os.path.join(image_dir, f"img{i}.jpg")
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(_JPEG_HEADER + rng.randbytes(image_bytes - len(_JPEG_HEADER)))
+        page_path = os.path.join(root, name, "index.html")
+        with open(page_path, "w", encoding="utf-8") as f:
+            f.write(build_page(items, image_count))
+        pages[name] = page_path
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir")
+    args = parser.parse_args()
+    for name, path in write_corpus(args.output_dir).items():
+        print(f"{name}: {path}")
+
+
+if __name__ == "__main__":
+    main()
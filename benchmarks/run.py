@@ -0,0 +1,156 @@
+"""Time every pipeline stage offline, against a generated corpus on a local server.
+
+    python benchmarks/run.py [--sizes small medium huge] [--repeat 3]
+                             [--json results.json] [--compare baseline.json]
+
+Each stage is timed on its own (best of ``--repeat`` runs) and then run once
+more under tracemalloc for its peak memory. ``--compare`` exits with status 1
+if a stage got slower than the baseline by more than ``--tolerance``.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from urllib.parse import urljoin
+
+import common  # noqa: F401 -- puts the repository root on sys.path
+from corpus import SIZES, write_corpus
+from server import serve
+
+import make
+from extractor import extract_fields
+from parsing import DEFAULT_PARSER, PARSERS, make_soup
+
+HEADERS = {"User-Agent": "bench"}
+
+# setup() is untimed and returns the argument for run(); size() is the bytes the stage handled
+Stage = namedtuple("Stage", ["name", "setup", "run", "size"])
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+def build_stages(page_url, webhook_url, html, workdir, parser):
+    page_bytes = len(html.encode("utf-8"))
+    counter = iter(range(1_000_000))
+
+    def fresh_folder():
+        return os.path.join(workdir, f"images_{next(counter)}")
+
+    # One downloaded folder and archive feed the zip and webhook stages
+    image_urls = [urljoin(page_url, src) for src in extract_fields(make_soup(html, parser))["image_srcs"]]
+    images_folder = fresh_folder()
+    with contextlib.redirect_stdout(io.StringIO()):
+        make.save_images(image_urls, HEADERS, images_folder)
+    zip_path = make.zip_images(images_folder)
+
+    def soup():
+        return make_soup(html, parser)
+
+    def fresh_zip():
+        # zip_images only appends changes, so start from no archive to time a full build
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        return images_folder
+
+    def bundle():
+        return {"page_title": "t", "meta_title": "t", "meta_description": "d",
+                "permalink": page_url, "content": html, "zip_file_path": make.zip_images(images_folder)}
+
+    return [
+        Stage("fetch_page", lambda: page_url,
+              lambda url: make.fetch_page(url, HEADERS), lambda: page_bytes),
+        Stage("parse", lambda: html, lambda markup: make_soup(markup, parser), lambda: page_bytes),
+        Stage("extract_fields", soup, extract_fields, lambda: page_bytes),
+        Stage("clean_content", soup, make.clean_content, lambda: page_bytes),
+        Stage("save_images", fresh_folder,
+              lambda folder: make.save_images(image_urls, HEADERS, folder),
+              lambda: folder_size(images_folder)),
+        Stage("zip_images", fresh_zip, make.zip_images, lambda: folder_size(images_folder)),
+        Stage("send_bundle", bundle,
+              lambda b: make.send_bundle(b, webhook_url), lambda: os.path.getsize(zip_path) + page_bytes),
+    ]
+
+
+def measure(stage, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        arg = stage.setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            stage.run(arg)
+            best = min(best, time.perf_counter() - start)
+    arg = stage.setup()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stage.run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["size"], r["stage"]): r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        old = baseline.get((r["size"], r["stage"]))
+        if old and r["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append(f"{r['size']}/{r['stage']}: {old['seconds'] * 1000:.1f} ms -> {r['seconds'] * 1000:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER)
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", metavar="BASELINE", help="results JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = os.path.join(tmp, "corpus")
+        pages = write_corpus(corpus_dir, {name: SIZES[name] for name in args.sizes})
+        with serve(corpus_dir) as base_url:
+            print(f"{'size':<7} {'stage':<17} {'ms':>9} {'MB/s':>9} {'peak MB':>8}")
+            for name, page_path in pages.items():
+                with open(page_path, encoding="utf-8") as f:
+                    html = f.read()
+                workdir = os.path.join(tmp, f"work_{name}")
+                os.makedirs(workdir)
+                stages = build_stages(f"{base_url}/{name}/index.html", f"{base_url}/webhook",
+                                      html, workdir, args.parser)
+                for stage in stages:
+                    seconds, peak = measure(stage, args.repeat)
+                    size = stage.size()
+                    results.append({"size": name, "stage": stage.name, "seconds": seconds,
+                                    "bytes": size, "peak_bytes": peak})
+                    print(f"{name:<7} {stage.name:<17} {seconds * 1000:>9.1f} "
+                          f"{size / seconds / 1e6:>9.1f} {peak / 1e6:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
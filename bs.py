@@ -1,48 +1,48 @@
-import os
+import argparse
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import uuid
-import copy
+from urllib.parse import urljoin
+from downloader import DEFAULT_PER_HOST, DEFAULT_WORKERS, download_images
+from image_store import ImageStore
+from meta_index import add_meta_index_arguments, open_meta_index
+from parsing import make_soup
+from render import write_page, write_site
+from sanitizer import sanitize
+from scheduler import add_scheduler_arguments, open_scheduler
+from thumbnails import Thumbnailer, add_thumbnail_arguments
+from warc import add_warc_arguments, open_session
 
-def fetch_page(url, headers):
-    response = requests.get(url, headers=headers)
+def fetch_page(url, headers, session=None):
+    # session: --record/--replay ile WARC dosyalarına yazan ya da onlardan okuyan oturum
+    response = (session or requests).get(url, headers=headers)
     if response.status_code == 200:
         return response.text
     else:
         print(f"Sayfa çekilemedi. Durum kodu: {response.status_code}")
         return None
 
-def process_images(soup, base_url, images_folder, headers):
+def process_images(soup, base_url, images_folder, headers, session=None,
+                   workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, store=None, thumbnailer=None):
     gallery_images = []  # Galeri için indirilen görsellerin yolunu saklayacağız.
-    if not os.path.exists(images_folder):
-        os.makedirs(images_folder)
-        
-    # Tüm <img> etiketlerini işle: görseli indir, src'yi yerel dosya yoluna güncelle
-    for img in soup.find_all('img'):
-        src = img.get('src')
-        if not src:
-            continue
-        absolute_src = urljoin(base_url, src)
-        try:
-            img_response = requests.get(absolute_src, headers=headers)
-            if img_response.status_code == 200:
-                parsed_url = urlparse(absolute_src)
-                filename = os.path.basename(parsed_url.path)
-                if not filename or '.' not in filename:
-                    filename = f"{uuid.uuid4()}.jpg"
-                local_path = os.path.join(images_folder, filename)
-                with open(local_path, 'wb') as f:
-                    f.write(img_response.content)
-                print(f"İndirildi: {absolute_src} -> {local_path}")
-                # Görsel URL'sini galerimiz için kaydediyoruz
-                gallery_images.append(local_path)
-                # img tag'inin src özniteliğini güncelle (görselin yeni yolu)
-                img['src'] = local_path
-            else:
-                print(f"Resim indirilemedi: {absolute_src} (Status: {img_response.status_code})")
-        except Exception as e:
-            print(f"Resim indirirken hata oluştu: {absolute_src}\nHata: {str(e)}")
+
+    # Tüm <img> etiketlerini işle: görselleri paralel indir, src'yi yerel dosya yoluna güncelle
+    imgs = [img for img in soup.find_all('img') if img.get('src')]
+    urls = [urljoin(base_url, img['src']) for img in imgs]
+    results = download_images(urls, images_folder, session=session, headers=headers,
+                              workers=workers, per_host=per_host, store=store)
+    # Sonuçlar <img> sırasıyla aynı, galeri sırası sabit kalır
+    for img, result in zip(imgs, results):
+        if result.ok:
+            print(f"İndirildi: {result.url} -> {result.path}")
+            # Görsel URL'sini galerimiz için kaydediyoruz
+            gallery_images.append(result.path)
+            # img tag'inin src özniteliğini güncelle (görselin yeni yolu)
+            img['src'] = result.path
+        else:
+            print(f"Resim indirirken hata oluştu: {result.url}\nHata: {result.error}")
+    if thumbnailer is not None and thumbnailer.enabled:
+        # Galeri küçültülmüş kopyaları gösterir; içerikteki img'ler orijinallere bağlı kalır
+        small = thumbnailer.derive_all(results, f"{images_folder}_small")
+        gallery_images = [small[path] for path in gallery_images]
     return gallery_images
 
 def extract_meta_details(soup):
@@ -55,105 +55,32 @@ def extract_meta_details(soup):
                 meta_details[key] = content.strip()
     return meta_details
 
+def index_page(meta_index, page):
+    # meta-title / meta-description scrape_page'in yedek değerleri; indekste yalnızca sayfadaki etiketler yer alır
+    meta_tags = {k: v for k, v in page["meta_details"].items() if k not in ("meta-title", "meta-description")}
+    meta_index.add(page["permalink"], page["page_title"], meta_tags)
+
 def clean_content(soup):
     """
     Body içerisinden yalnızca p, a, ul, ol, li etiketlerini korur.
-    Diğer tüm etiketler unwrap edilerek iç metin korunur.
+    Diğer tüm etiketler unwrap edilmiş gibi atlanır, iç metin korunur.
     Ayrıca, p, a, ul, ol, li etiketlerinin tüm attribute'ları temizlenir.
+    Orijinal ağaç kopyalanmaz ve değiştirilmez; tek geçişte yazılır.
     """
-    allowed_tags = ['p', 'a', 'ul', 'ol', 'li']
-    # Derinlemesine kopyasını alarak orijinal üzerinde oynamayalım.
-    content_soup = copy.deepcopy(soup.body)
-    
-    for tag in content_soup.find_all(True):
-        # Eğer izin verilen etiketler dışındaysa, etiketin kendisini kaldırıp, içeriğini koruruz.
-        if tag.name not in allowed_tags:
-            tag.unwrap()
-        else:
-            # İzin verilen etiketlerdeki tüm attribute'ları temizleyelim.
-            tag.attrs = {}
-    return str(content_soup)
+    return sanitize(soup.body, skip_tags=(), collapse_whitespace=False)
 
 def save_final_html(page_title, meta_details, content_html, gallery_images, permalink, output_filename="final_page.html"):
-    # Galeri için listeyi HTML haline getirelim:
-    gallery_html = "<div class='gallery'><h2>Gallery</h2><ul>"
-    for img_path in gallery_images:
-        gallery_html += f"<li><img src='{img_path}' alt='Görsel'></li>\n"
-    gallery_html += "</ul></div>"
-    
-    html_output = f"""<!DOCTYPE html>
-<html lang="tr">
-<head>
-    <meta charset="UTF-8">
-    <title>{page_title}</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            line-height: 1.6;
-            margin: 20px;
-        }}
-        .meta-info {{
-            background-color: #f4f4f4;
-            padding: 10px;
-            margin-bottom: 20px;
-            border: 1px solid #ddd;
-        }}
-        .meta-info h2 {{
-            margin-top: 0;
-        }}
-        .gallery ul {{
-            list-style-type: none;
-            padding: 0;
-        }}
-        .gallery li {{
-            display: inline-block;
-            margin-right: 10px;
-        }}
-        .gallery img {{
-            max-width: 150px;
-            height: auto;
-        }}
-    </style>
-</head>
-<body>
-    <div class="meta-info">
-        <h2>Meta Bilgileri</h2>
-        <p><strong>Permalink:</strong> <a href="{permalink}">{permalink}</a></p>
-        <ul>
-"""
-    for key, value in meta_details.items():
-        html_output += f"            <li><strong>{key}:</strong> {value}</li>\n"
-    html_output += """        </ul>
-    </div>
-    <div class="page-content">
-"""
-    html_output += content_html
-    html_output += """
-    </div>
-    <!-- Galeri -->
-"""
-    html_output += gallery_html
-    html_output += """
-</body>
-</html>
-"""
-    with open(output_filename, "w", encoding="utf-8") as f:
-        f.write(html_output)
+    # Şablon bir kez derlenir; meta değerleri kaçışlanır ve parçalar doğrudan dosyaya yazılır
+    write_page(output_filename, page_title, meta_details, content_html, gallery_images, permalink)
     print(f"Final HTML dosyası '{output_filename}' olarak kaydedildi.")
 
-def main():
-    url = "https://www.ellindecoratie.nl/"
-    headers = {
-        "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                       "AppleWebKit/537.36 (KHTML, like Gecko) "
-                       "Chrome/87.0.4280.66 Safari/537.36")
-    }
-    
-    html = fetch_page(url, headers)
+def scrape_page(url, headers, images_folder="images", store=None, thumbnailer=None, session=None):
+    """Sayfayı çekip save_final_html / write_site için gereken alanları döndürür."""
+    html = fetch_page(url, headers, session=session)
     if not html:
-        return
+        return None
     
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     
     # Title: Sayfadaki ilk H1 etiketini kullan (varsa), yoksa <title> etiketine fallback
     h1_tag = soup.find('h1')
@@ -175,8 +102,9 @@ def main():
     permalink = url  # Orijinal URL
     
     # Görselleri indir ve güncelle
-    images_folder = "images"
-    gallery_images = process_images(soup, url, images_folder, headers)
+    # Sayfalar arasında ortak görseller (logo vb.) paylaşılan depodan bağlanır
+    gallery_images = process_images(soup, url, images_folder, headers, session=session, store=store,
+                                    thumbnailer=thumbnailer)
     
     # Tüm meta detaylarını çekelim
     meta_details = extract_meta_details(soup)
@@ -186,8 +114,64 @@ def main():
     # İçerik: Body içerisinden yalnızca p, a, ul, ol, li etiketlerini koruyarak temiz içerik elde ediyoruz.
     cleaned_content = clean_content(soup)
     
-    # Final HTML dosyasını kaydet
-    save_final_html(page_title, meta_details, cleaned_content, gallery_images, permalink)
+    return {
+        "page_title": page_title,
+        "meta_details": meta_details,
+        "content_html": cleaned_content,
+        "gallery_images": gallery_images,
+        "permalink": permalink,
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Sayfaları temizlenmiş statik HTML olarak kaydet.")
+    arg_parser.add_argument("urls", nargs="*", default=["https://www.ellindecoratie.nl/"])
+    arg_parser.add_argument("--archive", metavar="ZIP",
+                            help="tüm sayfaları index.html ile tek bir ZIP arşivine yaz")
+    add_thumbnail_arguments(arg_parser)
+    add_warc_arguments(arg_parser)
+    add_scheduler_arguments(arg_parser)
+    add_meta_index_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if len(args.urls) > 1 and not args.archive:
+        arg_parser.error("birden fazla URL için --archive gerekli")
+    headers = {
+        "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                       "AppleWebKit/537.36 (KHTML, like Gecko) "
+                       "Chrome/87.0.4280.66 Safari/537.36")
+    }
+    store = ImageStore()
+    thumbnailer = Thumbnailer(fmt=args.thumbnails, max_size=args.thumbnail_size) if args.thumbnails else None
+    session = open_session(args, headers, scheduler=open_scheduler(args, headers))
+    meta_index = open_meta_index(args)
+    
+    try:
+        if not args.archive:
+            page = scrape_page(args.urls[0], headers, store=store, thumbnailer=thumbnailer, session=session)
+            if page:
+                if meta_index is not None:
+                    index_page(meta_index, page)
+                # Final HTML dosyasını kaydet
+                save_final_html(**page)
+            return
+        
+        # Sayfalar çekildikçe arşive yazılır; her sayfanın görselleri kendi klasörüne iner
+        def pages():
+            for i, url in enumerate(args.urls):
+                page = scrape_page(url, headers, images_folder=f"images/page{i}", store=store,
+                                   thumbnailer=thumbnailer, session=session)
+                if page:
+                    if meta_index is not None:
+                        index_page(meta_index, page)
+                    yield page
+        count = write_site(pages(), args.archive)
+        print(f"{count} sayfa '{args.archive}' arşivine yazıldı.")
+    finally:
+        if thumbnailer is not None:
+            thumbnailer.close()
+        if session is not None:
+            session.close()
+        if meta_index is not None:
+            meta_index.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,203 @@
+import contextlib
+import hashlib
+import os
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_BYTES = 25 * 1024 * 1024
+ALLOWED_CONTENT_TYPES = frozenset([
+    "image/jpeg", "image/png", "image/gif", "image/webp",
+    "image/avif", "image/svg+xml", "image/bmp", "image/x-icon",
+    "image/vnd.microsoft.icon",
+])
+
+# One entry per requested image URL, in the order the URLs were given
+ImageResult = namedtuple("ImageResult", ["url", "path", "ok", "error", "size", "sha256"])
+
+
+class DownloadRejected(Exception):
+    """Raised when a response fails the content-type or size checks."""
+
+
+class NotModified(Exception):
+    """Raised when a conditional request comes back 304 Not Modified."""
+
+
+def make_session(headers=None, pool_size=DEFAULT_WORKERS, adapter=None):
+    # A single pooled session keeps TCP/TLS connections alive between downloads
+    session = requests.Session()
+    adapter = adapter or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def session_scheduler(session):
+    """The scheduler.HostScheduler that paces ``session``'s requests, or None."""
+    return getattr(session.get_adapter("http://"), "scheduler", None)
+
+
+class HostLimiter:
+    """Caps the number of simultaneous connections per host; ``per_host=None`` doesn't."""
+
+    def __init__(self, per_host=DEFAULT_PER_HOST):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def slot(self, url):
+        if self.per_host is None:
+            return contextlib.nullcontext()
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._slots.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._slots[host] = semaphore
+        return semaphore
+
+
+def local_filename(url, taken):
+    filename = os.path.basename(urlparse(url).path)
+    if not filename or '.' not in filename:
+        filename = f"{uuid.uuid4()}.jpg"
+    # Two different URLs can share a basename; keep both files instead of racing
+    stem, ext = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while candidate in taken:
+        candidate = f"{stem}-{n}{ext}"
+        n += 1
+    taken.add(candidate)
+    return candidate
+
+
+def fetch_image(session, url, local_path, headers=None, timeout=30,
+                max_bytes=MAX_IMAGE_BYTES, allowed_types=ALLOWED_CONTENT_TYPES,
+                chunk_size=CHUNK_SIZE, state=None, conditional=True):
+    """Stream ``url`` to ``local_path`` and return ``(size, sha256 hexdigest)``.
+
+    The headers are checked before any of the body is read; the body is
+    written chunk by chunk so memory use does not depend on the image size.
+    With a fetch_state.FetchState as ``state`` the new validators are
+    recorded and, if ``conditional``, the request is conditional and
+    NotModified is raised on a 304.
+    """
+    if state is not None and conditional:
+        headers = {**(headers or {}), **state.conditional_headers(url)}
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as img_response:
+        if img_response.status_code == 304:
+            raise NotModified(url)
+        img_response.raise_for_status()
+        content_type = img_response.headers.get("Content-Type", "")
+        content_type = content_type.split(";")[0].strip().lower()
+        if allowed_types is not None and content_type not in allowed_types:
+            raise DownloadRejected(f"content type {content_type or 'missing'!r} not allowed")
+        length = img_response.headers.get("Content-Length", "")
+        if max_bytes and length.isdigit() and int(length) > max_bytes:
+            raise DownloadRejected(f"{length} bytes exceeds limit of {max_bytes}")
+
+        digest = hashlib.sha256()
+        size = 0
+        # Write to a temporary name so a failed download never leaves a truncated image
+        part_path = local_path + ".part"
+        try:
+            with open(part_path, 'wb') as f:
+                for chunk in img_response.iter_content(chunk_size):
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise DownloadRejected(f"body exceeds limit of {max_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.replace(part_path, local_path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+    if state is not None:
+        state.record(url, img_response.headers, digest.hexdigest())
+    return size, digest.hexdigest()
+
+
+def download_images(urls, images_folder, session=None, headers=None,
+                    workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                    timeout=30, max_bytes=MAX_IMAGE_BYTES,
+                    allowed_types=ALLOWED_CONTENT_TYPES, chunk_size=CHUNK_SIZE,
+                    store=None, on_result=None, state=None):
+    """Download ``urls`` into ``images_folder`` concurrently.
+
+    Returns a list of ImageResult aligned with ``urls``. Duplicate URLs are
+    fetched once and each body is streamed to disk with the checks described
+    in fetch_image(). With an image_store.ImageStore as ``store`` the bytes
+    are fetched into the shared store (or reused from it) and hard-linked
+    into ``images_folder``. ``on_result`` is called from the calling thread
+    as each download finishes. With a fetch_state.FetchState as ``state``
+    images already on disk are revalidated with a conditional request
+    instead of being trusted or downloaded again. When ``session`` is
+    paced by a scheduler.HostScheduler the scheduler decides how many
+    requests each host gets: ``per_host`` is ignored and ``workers`` is
+    raised to the scheduler's maximum.
+    """
+    if not os.path.exists(images_folder):
+        os.makedirs(images_folder)
+    if session is None:
+        session = make_session(headers, pool_size=workers)
+    scheduler = session_scheduler(session)
+    if scheduler is not None:
+        # A fixed cap would keep the scheduler from ever growing a host past it
+        per_host = None
+        workers = max(workers, scheduler.max_per_host)
+    limiter = HostLimiter(per_host)
+
+    taken = set()
+    paths = {}
+    for url in urls:
+        if url not in paths:
+            paths[url] = os.path.join(images_folder, local_filename(url, taken))
+
+    fetch_kwargs = dict(headers=headers, timeout=timeout, max_bytes=max_bytes,
+                        allowed_types=allowed_types, chunk_size=chunk_size)
+
+    def download(url):
+        if store is not None:
+            known = store.lookup(url)
+            if known is None or state is not None:
+                with limiter.slot(url):
+                    known = store.fetch(session, url, state=state, **fetch_kwargs)
+            sha256, size = known
+            store.link(sha256, paths[url])
+            return size, sha256
+        path = paths[url]
+        # Only ask for a 304 when the previous copy is still here to fall back on
+        known = state.get(url) if state is not None and os.path.exists(path) else None
+        with limiter.slot(url):
+            try:
+                return fetch_image(session, url, path, state=state, conditional=bool(known), **fetch_kwargs)
+            except NotModified:
+                return os.path.getsize(path), known[2]
+
+    done = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(download, url): url for url in paths}
+        for future in as_completed(futures):
+            url = futures[future]
+            error = future.exception()
+            if error is None:
+                size, sha256 = future.result()
+                result = ImageResult(url, paths[url], True, None, size, sha256)
+            else:
+                result = ImageResult(url, None, False, error, 0, None)
+            done[url] = result
+            if on_result is not None:
+                on_result(result)
+    return [done[url] for url in urls]
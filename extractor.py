@@ -0,0 +1,76 @@
+def extract_fields(soup, fallback_title="Title not found",
+                   fallback_description="Meta description not found"):
+    """Collect the page fields used by process_url in a single walk over ``soup``.
+
+    Replaces the separate find("h1"), soup.title, extract_meta(),
+    extract_all_meta() and find_all("img") scans with the same results:
+    page_title, meta_title, meta_description, meta_tags, plus the raw
+    ``image_srcs`` and ``links`` (href values) in document order. Pages
+    those scans raised AttributeError on (a name="title" meta without an
+    og:title, a description meta without content) get the page title and
+    an empty description instead.
+    """
+    title_tag = h1_tag = og_title = name_title = description = None
+    meta_tags = {}
+    image_srcs = []
+    links = []
+
+    for node in soup.descendants:
+        name = node.name
+        if name is None:
+            # Text, comments and other strings
+            continue
+        if name == "meta":
+            attrs = node.attrs
+            meta_name = attrs.get("name")
+            meta_property = attrs.get("property")
+            if og_title is None and meta_property == "og:title":
+                og_title = node
+            if meta_name == "title" and name_title is None:
+                name_title = node
+            elif meta_name == "description" and description is None:
+                description = node
+            key = meta_name or meta_property
+            content = attrs.get("content")
+            if key and content:
+                meta_tags[key] = content.strip()
+        elif name == "img":
+            src = node.attrs.get("src")
+            if src:
+                image_srcs.append(src)
+        elif name == "a":
+            href = node.attrs.get("href")
+            if href is not None:
+                links.append(href)
+        elif name == "h1":
+            if h1_tag is None:
+                h1_tag = node
+        elif name == "title":
+            if title_tag is None:
+                title_tag = node
+
+    # Page Title: Use first <h1> if it has text; otherwise, use <title>
+    page_title = h1_tag.get_text(strip=True) if h1_tag is not None else ""
+    if not page_title:
+        page_title = title_tag.get_text(strip=True) if title_tag is not None else fallback_title
+
+    # As extract_meta() did: an og:title with any content wins, even if it strips to "";
+    # name="title" is only used when og:title has none. The cases extract_meta() crashed
+    # on (no og:title, or neither tag with a content attribute) fall back to the page title
+    og_content = og_title.get("content") if og_title is not None else None
+    meta_title = og_content or (name_title.get("content") if name_title is not None else None)
+    meta_title = meta_title.strip() if meta_title is not None else page_title
+
+    if description is not None:
+        meta_description = (description.get("content") or "").strip()
+    else:
+        meta_description = fallback_description
+
+    return {
+        "page_title": page_title,
+        "meta_title": meta_title,
+        "meta_description": meta_description,
+        "meta_tags": meta_tags,
+        "image_srcs": image_srcs,
+        "links": links,
+    }
@@ -0,0 +1,92 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_STATE_PATH = "fetch_state.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    sha256 TEXT NOT NULL,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+class PageUnchanged(Exception):
+    """Raised by fetch_page when the page is the same as on the last finished run."""
+
+
+class FetchState:
+    """ETag, Last-Modified and content hash of every page and image URL fetched.
+
+    Images are recorded as soon as they are stored. Pages are only staged
+    when fetched and written by commit() once the page made it all the way
+    to the webhook, so a page that failed halfway is processed again on the
+    next run instead of being skipped as unchanged.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, url):
+        """Return ``(etag, last_modified, sha256)`` for ``url``, or None."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT etag, last_modified, sha256 FROM resources WHERE url = ?", (url,)).fetchone()
+
+    def conditional_headers(self, url):
+        row = self.get(url)
+        headers = {}
+        if row:
+            if row[0]:
+                headers["If-None-Match"] = row[0]
+            if row[1]:
+                headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def record(self, url, response_headers, sha256):
+        self._write(url, *_validators(response_headers), sha256)
+
+    def stage(self, url, response_headers, sha256):
+        # Only the validators are kept: a plain dict copy of the headers would lose
+        # their case-insensitivity and miss an "etag" or "last-modified" header
+        with self._lock:
+            self._pending[url] = (*_validators(response_headers), sha256)
+
+    def commit(self, url):
+        with self._lock:
+            pending = self._pending.pop(url, None)
+        if pending is not None:
+            self._write(url, *pending)
+
+    def _write(self, url, etag, last_modified, sha256):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO resources (url, etag, last_modified, sha256, checked_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, sha256, time.time()),
+            )
+
+
+def _validators(headers):
+    # Header names are case-insensitive, but plain dicts (aiohttp copies, WARC records) are not
+    headers = CaseInsensitiveDict(headers)
+    return headers.get("ETag"), headers.get("Last-Modified")
+
+
+def content_sha256(data):
+    return hashlib.sha256(data).hexdigest()
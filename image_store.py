@@ -0,0 +1,105 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from downloader import NotModified, fetch_image
+
+DEFAULT_STORE_ROOT = ".image_store"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_sha256 ON urls (sha256);
+"""
+
+
+class ImageStore:
+    """Content-addressed image blobs shared by every scraped page.
+
+    Blobs live under ``objects/<first two hex chars>/<sha256>`` and an SQLite
+    index maps each source URL to the hash of the bytes it served. Page
+    folders get hard links to the blobs, so an image shared by many pages is
+    downloaded and stored once.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_ROOT):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        # Downloads run on a thread pool, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def lookup(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT sha256, size FROM urls WHERE url = ?", (url,)).fetchone()
+        if row and os.path.exists(self.blob_path(row[0])):
+            return row
+        return None
+
+    def record(self, url, sha256, size):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256, size, fetched_at) VALUES (?, ?, ?, ?)",
+                (url, sha256, size, time.time()),
+            )
+
+    def fetch(self, session, url, state=None, **fetch_kwargs):
+        """Return ``(sha256, size)`` for ``url``, downloading it only if unknown.
+
+        With a fetch_state.FetchState as ``state`` a known URL is revalidated
+        with a conditional request and downloaded again only if it changed.
+        """
+        known = self.lookup(url)
+        if known and state is None:
+            return known
+        tmp_path = self.temp_path()
+        try:
+            size, sha256 = fetch_image(session, url, tmp_path, state=state, conditional=bool(known),
+                                       **fetch_kwargs)
+        except NotModified:
+            return known
+        return self.add_file(url, tmp_path, sha256, size)
+
+    def temp_path(self):
+        return os.path.join(self.root, "tmp", uuid.uuid4().hex)
+
+    def add_file(self, url, tmp_path, sha256, size):
+        """Move a finished download of ``url`` at ``tmp_path`` into the store."""
+        blob = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if os.path.exists(blob):
+            # Same bytes already stored under another URL
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, blob)
+        self.record(url, sha256, size)
+        return sha256, size
+
+    def link(self, sha256, dest_path):
+        """Hard-link the blob to ``dest_path``, copying if links are unsupported."""
+        blob = self.blob_path(sha256)
+        if os.path.exists(dest_path):
+            if os.path.samefile(blob, dest_path):
+                return dest_path
+            os.remove(dest_path)
+        try:
+            os.link(blob, dest_path)
+        except OSError:
+            shutil.copyfile(blob, dest_path)
+        return dest_path
@@ -0,0 +1,164 @@
+import glob
+import gzip
+import io
+import json
+import os
+import re
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .zst output
+    zstandard = None
+
+DEFAULT_OUTPUT = "output.jsonl"
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+# How a compressed file left unfinished by a crash ends when read back
+TRUNCATED_ERRORS = (EOFError, zstandard.ZstdError) if zstandard is not None else (EOFError,)
+
+
+def _split(path):
+    """Split ``out/pages.jsonl.gz`` into ``("out/pages", ".jsonl.gz")``."""
+    compressed = ""
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(suffix):
+            compressed = suffix
+            path = path[:-len(suffix)]
+    stem, ext = os.path.splitext(path)
+    return stem, ext + compressed
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstd output needs the 'zstandard' package (pip install zstandard)")
+
+
+def _open_append(path):
+    # Only plain files are ever appended to: JsonlWriter starts a new part instead of
+    # adding to an existing .gz or .zst file, whose last member may have been cut off
+    if path.endswith(".gz"):
+        return gzip.open(path, "ab")
+    if path.endswith(".zst"):
+        _require_zstandard()
+        return zstandard.ZstdCompressor().stream_writer(open(path, "ab"), closefd=True)
+    return open(path, "ab")
+
+
+def _open_read(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        _require_zstandard()
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                         closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def part_paths(path):
+    """Return the files that make up ``path``: itself and/or its rotated parts, in order."""
+    stem, ext = _split(path)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"-(\d{5})" + re.escape(ext) + "$")
+    parts = []
+    for candidate in glob.glob(f"{glob.escape(stem)}-*{glob.escape(ext)}"):
+        match = pattern.match(os.path.basename(candidate))
+        if match:
+            parts.append((int(match.group(1)), candidate))
+    paths = [path] if os.path.exists(path) else []
+    return paths + [candidate for _, candidate in sorted(parts)]
+
+
+class JsonlWriter:
+    """Append-only JSON Lines file, one record per line, flushed after every record.
+
+    The compression follows the file name: ``.gz`` for gzip, ``.zst`` for zstd
+    (needs the optional ``zstandard`` package). With ``max_bytes`` the output
+    is split into ``<stem>-00001<ext>``, ``<stem>-00002<ext>``, ... parts that
+    each hold about ``max_bytes`` of uncompressed JSON; a new run continues
+    the last part if it is plain text. Records already written survive a
+    crash mid-run.
+
+    A compressed file killed mid-run ends in a cut-off member, and anything
+    appended after it could not be read back. So a compressed file is never
+    reopened: a run that finds ``path`` (or the last part) already there
+    writes to the next numbered part, and read_records() reads the records
+    of a cut-off part up to the point where it ends.
+    """
+
+    def __init__(self, path=DEFAULT_OUTPUT, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._written = 0
+        self._part = 0
+        existing = part_paths(path)
+        stem, ext = _split(path)
+        last = existing[-1] if existing and existing[-1] != path else None
+        if max_bytes:
+            self._part = int(last[len(stem) + 1:len(stem) + 6]) if last else 1
+            # Compressed parts are never reopened; plain ones are topped up
+            if last and not last.endswith(COMPRESSED_SUFFIXES):
+                self._written = os.path.getsize(last)
+            elif last:
+                self._part += 1
+        elif existing and path.endswith(COMPRESSED_SUFFIXES):
+            self._part = int(last[len(stem) + 1:len(stem) + 6]) + 1 if last else 1
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def current_path(self):
+        if not self._part:
+            return self.path
+        stem, ext = _split(self.path)
+        return f"{stem}-{self._part:05d}{ext}"
+
+    def _open(self):
+        directory = os.path.dirname(self.current_path())
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = _open_append(self.current_path())
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.max_bytes and self._written and self._written + len(line) > self.max_bytes:
+            self._file.close()
+            self._part += 1
+            self._written = 0
+            self._open()
+        self._file.write(line)
+        self._file.flush()
+        self._written += len(line)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_records(path):
+    """Yield the records written to ``path`` (all rotated parts, in order) one at a time."""
+    for part in part_paths(path):
+        with _open_read(part) as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except TRUNCATED_ERRORS:
+                # Cut off by a crash; every record flushed before it was read
+                continue
+
+
+def add_output_arguments(arg_parser):
+    arg_parser.add_argument("--output", default=DEFAULT_OUTPUT, metavar="FILE",
+                            help="append one JSON line per page to FILE (.gz or .zst to compress)")
+    arg_parser.add_argument("--output-max-mb", type=float, metavar="MB",
+                            help="start a new numbered output file every MB of JSON")
+
+
+def open_output(args):
+    max_bytes = int(args.output_max_mb * 1024 * 1024) if args.output_max_mb else None
+    return JsonlWriter(args.output, max_bytes=max_bytes)
@@ -1,17 +1,32 @@
+import argparse
+import functools
+import hashlib
 import os
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-import uuid
-import copy
-import re
 import json
-import shutil
+from archive import ImageArchive
+from batch import DEFAULT_FETCH_WORKERS, read_url_list, run_batch
+from downloader import DEFAULT_PER_HOST, DEFAULT_WORKERS, download_images
+from extractor import extract_fields
+from image_store import ImageStore
+from jsonl import add_output_arguments, open_output
+from meta_index import add_meta_index_arguments, open_meta_index
+from metrics import NULL_METRICS, add_metrics_arguments, metrics_session
+from parsing import DEFAULT_PARSER, PARSERS, make_soup
+from sanitizer import sanitize
+from scheduler import add_scheduler_arguments, open_scheduler, scheduled_session
 
-def fetch_page(url, headers):
+# Properties per webhook request with --upload-zip-once. Raise it once the receiving
+# scenario accepts the {"properties": [...]} form
+PROPERTIES_PER_REQUEST = 1
+
+def fetch_page(url, headers, metrics=NULL_METRICS, session=None):
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
+        with metrics.stage("fetch", url):
+            response = (session or requests).get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+        metrics.incr("bytes_total", len(response.content), direction="download", kind="page")
         return response.text
     except Exception as e:
         return None
@@ -24,124 +39,251 @@ def get_image_folder(base_url):
     else:
         return f"{parsed_url.netloc}_images"
 
-def process_images(soup, base_url, headers, images_folder):
-    if not os.path.exists(images_folder):
-        os.makedirs(images_folder)
-    for img in soup.find_all('img'):
-        src = img.get('src')
-        if not src:
-            continue
-        absolute_src = urljoin(base_url, src)
-        try:
-            img_response = requests.get(absolute_src, headers=headers, timeout=30)
-            img_response.raise_for_status()
-            filename = os.path.basename(urlparse(absolute_src).path)
-            if not filename or '.' not in filename:
-                filename = f"{uuid.uuid4()}.jpg"
-            local_path = os.path.join(images_folder, filename)
-            with open(local_path, 'wb') as f:
-                f.write(img_response.content)
-            img['src'] = local_path
-        except Exception as e:
-            continue
-    return soup
-
-def extract_meta(soup, fallback_title):
-    meta_og = soup.find("meta", property="og:title")
-    meta_name = soup.find("meta", attrs={"name": "title"})
-    meta_desc_tag = soup.find("meta", attrs={"name": "description"})
-    meta_title = (meta_og.get("content") or meta_name.get("content")).strip() if (meta_og or meta_name) else fallback_title
-    meta_description = meta_desc_tag.get("content").strip() if meta_desc_tag else "Meta description not found"
-    return meta_title, meta_description
-
-def extract_all_meta(soup):
-    meta_tags = {}
-    for meta in soup.find_all("meta"):
-        key = meta.get("name") or meta.get("property")
-        content = meta.get("content")
-        if key and content:
-            meta_tags[key] = content.strip()
-    return meta_tags
+def save_images(image_urls, headers, images_folder, session=None,
+                workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, store=None,
+                metrics=NULL_METRICS, on_result=None):
+    results = download_images(image_urls, images_folder, session=session, headers=headers,
+                              workers=workers, per_host=per_host, store=store,
+                              on_result=on_result)
+    counted = set()
+    for result in results:
+        if result.ok:
+            metrics.incr("images_total", result="ok")
+            # The same image can appear many times on a page but is downloaded once
+            if result.url not in counted:
+                counted.add(result.url)
+                metrics.incr("bytes_total", result.size, direction="download", kind="image")
+        else:
+            metrics.incr("images_total", result="failed")
+            metrics.incr("errors_total", stage="images")
+            print(f"Image failed: {result.url} ({result.error})")
+    return results
 
 def clean_content(soup):
-    for unwanted in soup(['script', 'style']):
-        unwanted.decompose()
-    allowed_tags = ["p", "a", "ul", "ol", "li"]
-    content_soup = copy.deepcopy(soup.body or soup)
-    for tag in content_soup.find_all(True):
-        if tag.name not in allowed_tags:
-            tag.unwrap()
-        else:
-            tag.attrs = {}
-    content_str = re.sub(r'\s+', ' ', str(content_soup)).strip()
-    return content_str
+    return sanitize(soup.body or soup)
 
-def zip_images(images_folder):
-    shutil.make_archive(images_folder, 'zip', images_folder)
+def zip_images(images_folder, archive=None):
+    if archive is not None:
+        archive.sync(images_folder)
+        return f"{images_folder}.zip"
+    with ImageArchive(f"{images_folder}.zip") as archive:
+        archive.sync(images_folder)
     return f"{images_folder}.zip"
 
-def process_url(url, headers):
-    html = fetch_page(url, headers)
-    if not html:
-        return None
-    soup = BeautifulSoup(html, "html.parser")
-    h1_tag = soup.find("h1")
-    page_title = h1_tag.get_text(strip=True) if h1_tag and h1_tag.get_text(strip=True) else (soup.title.get_text(strip=True) if soup.title else "Title not found")
-    meta_title, meta_description = extract_meta(soup, page_title)
-    meta_tags = extract_all_meta(soup)
-    permalink = url
-    images_folder = get_image_folder(url)
-    soup = process_images(soup, url, headers, images_folder)
-    content = clean_content(soup)
-    zip_file_path = zip_images(images_folder)
+def extract_page(html, url, parser=None, metrics=NULL_METRICS):
+    with metrics.stage("parse", url):
+        soup = make_soup(html, parser)
+    with metrics.stage("extract", url):
+        fields = extract_fields(soup)
+        image_urls = [urljoin(url, src) for src in fields["image_srcs"]]
+    with metrics.stage("clean", url):
+        content = clean_content(soup)
     return {
-        "page_title": page_title,
-        "meta_title": meta_title,
-        "meta_description": meta_description,
-        "meta_tags": meta_tags,
-        "permalink": permalink,
+        "page_title": fields["page_title"],
+        "meta_title": fields["meta_title"],
+        "meta_description": fields["meta_description"],
+        "meta_tags": fields["meta_tags"],
+        "permalink": url,
         "content": content,
-        "zip_file_path": zip_file_path
+        "image_urls": image_urls
     }
 
-def send_property_with_zip(prop_name, prop_value, zip_file_path, webhook_url):
-    payload = {"property": prop_name, "value": prop_value}
+def finish_page(page, headers, store=None, metrics=NULL_METRICS, session=None):
+    image_urls = page.pop("image_urls")
+    url = page["permalink"]
+    images_folder = get_image_folder(url)
+    with ImageArchive(f"{images_folder}.zip") as archive:
+        def add_to_archive(result):
+            if result.ok:
+                archive.add(result.path)
+        with metrics.stage("images", url):
+            save_images(image_urls, headers, images_folder, session=session, store=store, metrics=metrics,
+                        on_result=add_to_archive)
+        with metrics.stage("zip", url):
+            page["zip_file_path"] = zip_images(images_folder, archive)
+    return page
+
+def process_url(url, headers, store=None, parser=None, metrics=NULL_METRICS, session=None):
+    html = fetch_page(url, headers, metrics=metrics, session=session)
+    if not html:
+        return None
+    page = extract_page(html, url, parser, metrics=metrics)
+    return finish_page(page, headers, store=store, metrics=metrics, session=session)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def post_multipart(webhook_url, files, kind, metrics=NULL_METRICS, session=None):
     try:
-        with open(zip_file_path, "rb") as f_zip:
-            files = {
-                "data": (None, json.dumps(payload, ensure_ascii=False), "application/json"),
-                "zip_file": (os.path.basename(zip_file_path), f_zip, "application/zip")
-            }
-            requests.post(webhook_url, files=files, timeout=30)
+        with metrics.stage("webhook"):
+            response = (session or requests).post(webhook_url, files=files, timeout=30)
+        metrics.incr("bytes_total", len(response.request.body or b""), direction="upload", kind=kind)
+        if response.ok:
+            return True
     except Exception as e:
         pass
+    metrics.incr("errors_total", stage="webhook")
+    return False
+
+def send_property_with_zip(prop_name, prop_value, zip_file_path, webhook_url, metrics=NULL_METRICS, session=None):
+    payload = {"property": prop_name, "value": prop_value}
+    with open(zip_file_path, "rb") as f_zip:
+        files = {
+            "data": (None, json.dumps(payload, ensure_ascii=False), "application/json"),
+            "zip_file": (os.path.basename(zip_file_path), f_zip, "application/zip")
+        }
+        return post_multipart(webhook_url, files, "property", metrics=metrics, session=session)
+
+def upload_zip_once(zip_file_path, webhook_url, uploaded=None, metrics=NULL_METRICS, session=None):
+    # The receiver stores the archive under its sha256; properties then only carry the hash
+    zip_sha256 = file_sha256(zip_file_path)
+    if uploaded is not None and zip_sha256 in uploaded:
+        return zip_sha256
+    payload = {"zip_sha256": zip_sha256}
+    with open(zip_file_path, "rb") as f_zip:
+        files = {
+            "data": (None, json.dumps(payload), "application/json"),
+            "zip_file": (os.path.basename(zip_file_path), f_zip, "application/zip")
+        }
+        if not post_multipart(webhook_url, files, "zip", metrics=metrics, session=session):
+            return None
+    if uploaded is not None:
+        uploaded.add(zip_sha256)
+    return zip_sha256
 
-def send_all_properties(bundle, webhook_url):
+def send_properties(properties, zip_sha256, webhook_url, metrics=NULL_METRICS, session=None):
+    if len(properties) == 1:
+        (prop_name, prop_value), = properties
+        payload = {"property": prop_name, "value": prop_value, "zip_sha256": zip_sha256}
+    else:
+        payload = {
+            "properties": [{"property": k, "value": v} for k, v in properties],
+            "zip_sha256": zip_sha256
+        }
+    files = {"data": (None, json.dumps(payload, ensure_ascii=False), "application/json")}
+    return post_multipart(webhook_url, files, "property", metrics=metrics, session=session)
+
+def send_all_properties(bundle, webhook_url, metrics=NULL_METRICS, zip_once=False,
+                        per_request=PROPERTIES_PER_REQUEST, uploaded=None, session=None):
+    # By default every property request carries the ZIP, the form the receiving scenario
+    # is built for. zip_once uploads it once and sends properties with its sha256 instead
     zip_file_path = bundle.pop("zip_file_path")
-    for key, value in bundle.items():
-        send_property_with_zip(key, value, zip_file_path, webhook_url)
+    with metrics.stage("send_all_properties", bundle.get("permalink")):
+        if not zip_once:
+            for key, value in bundle.items():
+                send_property_with_zip(key, value, zip_file_path, webhook_url, metrics=metrics, session=session)
+            return
+        zip_sha256 = upload_zip_once(zip_file_path, webhook_url, uploaded, metrics=metrics, session=session)
+        if zip_sha256 is None:
+            print(f"ZIP upload failed: {zip_file_path}")
+            return
+        items = list(bundle.items())
+        for i in range(0, len(items), per_request):
+            send_properties(items[i:i + per_request], zip_sha256, webhook_url, metrics=metrics, session=session)
+
+def index_page(meta_index, page):
+    meta_index.add(page["permalink"], page["page_title"], page["meta_tags"])
+
+def run_batch_mode(urls, headers, webhook_url, store=None, workers=DEFAULT_FETCH_WORKERS,
+                   parser=None, metrics=NULL_METRICS, zip_once=False, per_request=PROPERTIES_PER_REQUEST,
+                   output=None, session=None, webhook_session=None, meta_index=None):
+    fetch = functools.partial(fetch_page, headers=headers, metrics=metrics, session=session)
+    extract = functools.partial(extract_page, parser=parser)
+    finish = functools.partial(finish_page, headers=headers, store=store, metrics=metrics, session=session)
+    uploaded = set()
+    # Pages sharing an image folder (and its ZIP) are finished one after another
+    for result in run_batch(urls, fetch, extract, finish, fetch_workers=workers,
+                            finish_key=get_image_folder):
+        if result.error is not None:
+            metrics.incr("errors_total", stage="batch")
+            print(f"Failed: {result.url} ({result.error})")
+            continue
+        if output is not None:
+            output.write({k: v for k, v in result.result.items() if k != "zip_file_path"})
+        if meta_index is not None:
+            index_page(meta_index, result.result)
+        send_all_properties(result.result, webhook_url, metrics=metrics, zip_once=zip_once,
+                            per_request=per_request, uploaded=uploaded, session=webhook_session)
+
+def run_single(url, headers, webhook_url, store=None, parser=None, metrics=NULL_METRICS,
+               zip_once=False, per_request=PROPERTIES_PER_REQUEST, output=None, session=None,
+               webhook_session=None, meta_index=None):
+    bundle_data = process_url(url, headers, store=store, parser=parser, metrics=metrics, session=session)
+    if not bundle_data:
+        return
+    if meta_index is not None:
+        index_page(meta_index, bundle_data)
+    # (Optional) Append backup without zip_file_path
+    try:
+        if output is not None:
+            output.write({k: v for k, v in bundle_data.items() if k != "zip_file_path"})
+    except Exception as e:
+        pass
+    # Upload the ZIP once, then send the properties with a reference to it
+    send_all_properties(bundle_data, webhook_url, metrics=metrics, zip_once=zip_once, per_request=per_request,
+                        session=webhook_session)
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 def main():
-    url = "https://www.ellindecoratie.nl"
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("url", nargs="?", default="https://www.ellindecoratie.nl")
+    arg_parser.add_argument("--batch", metavar="FILE", help="URL list (one per line) or sitemap.xml")
+    arg_parser.add_argument("--workers", type=int, default=DEFAULT_FETCH_WORKERS)
+    arg_parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER)
+    arg_parser.add_argument("--upload-zip-once", action="store_true",
+                            help="upload each ZIP once and send properties with its sha256 instead of the file "
+                                 "(the receiving scenario must support it)")
+    arg_parser.add_argument("--properties-per-request", type=positive_int, default=PROPERTIES_PER_REQUEST,
+                            help="properties grouped into one webhook request (with --upload-zip-once)")
+    add_scheduler_arguments(arg_parser)
+    add_output_arguments(arg_parser)
+    add_metrics_arguments(arg_parser)
+    add_meta_index_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if args.properties_per_request > 1 and not args.upload_zip_once:
+        arg_parser.error("--properties-per-request needs --upload-zip-once")
     webhook_url = "https://hook.eu2.make.com/is1dhkyhge8iuqg4jsxykh6dkyaejawy"
     headers = {
         "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                        "AppleWebKit/537.36 (KHTML, like Gecko) "
                        "Chrome/87.0.4280.66 Safari/537.36")
     }
-    bundle_data = process_url(url, headers)
-    if not bundle_data:
-        return
-    # (Optional) Save backup without zip_file_path
-    output_file = "output.json"
-    try:
-        backup_data = {k: v for k, v in bundle_data.items() if k != "zip_file_path"}
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        pass
-    # Send each property (with the same ZIP file) separately
-    send_all_properties(bundle_data, webhook_url)
+    store = ImageStore()
+    meta_index = open_meta_index(args)
+    with metrics_session(args.metrics_log, args.metrics_prom) as metrics, open_output(args) as output:
+        # Pages, images and webhook requests share one per-host scheduler
+        scheduler = open_scheduler(args, headers, metrics=metrics)
+        session = webhook_session = None
+        if scheduler is not None:
+            session = scheduled_session(scheduler, headers, pool_size=max(args.workers, DEFAULT_WORKERS))
+            webhook_session = scheduled_session(scheduler, pool_size=2)
+        try:
+            if args.batch:
+                run_batch_mode(read_url_list(args.batch, headers), headers, webhook_url, store=store,
+                               workers=args.workers, parser=args.parser, metrics=metrics,
+                               zip_once=args.upload_zip_once, per_request=args.properties_per_request,
+                               output=output, session=session, webhook_session=webhook_session,
+                               meta_index=meta_index)
+            else:
+                run_single(args.url, headers, webhook_url, store=store, parser=args.parser,
+                           metrics=metrics, zip_once=args.upload_zip_once,
+                           per_request=args.properties_per_request, output=output,
+                           session=session, webhook_session=webhook_session, meta_index=meta_index)
+        finally:
+            if session is not None:
+                session.close()
+                webhook_session.close()
+            if meta_index is not None:
+                meta_index.close()
     print("Process complete.")
 
 if __name__ == "__main__":
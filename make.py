@@ -1,21 +1,84 @@
+import argparse
+import asyncio
+import collections
+import functools
 import os
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-import uuid
-import copy
-import re
-import json
-import shutil
+from archive import ImageArchive
+from async_http import AsyncHttp
+from batch import DEFAULT_FETCH_WORKERS, read_url_list, run_batch
+from downloader import DEFAULT_PER_HOST, DEFAULT_WORKERS, download_images
+from extractor import extract_fields
+from fetch_state import DEFAULT_STATE_PATH, FetchState, PageUnchanged, content_sha256
+from image_store import ImageStore
+from jsonl import add_output_arguments, open_output
+from metrics import NULL_METRICS, add_metrics_arguments, metrics_session
+from outbox import DEFAULT_OUTBOX, DeliveryWorker, Outbox
+from parsing import DEFAULT_PARSER, PARSERS, make_soup
+from pipeline import Stage, run_pipeline
+from sanitizer import sanitize
+from scheduler import add_scheduler_arguments, open_scheduler, scheduled_session
+from streaming import DEFAULT_MAX_PAGE_BYTES, stream_page
+from thumbnails import Thumbnailer, add_thumbnail_arguments
+from warc import add_warc_arguments, open_session
 
-def fetch_page(url, headers):
+# Text fields of a bundle, each sent as its own multipart field next to the ZIP
+BUNDLE_FIELDS = ("page_title", "meta_title", "meta_description", "permalink", "content")
+
+WEBHOOK_URL = "https://hook.eu2.make.com/is1dhkyhge8iuqg4jsxykh6dkyaejawy"
+
+HEADERS = {
+    "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                   "AppleWebKit/537.36 (KHTML, like Gecko) "
+                   "Chrome/87.0.4280.66 Safari/537.36")
+}
+
+def fetch_page(url, headers, metrics=NULL_METRICS, state=None, session=None):
+    # With a FetchState the request is conditional, and an unchanged page raises PageUnchanged.
+    # A session passed in (e.g. one recording to or replaying from WARC files) is used instead of requests
+    http = session or requests
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
+        if state is not None:
+            headers = {**headers, **state.conditional_headers(url)}
+        with metrics.stage("fetch", url):
+            response = http.get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+        metrics.incr("bytes_total", len(response.content), direction="download", kind="page")
+        if state is not None:
+            track_page(state, url, response.status_code, response.headers, content_sha256(response.content))
         return response.text
+    except PageUnchanged:
+        raise
+    except Exception as e:
+        print(f"❌ Failed to fetch page {url}. Error: {e}")
+        return None
+
+def track_page(state, url, status_code, response_headers, sha256):
+    # A 304, or a body identical to the last delivered one, raises PageUnchanged;
+    # the hash check catches servers that send no ETag/Last-Modified
+    if status_code == 304:
+        raise PageUnchanged(url)
+    known = state.get(url)
+    if known and known[2] == sha256:
+        raise PageUnchanged(url)
+    state.stage(url, response_headers, sha256)
+
+def stream_fetch(url, headers, metrics=NULL_METRICS, state=None, max_bytes=DEFAULT_MAX_PAGE_BYTES,
+                 session=None):
+    # Fetch and extract in one pass over the streamed body: neither the whole
+    # HTML string nor a tree is ever held, and oversized pages are cut off
+    try:
+        with metrics.stage("stream", url):
+            page = stream_page(url, headers, session=session, max_bytes=max_bytes, state=state)
     except Exception as e:
         print(f"❌ Failed to fetch page {url}. Error: {e}")
         return None
+    metrics.incr("bytes_total", page.pop("size"), direction="download", kind="page")
+    status_code, response_headers, sha256 = page.pop("status"), page.pop("headers"), page.pop("sha256")
+    if state is not None:
+        track_page(state, url, status_code, response_headers, sha256)
+    return page
 
 def get_image_folder(base_url):
     parsed_url = urlparse(base_url)
@@ -26,152 +89,331 @@ def get_image_folder(base_url):
         folder_name = f"{parsed_url.netloc}_images"
     return folder_name
 
-def process_images(soup, base_url, headers, images_folder):
-    if not os.path.exists(images_folder):
-        os.makedirs(images_folder)
-    
-    for img in soup.find_all('img'):
-        src = img.get('src')
-        if not src:
-            continue
-        absolute_src = urljoin(base_url, src)
-        try:
-            img_response = requests.get(absolute_src, headers=headers, timeout=30)
-            img_response.raise_for_status()
-            filename = os.path.basename(urlparse(absolute_src).path)
-            if not filename or '.' not in filename:
-                filename = f"{uuid.uuid4()}.jpg"
-            local_path = os.path.join(images_folder, filename)
-            with open(local_path, 'wb') as f:
-                f.write(img_response.content)
-            print(f"✅ Image downloaded: {absolute_src} -> {local_path}")
-            # Update the img tag's src attribute to the local file path
-            img['src'] = local_path
-        except Exception as e:
-            print(f"❌ Error downloading image: {absolute_src}. Error: {e}")
-    return soup
+def save_images(image_urls, headers, images_folder, session=None,
+                workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, store=None,
+                metrics=NULL_METRICS, on_result=None, state=None):
+    results = download_images(image_urls, images_folder, session=session, headers=headers,
+                              workers=workers, per_host=per_host, store=store,
+                              on_result=on_result, state=state)
+    report_images(results, metrics)
+    return results
 
-def extract_meta(soup, fallback_title):
-    meta_og = soup.find("meta", property="og:title")
-    meta_name = soup.find("meta", attrs={"name": "title"})
-    meta_desc_tag = soup.find("meta", attrs={"name": "description"})
-    
-    meta_title = (meta_og.get("content") or meta_name.get("content")).strip() if (meta_og or meta_name) else fallback_title
-    meta_description = meta_desc_tag.get("content").strip() if meta_desc_tag else "Meta description not found"
-    return meta_title, meta_description
+def report_images(results, metrics=NULL_METRICS):
+    counted = set()
+    for result in results:
+        if result.ok:
+            print(f"✅ Image downloaded: {result.url} -> {result.path}")
+            metrics.incr("images_total", result="ok")
+            # The same image can appear many times on a page but is downloaded once
+            if result.url not in counted:
+                counted.add(result.url)
+                metrics.incr("bytes_total", result.size, direction="download", kind="image")
+        else:
+            print(f"❌ Error downloading image: {result.url}. Error: {result.error}")
+            metrics.incr("images_total", result="failed")
+            metrics.incr("errors_total", stage="images")
+    return results
 
 def clean_content(soup):
-    # Remove script and style tags
-    for unwanted in soup(['script', 'style']):
-        unwanted.decompose()
-    
-    # Only allow basic HTML tags: p, a, ul, ol, li (images are excluded from content)
-    allowed_tags = ["p", "a", "ul", "ol", "li"]
-    content_soup = copy.deepcopy(soup.body or soup)
-    
-    for tag in content_soup.find_all(True):
-        if tag.name not in allowed_tags:
-            tag.unwrap()
-        else:
-            tag.attrs = {}
-    
-    content_str = re.sub(r'\s+', ' ', str(content_soup)).strip()
-    return content_str
+    # Only allow basic HTML tags: p, a, ul, ol, li (images are excluded from content).
+    # Script and style tags are dropped; the tree is serialized in one pass without copying it
+    return sanitize(soup.body or soup)
 
-def zip_images(images_folder):
-    shutil.make_archive(images_folder, 'zip', images_folder)
+def zip_images(images_folder, archive=None):
+    # Only new or changed images are written; JPEG/PNG are stored without re-deflating
     zip_path = f"{images_folder}.zip"
+    if archive is not None:
+        archive.sync(images_folder)
+        return zip_path
+    with ImageArchive(zip_path) as archive:
+        archive.sync(images_folder)
     return zip_path
 
-def process_url(url, headers):
-    html = fetch_page(url, headers)
-    if not html:
-        return None
-    soup = BeautifulSoup(html, "html.parser")
-    
-    # Page Title: Use first <h1> if available; otherwise, use <title>
-    h1_tag = soup.find("h1")
-    if h1_tag and h1_tag.get_text(strip=True):
-        page_title = h1_tag.get_text(strip=True)
-    else:
-        page_title = soup.title.get_text(strip=True) if soup.title else "Title not found"
-    
-    meta_title, meta_description = extract_meta(soup, page_title)
-    permalink = url
+def extract_page(html, url, parser=None, metrics=NULL_METRICS):
+    # Parse, extract and clean a page. This is pure CPU work, so batch mode runs it in a process pool
+    with metrics.stage("parse", url):
+        soup = make_soup(html, parser)
     
-    # Process images: download images and update <img> tag src attribute
-    images_folder = get_image_folder(url)
-    soup = process_images(soup, url, headers, images_folder)
+    # Title, meta tags and image sources are collected in one walk over the tree
+    with metrics.stage("extract", url):
+        fields = extract_fields(soup)
+        image_urls = [urljoin(url, src) for src in fields["image_srcs"]]
     
     # Clean content: keep only basic HTML tags (p, a, ul, ol, li)
-    content = clean_content(soup)
-    
-    # Create ZIP archive for the images folder
-    zip_file_path = zip_images(images_folder)
+    with metrics.stage("clean", url):
+        content = clean_content(soup)
     
     return {
-        "page_title": page_title,
-        "meta_title": meta_title,
-        "meta_description": meta_description,
-        "permalink": permalink,
+        "page_title": fields["page_title"],
+        "meta_title": fields["meta_title"],
+        "meta_description": fields["meta_description"],
+        "permalink": url,
         "content": content,
-        "zip_file_path": zip_file_path  # For attachment purposes.
+        "image_urls": image_urls
     }
 
-def send_bundle(bundle, webhook_url):
+def finish_page(page, headers, store=None, metrics=NULL_METRICS, state=None, thumbnailer=None,
+                session=None):
+    # Download the page's images and create the ZIP archive for them
+    image_urls = page.pop("image_urls")
+    url = page["permalink"]
+    images_folder = get_image_folder(url)
+    small = thumbnailer is not None and thumbnailer.enabled
+    # Each image goes into the archive as soon as its download finishes
+    with ImageArchive(f"{images_folder}.zip") as archive:
+        def add_to_archive(result):
+            if result.ok and not small:
+                archive.add(result.path)
+        with metrics.stage("images", url):
+            results = save_images(image_urls, headers, images_folder, session=session, store=store,
+                                  metrics=metrics, on_result=add_to_archive, state=state)
+        if small:
+            # The ZIP carries the resized copies instead of the originals
+            small_folder = f"{images_folder}_small"
+            with metrics.stage("thumbnails", url):
+                thumbnailer.derive_all(results, small_folder)
+            with metrics.stage("zip", url):
+                archive.sync(small_folder)
+                page["zip_file_path"] = archive.zip_path
+        else:
+            with metrics.stage("zip", url):
+                page["zip_file_path"] = zip_images(images_folder, archive)  # For attachment purposes.
+    return page
+
+def process_url(url, headers, store=None, parser=None, metrics=NULL_METRICS, state=None, thumbnailer=None,
+                stream=False, max_page_bytes=DEFAULT_MAX_PAGE_BYTES, session=None):
+    if stream:
+        page = stream_fetch(url, headers, metrics=metrics, state=state, max_bytes=max_page_bytes,
+                            session=session)
+        if not page:
+            return None
+    else:
+        html = fetch_page(url, headers, metrics=metrics, state=state, session=session)
+        if not html:
+            return None
+        page = extract_page(html, url, parser, metrics=metrics)
+    return finish_page(page, headers, store=store, metrics=metrics, state=state, thumbnailer=thumbnailer,
+                       session=session)
+
+def send_bundle(bundle, webhook_url, metrics=NULL_METRICS, session=None):
     # Extract the ZIP file path and remove it from the JSON payload
     zip_file_path = bundle.pop("zip_file_path")
     # Prepare a multipart payload where each property is a separate field
-    multipart_data = {
-        "page_title": (None, bundle.get("page_title"), "text/plain"),
-        "meta_title": (None, bundle.get("meta_title"), "text/plain"),
-        "meta_description": (None, bundle.get("meta_description"), "text/plain"),
-        "permalink": (None, bundle.get("permalink"), "text/plain"),
-        "content": (None, bundle.get("content"), "text/plain")
-    }
+    multipart_data = {name: (None, bundle.get(name), "text/plain") for name in BUNDLE_FIELDS}
     # Open the ZIP file for attachment
     with open(zip_file_path, "rb") as f_zip:
         multipart_data["zip_file"] = (os.path.basename(zip_file_path), f_zip, "application/zip")
         try:
-            response = requests.post(webhook_url, files=multipart_data, timeout=30)
+            with metrics.stage("webhook", bundle.get("permalink")):
+                response = (session or requests).post(webhook_url, files=multipart_data, timeout=30)
+            metrics.incr("bytes_total", len(response.request.body or b""), direction="upload", kind="bundle")
             print("🔔 Webhook Response status code:", response.status_code)
             print("🔔 Webhook Response text:", response.text)
             if response.status_code in [200, 201, 202]:
                 print("✅ Bundle successfully sent to the webhook.")
-            else:
-                print(f"❌ Error sending bundle: {response.status_code}")
+                return True
+            metrics.incr("errors_total", stage="webhook")
+            print(f"❌ Error sending bundle: {response.status_code}")
         except Exception as e:
             print("❌ Error during webhook request:", e)
+    return False
 
-def main():
-    # Process only the "over-mij" website
-    url = "https://www.ellindecoratie.nl/"
-    webhook_url = "https://hook.eu2.make.com/is1dhkyhge8iuqg4jsxykh6dkyaejawy"
-    
-    headers = {
-        "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                       "AppleWebKit/537.36 (KHTML, like Gecko) "
-                       "Chrome/87.0.4280.66 Safari/537.36")
-    }
+def deliver(bundle, webhook_url, outbox=None, metrics=NULL_METRICS, session=None, state=None):
+    # With an outbox the bundle is queued on disk and the delivery worker sends it;
+    # the page's fetch state is committed only once the webhook has accepted the bundle.
+    # Without a webhook URL (e.g. --replay) pages only go to the output file
+    if webhook_url is None:
+        print("⏭️ No webhook URL, bundle not sent.")
+        return False
+    if outbox is None:
+        url = bundle["permalink"]
+        sent = send_bundle(bundle, webhook_url, metrics=metrics, session=session)
+        if sent and state is not None:
+            state.commit(url)
+        return sent
+    message_id = outbox.put(bundle)
+    print(f"📮 Bundle queued for delivery (#{message_id}).")
+    return True
+
+def commit_when_sent(state):
+    # DeliveryWorker on_sent callback: queued pages commit their fetch state once delivered
+    if state is None:
+        return None
+    return lambda message: state.commit(message["payload"]["permalink"])
+
+def run_batch_mode(urls, headers, webhook_url, store=None, workers=DEFAULT_FETCH_WORKERS,
+                   parser=None, metrics=NULL_METRICS, outbox=None, state=None, output=None,
+                   thumbnailer=None, stream=False, max_page_bytes=DEFAULT_MAX_PAGE_BYTES, session=None,
+                   webhook_session=None):
+    if stream:
+        # Pages are extracted while they download, so there is no separate parse stage
+        fetch = functools.partial(stream_fetch, headers=headers, metrics=metrics, state=state,
+                                  max_bytes=max_page_bytes, session=session)
+        extract = None
+    else:
+        fetch = functools.partial(fetch_page, headers=headers, metrics=metrics, state=state, session=session)
+        # Extraction runs in worker processes, which can't report into this process' metrics
+        extract = functools.partial(extract_page, parser=parser)
+    finish = functools.partial(finish_page, headers=headers, store=store, metrics=metrics, state=state,
+                               thumbnailer=thumbnailer, session=session)
+    processed = 0
+    failed = 0
+    unchanged = 0
+    # Pages arrive in completion order; a failed page is reported and the batch continues.
+    # Pages sharing an image folder (and its ZIP) are finished one after another
+    for result in run_batch(urls, fetch, extract, finish, fetch_workers=workers,
+                            finish_key=get_image_folder):
+        if isinstance(result.error, PageUnchanged):
+            unchanged += 1
+            metrics.incr("pages_total", result="unchanged")
+            print(f"⏭️ Unchanged since last run: {result.url}")
+            continue
+        if result.error is not None:
+            failed += 1
+            metrics.incr("errors_total", stage="batch")
+            print(f"❌ Failed to process {result.url}. Error: {result.error}")
+            continue
+        bundle_data = result.result
+        processed += 1
+        # One JSON line per page as it completes, so an interrupted batch keeps its records
+        if output is not None:
+            output.write({k: v for k, v in bundle_data.items() if k != "zip_file_path"})
+        print(f"🔗 Processed URL: {result.url}")
+        deliver(bundle_data, webhook_url, outbox=outbox, metrics=metrics, session=webhook_session, state=state)
     
+    if output is not None:
+        print(f"✅ Data successfully written to {output.current_path()}.")
+    print(f"✅ Batch complete: {processed} pages processed, {unchanged} unchanged, {failed} failed.")
+
+def extract_item(item, parser=None):
+    # Pipeline stages take one argument; this unpacks the (html, url) the fetch stage produces
+    html, url = item
+    return extract_page(html, url, parser)
+
+async def run_pipeline_mode(urls, headers, webhook_url, store=None, workers=DEFAULT_FETCH_WORKERS,
+                            parser=None, metrics=NULL_METRICS, outbox=None, state=None, output=None,
+                            thumbnailer=None, session=None, scheduler=None):
+    counts = {"processed": 0, "unchanged": 0, "failed": 0}
+    # Like run_batch: each URL once, and one page at a time per image folder and ZIP
+    urls = list(dict.fromkeys(urls))
+    folder_locks = collections.defaultdict(asyncio.Lock)
+
+    async with AsyncHttp(headers, connections=workers * 2, session=session, scheduler=scheduler) as http:
+        async def fetch(url):
+            request_headers = state.conditional_headers(url) if state is not None else None
+            with metrics.stage("fetch", url):
+                response = await http.get_page(url, headers=request_headers)
+            metrics.incr("bytes_total", len(response.content), direction="download", kind="page")
+            if state is not None:
+                track_page(state, url, response.status, response.headers, content_sha256(response.content))
+            return response.text, url
+
+        async def images(page):
+            images_folder = get_image_folder(page["permalink"])
+            async with folder_locks[images_folder]:
+                return await build_images(page, images_folder)
+
+        async def build_images(page, images_folder):
+            url = page["permalink"]
+            with metrics.stage("images", url):
+                results = await http.download_images(page.pop("image_urls"), images_folder, store=store,
+                                                     state=state)
+            report_images(results, metrics)
+            zip_folder = images_folder
+            if thumbnailer is not None and thumbnailer.enabled:
+                # The ZIP carries the resized copies instead of the originals
+                zip_folder = f"{images_folder}_small"
+                with metrics.stage("thumbnails", url):
+                    await asyncio.to_thread(thumbnailer.derive_all, results, zip_folder)
+
+            def build_zip():
+                with ImageArchive(f"{images_folder}.zip") as archive:
+                    archive.sync(zip_folder)
+                return archive.zip_path
+            with metrics.stage("zip", url):
+                page["zip_file_path"] = await asyncio.to_thread(build_zip)
+            return page
+
+        async def send(page):
+            url = page["permalink"]
+            if output is not None:
+                output.write({k: v for k, v in page.items() if k != "zip_file_path"})
+            if webhook_url is None:
+                # Without a webhook URL (e.g. --replay) pages only go to the output file
+                return page
+            if outbox is not None:
+                # The delivery worker commits the fetch state once the bundle is sent
+                await asyncio.to_thread(outbox.put, page)
+            else:
+                zip_file_path = page["zip_file_path"]
+                fields = {name: page.get(name) for name in BUNDLE_FIELDS}
+                files = {"zip_file": (os.path.basename(zip_file_path), zip_file_path, "application/zip")}
+                try:
+                    with metrics.stage("webhook", url):
+                        status = await http.post_multipart(webhook_url, fields, files)
+                    sent = status in (200, 201, 202)
+                except Exception as e:
+                    print(f"❌ Error during webhook request for {url}:", e)
+                    sent = False
+                if not sent:
+                    metrics.incr("errors_total", stage="webhook")
+                elif state is not None:
+                    state.commit(url)
+            return page
+
+        def on_result(result):
+            if isinstance(result.error, PageUnchanged):
+                counts["unchanged"] += 1
+                metrics.incr("pages_total", result="unchanged")
+                print(f"⏭️ Unchanged since last run: {result.url}")
+            elif result.error is not None:
+                counts["failed"] += 1
+                metrics.incr("errors_total", stage="batch")
+                print(f"❌ Failed to process {result.url}. Error: {result.error}")
+            else:
+                counts["processed"] += 1
+                print(f"🔗 Processed URL: {result.url}")
+
+        # Fetches and downloads wait on the network while other pages parse in worker processes
+        stages = [
+            Stage("fetch", fetch, workers, False),
+            Stage("extract", functools.partial(extract_item, parser=parser), os.cpu_count() or 1, True),
+            Stage("images", images, workers, False),
+            Stage("deliver", send, 2, False),
+        ]
+        await run_pipeline(urls, stages, on_result)
+
+    if output is not None:
+        print(f"✅ Data successfully written to {output.current_path()}.")
+    print(f"✅ Pipeline complete: {counts['processed']} pages processed, "
+          f"{counts['unchanged']} unchanged, {counts['failed']} failed.")
+
+def run_single(url, headers, webhook_url, store=None, parser=None, metrics=NULL_METRICS, outbox=None,
+               state=None, output=None, thumbnailer=None, stream=False,
+               max_page_bytes=DEFAULT_MAX_PAGE_BYTES, session=None, webhook_session=None):
     print(f"🔗 Processing URL: {url}")
-    bundle_data = process_url(url, headers)
+    try:
+        bundle_data = process_url(url, headers, store=store, parser=parser, metrics=metrics, state=state,
+                                  thumbnailer=thumbnailer, stream=stream, max_page_bytes=max_page_bytes,
+                                  session=session)
+    except PageUnchanged:
+        metrics.incr("pages_total", result="unchanged")
+        print("⏭️ Page unchanged since the last run, nothing to send.")
+        return
     if not bundle_data:
         print("❌ No data processed.")
         return
     
-    # (Optional) Save JSON payload without ZIP file path for backup
-    output_file = "output.json"
-    try:
-        backup_data = {k: v for k, v in bundle_data.items() if k != "zip_file_path"}
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=4)
-        print(f"✅ Data successfully written to {output_file}.")
-    except Exception as e:
-        print("❌ Error writing to file:", e)
+    # (Optional) Append the JSON payload without ZIP file path for backup
+    if output is not None:
+        try:
+            output.write({k: v for k, v in bundle_data.items() if k != "zip_file_path"})
+            print(f"✅ Data successfully written to {output.current_path()}.")
+        except Exception as e:
+            print("❌ Error writing to file:", e)
     
     # Send all properties along with the ZIP file in one bundle
-    send_bundle(bundle_data, webhook_url)
+    deliver(bundle_data, webhook_url, outbox=outbox, metrics=metrics, session=webhook_session, state=state)
     
     # Debug output
     print("------------------------------------------------")
@@ -182,5 +424,103 @@ def main():
     print("ZIP File path:", bundle_data.get("zip_file_path"))
     print("------------------------------------------------")
 
+def main():
+    arg_parser = argparse.ArgumentParser(description="Scrape pages and send them to the webhook.")
+    # Process only the "over-mij" website unless told otherwise
+    arg_parser.add_argument("url", nargs="?", default="https://www.ellindecoratie.nl/")
+    arg_parser.add_argument("--batch", metavar="FILE",
+                            help="process every URL in FILE (one URL per line, or a sitemap.xml)")
+    arg_parser.add_argument("--workers", type=int, default=DEFAULT_FETCH_WORKERS,
+                            help="concurrent page fetches in batch mode")
+    arg_parser.add_argument("--pipeline", action="store_true",
+                            help="run --batch as an asyncio pipeline (uses aiohttp when installed)")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="extract pages while they download instead of parsing the whole page")
+    arg_parser.add_argument("--max-page-mb", type=float, default=DEFAULT_MAX_PAGE_BYTES / 1024 / 1024,
+                            help="with --stream, give up on pages larger than this")
+    arg_parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER,
+                            help="HTML parser backend; lxml is faster but may clean some pages differently "
+                                 "(falls back to html.parser if not installed)")
+    arg_parser.add_argument("--outbox", nargs="?", const=DEFAULT_OUTBOX, metavar="FILE",
+                            help="queue bundles in FILE and deliver them in the background, with retries")
+    arg_parser.add_argument("--delivery-concurrency", type=int, default=2,
+                            help="webhook requests in flight when using --outbox")
+    arg_parser.add_argument("--delivery-rate", type=float, help="maximum webhook requests per second")
+    arg_parser.add_argument("--delivery-batch", type=int, default=1,
+                            help="pages per webhook request when using --outbox")
+    arg_parser.add_argument("--incremental", nargs="?", const=DEFAULT_STATE_PATH, metavar="FILE",
+                            help="remember ETag/Last-Modified/content hashes in FILE and skip unchanged pages")
+    add_warc_arguments(arg_parser)
+    add_scheduler_arguments(arg_parser)
+    add_thumbnail_arguments(arg_parser)
+    add_output_arguments(arg_parser)
+    add_metrics_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if args.stream and args.pipeline:
+        arg_parser.error("--stream and --pipeline can't be combined")
+    if args.replay and args.outbox:
+        arg_parser.error("--replay doesn't deliver anything, so it can't be combined with --outbox")
+    max_page_bytes = int(args.max_page_mb * 1024 * 1024)
+    
+    webhook_url = WEBHOOK_URL
+    headers = HEADERS
+    # Images shared between pages (logo, sliders) are stored once and hard-linked
+    store = ImageStore()
+    state = FetchState(args.incremental) if args.incremental else None
+    thumbnailer = Thumbnailer(fmt=args.thumbnails, max_size=args.thumbnail_size) if args.thumbnails else None
+    if args.replay:
+        webhook_url = None
+    
+    with metrics_session(args.metrics_log, args.metrics_prom) as metrics, open_output(args) as output:
+        # One scheduler paces pages, images and webhook requests per host;
+        # --record/--replay route page and image requests through WARC files
+        scheduler = open_scheduler(args, headers, metrics=metrics)
+        session = open_session(args, headers, pool_size=max(args.workers, DEFAULT_WORKERS), scheduler=scheduler)
+        webhook_session = None
+        if scheduler is not None:
+            webhook_session = scheduled_session(scheduler, pool_size=args.delivery_concurrency)
+        outbox = worker = None
+        if args.outbox:
+            # Bundles left over from an earlier run are delivered along with this run's
+            outbox = Outbox(args.outbox)
+            worker = DeliveryWorker(outbox, webhook_url, concurrency=args.delivery_concurrency,
+                                    rate=args.delivery_rate, batch_size=args.delivery_batch,
+                                    session=webhook_session, metrics=metrics,
+                                    on_sent=commit_when_sent(state)).start()
+        try:
+            if args.batch:
+                urls = read_url_list(args.batch, headers)
+                print(f"🔗 Processing {len(urls)} URLs from {args.batch}")
+                if args.pipeline:
+                    asyncio.run(run_pipeline_mode(urls, headers, webhook_url, store=store, workers=args.workers,
+                                                  parser=args.parser, metrics=metrics, outbox=outbox,
+                                                  state=state, output=output, thumbnailer=thumbnailer,
+                                                  session=session if args.record or args.replay else None,
+                                                  scheduler=scheduler))
+                else:
+                    run_batch_mode(urls, headers, webhook_url, store=store, workers=args.workers,
+                                   parser=args.parser, metrics=metrics, outbox=outbox, state=state, output=output,
+                                   thumbnailer=thumbnailer, stream=args.stream, max_page_bytes=max_page_bytes,
+                                   session=session, webhook_session=webhook_session)
+            else:
+                run_single(args.url, headers, webhook_url, store=store, parser=args.parser,
+                           metrics=metrics, outbox=outbox, state=state, output=output,
+                           thumbnailer=thumbnailer, stream=args.stream, max_page_bytes=max_page_bytes,
+                           session=session, webhook_session=webhook_session)
+        finally:
+            if worker is not None:
+                # Anything still waiting on a retry stays in the outbox for the next run
+                worker.stop(drain=True)
+                print(f"📮 Outbox: {outbox.counts()}")
+                outbox.close()
+            if state is not None:
+                state.close()
+            if thumbnailer is not None:
+                thumbnailer.close()
+            if session is not None:
+                session.close()
+            if webhook_session is not None:
+                webhook_session.close()
+
 if __name__ == "__main__":
     main()
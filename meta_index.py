@@ -0,0 +1,224 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from jsonl import read_records
+
+DEFAULT_META_INDEX = "meta_index.sqlite"
+BATCH_SIZE = 500
+# Not a meta tag: the page title the scraper chose (H1, og:title or <title>), queryable like one
+PAGE_TITLE = "page_title"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    permalink TEXT PRIMARY KEY,
+    page_title TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    permalink TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (permalink, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS meta_values ON meta (name, content);
+CREATE INDEX IF NOT EXISTS pages_titles ON pages (page_title);
+"""
+
+
+class MetaIndex:
+    """Meta tags, titles and permalinks of scraped pages, queryable without re-fetching.
+
+    Pages are buffered and written ``batch_size`` at a time in one
+    transaction; a page indexed again replaces what was stored for it.
+    The ``(name, content)`` index makes duplicates(), missing() and
+    values() index scans rather than passes over every page.
+    """
+
+    def __init__(self, path=DEFAULT_META_INDEX, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def add(self, permalink, page_title, meta_tags):
+        with self._lock:
+            self._pending.append((permalink, page_title, dict(meta_tags)))
+            if len(self._pending) < self.batch_size:
+                return
+            pending, self._pending = self._pending, []
+            self._write(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                self._write(pending)
+
+    def _write(self, pages):
+        now = time.time()
+        with self._db:
+            self._db.executemany("DELETE FROM meta WHERE permalink = ?", [(p[0],) for p in pages])
+            self._db.executemany("INSERT OR REPLACE INTO pages (permalink, page_title, indexed_at) VALUES (?, ?, ?)",
+                                 [(permalink, title, now) for permalink, title, _ in pages])
+            self._db.executemany("INSERT OR REPLACE INTO meta (permalink, name, content) VALUES (?, ?, ?)",
+                                 [(permalink, name, content) for permalink, _, tags in pages
+                                  for name, content in tags.items()])
+
+    def _values(self, name):
+        # (permalink, content) rows for a meta tag name, or for the page titles
+        if name == PAGE_TITLE:
+            return "SELECT permalink, page_title AS content FROM pages WHERE page_title IS NOT NULL", ()
+        return "SELECT permalink, content FROM meta WHERE name = ?", (name,)
+
+    def duplicates(self, name, limit=None):
+        """``[(content, [permalinks])]`` for values of ``name`` shared by several pages, most shared first."""
+        values, params = self._values(name)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT content, group_concat(permalink, char(10)), COUNT(*) AS pages FROM ({values}) "
+                f"GROUP BY content HAVING pages > 1 ORDER BY pages DESC, content LIMIT ?",
+                params + (-1 if limit is None else limit,)).fetchall()
+        return [(content, permalinks.split("\n")) for content, permalinks, _ in rows]
+
+    def missing(self, name, limit=None):
+        """Permalinks of the pages without ``name`` (a meta tag name, or PAGE_TITLE)."""
+        if name == PAGE_TITLE:
+            query, params = "SELECT permalink FROM pages WHERE coalesce(page_title, '') = ''", ()
+        else:
+            # One primary key lookup per page
+            query = ("SELECT permalink FROM pages WHERE NOT EXISTS "
+                     "(SELECT 1 FROM meta WHERE meta.permalink = pages.permalink AND name = ?)")
+            params = (name,)
+        with self._lock:
+            rows = self._db.execute(f"{query} ORDER BY permalink LIMIT ?",
+                                    params + (-1 if limit is None else limit,)).fetchall()
+        return [row[0] for row in rows]
+
+    def values(self, name, split=False, limit=None):
+        """``[(value, pages)]`` for ``name``, most common first.
+
+        With ``split`` comma-separated contents such as ``keywords`` or
+        ``robots`` (``noindex, nofollow``) are counted per lowercased item.
+        """
+        values, params = self._values(name)
+        with self._lock:
+            if not split:
+                return self._db.execute(
+                    f"SELECT content, COUNT(*) AS pages FROM ({values}) GROUP BY content "
+                    f"ORDER BY pages DESC, content LIMIT ?", params + (-1 if limit is None else limit,)).fetchall()
+            rows = self._db.execute(f"SELECT content, COUNT(*) FROM ({values}) GROUP BY content", params).fetchall()
+        counts = Counter()
+        for content, pages in rows:
+            # An item repeated within one page still counts that page once
+            for item in {item.strip().lower() for item in content.split(",")} - {""}:
+                counts[item] += pages
+        return counts.most_common(limit)
+
+    def names(self):
+        """``[(meta tag name, pages)]`` over the whole index, most common first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT name, COUNT(*) AS pages FROM meta GROUP BY name ORDER BY pages DESC, name").fetchall()
+
+    def page_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+
+def add_meta_index_arguments(arg_parser):
+    arg_parser.add_argument("--meta-index", nargs="?", const=DEFAULT_META_INDEX, metavar="FILE",
+                            help="add every page's meta tags and title to the SQLite index in FILE")
+
+
+def open_meta_index(args):
+    return MetaIndex(args.meta_index) if args.meta_index else None
+
+
+def import_records(index, path):
+    """Index the pages in a JSON Lines output file; returns (indexed, skipped)."""
+    indexed = skipped = 0
+    for record in read_records(path):
+        # Only make-v2.py records carry every meta tag; make.py ones would look like pages without any
+        if "meta_tags" not in record or "permalink" not in record:
+            skipped += 1
+            continue
+        index.add(record["permalink"], record.get("page_title"), record["meta_tags"])
+        indexed += 1
+    return indexed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the meta tags of scraped pages.")
+    parser.add_argument("--index", default=DEFAULT_META_INDEX, metavar="FILE")
+    parser.add_argument("--limit", type=int, help="show at most this many rows")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("summary", help="page count and how many pages have each meta tag")
+    import_parser = commands.add_parser("import", help="index the pages in JSON Lines output files")
+    import_parser.add_argument("files", nargs="+")
+    for command, help_text in [("duplicates", "values shared by more than one page"),
+                               ("missing", "pages without the tag"),
+                               ("values", "how often each value occurs")]:
+        command_parser = commands.add_parser(command, help=help_text)
+        command_parser.add_argument("name", help=f"meta tag name or property, or {PAGE_TITLE}")
+        if command == "values":
+            command_parser.add_argument("--split", action="store_true",
+                                        help="count comma-separated items (keywords, robots) one by one")
+    args = parser.parse_args()
+
+    with MetaIndex(args.index) as index:
+        if args.command == "import":
+            for path in args.files:
+                indexed, skipped = import_records(index, path)
+                print(f"{path}: {indexed} pages indexed, {skipped} skipped")
+            return
+        started = time.perf_counter()
+        if args.command == "summary":
+            result = {"pages": index.page_count(), "tags": index.names()[:args.limit]}
+        elif args.command == "duplicates":
+            result = index.duplicates(args.name, args.limit)
+        elif args.command == "missing":
+            result = index.missing(args.name, args.limit)
+        else:
+            result = index.values(args.name, split=args.split, limit=args.limit)
+        took = (time.perf_counter() - started) * 1000
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+            return
+        if args.command == "summary":
+            print(f"{result['pages']} pages")
+            for name, pages in result["tags"]:
+                print(f"{pages:8} {name}")
+        elif args.command == "duplicates":
+            for content, permalinks in result:
+                print(f"{len(permalinks):8} {content}")
+                for permalink in permalinks:
+                    print(f"         {permalink}")
+        elif args.command == "missing":
+            for permalink in result:
+                print(permalink)
+        else:
+            for value, pages in result:
+                print(f"{pages:8} {value}")
+        print(f"({took:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
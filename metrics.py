@@ -0,0 +1,135 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+PREFIX = "scraper"
+
+_HELP = {
+    "stage_seconds_total": "Wall time spent in each pipeline stage.",
+    "stage_runs_total": "Number of times each pipeline stage ran.",
+    "bytes_total": "Bytes transferred, by direction and kind.",
+    "images_total": "Images processed, by result.",
+    "pages_total": "Pages by outcome (e.g. skipped as unchanged).",
+    "errors_total": "Errors, by stage.",
+    "throttled_total": "Times a host's concurrency was cut, by reason (429/5xx, error, latency).",
+}
+
+
+class Metrics:
+    """Collects per-stage wall time and counters for a run.
+
+    Each finished stage is written to ``log`` (a text file object) as a JSON
+    line when one is given; write_prometheus() dumps the totals in the
+    Prometheus text format. All methods are thread-safe.
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def emit(self, event, **fields):
+        if self.log is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False)
+        with self._lock:
+            self.log.write(line + "\n")
+            self.log.flush()
+
+    @contextlib.contextmanager
+    def stage(self, name, url=None):
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            self.incr("errors_total", stage=name)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.incr("stage_seconds_total", seconds, stage=name)
+            self.incr("stage_runs_total", stage=name)
+            self.emit("stage", stage=name, url=url, seconds=round(seconds, 6), ok=ok)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def write_prometheus(self, path):
+        by_name = defaultdict(list)
+        for (name, labels), value in sorted(self.snapshot().items()):
+            by_name[name].append((labels, value))
+        lines = []
+        for name, samples in by_name.items():
+            metric = f"{PREFIX}_{name}"
+            if name in _HELP:
+                lines.append(f"# HELP {metric} {_HELP[name]}")
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                value = _format_value(value)
+                lines.append(f"{metric}{{{label_str}}} {value}" if label_str else f"{metric} {value}")
+        # Write then rename so a textfile collector never reads a half-written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+class NullMetrics:
+    """Stand-in used when instrumentation is off; every call is a no-op."""
+
+    _stage = contextlib.nullcontext()
+
+    def incr(self, name, value=1, **labels):
+        pass
+
+    def emit(self, event, **fields):
+        pass
+
+    def stage(self, name, url=None):
+        return self._stage
+
+
+NULL_METRICS = NullMetrics()
+
+
+def add_metrics_arguments(arg_parser):
+    arg_parser.add_argument("--metrics-log", metavar="FILE",
+                            help="append one JSON line per pipeline stage to FILE")
+    arg_parser.add_argument("--metrics-prom", metavar="FILE",
+                            help="write run totals to FILE in Prometheus text format")
+
+
+@contextlib.contextmanager
+def metrics_session(log_path=None, prom_path=None):
+    """Yield a Metrics for the run, or NULL_METRICS when both outputs are off."""
+    if not log_path and not prom_path:
+        yield NULL_METRICS
+        return
+    log = open(log_path, "a", encoding="utf-8") if log_path else None
+    metrics = Metrics(log=log)
+    try:
+        yield metrics
+    finally:
+        if prom_path:
+            metrics.write_prometheus(prom_path)
+        if log is not None:
+            log.close()
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(round(value, 6))
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
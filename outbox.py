@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader import make_session
+from metrics import NULL_METRICS
+from scheduler import retry_after_seconds
+
+DEFAULT_OUTBOX = "outbox.sqlite"
+MAX_ATTEMPTS = 8
+BASE_DELAY = 2.0
+MAX_DELAY = 600.0
+# Client errors that will never succeed on retry; everything else is retried
+RETRYABLE_4XX = {408, 409, 425, 429}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    payload TEXT NOT NULL,
+    zip_path TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (state, next_attempt_at);
+"""
+
+
+class Outbox:
+    """Durable queue of page bundles waiting to be delivered to the webhook.
+
+    Bundles are stored in SQLite and their ZIP is copied next to the
+    database, so a later run that rebuilds the page's archive can't change
+    what gets delivered. Messages that were being sent when the process
+    died are picked up again on the next open.
+    """
+
+    def __init__(self, path=DEFAULT_OUTBOX, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.files_dir = f"{os.path.splitext(path)[0]}_files"
+        os.makedirs(self.files_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        with self._db:
+            self._db.execute("UPDATE messages SET state = 'pending' WHERE state = 'sending'")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def put(self, bundle):
+        payload = dict(bundle)
+        zip_path = payload.pop("zip_file_path", None)
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO messages (created_at, payload, next_attempt_at) VALUES (?, ?, ?)",
+                (time.time(), json.dumps(payload, ensure_ascii=False), 0),
+            )
+            message_id = cursor.lastrowid
+            if zip_path:
+                # One folder per message keeps the ZIP's own name, which is what the webhook sees
+                folder = os.path.join(self.files_dir, str(message_id))
+                os.makedirs(folder, exist_ok=True)
+                stored = os.path.join(folder, os.path.basename(zip_path))
+                shutil.copyfile(zip_path, stored)
+                self._db.execute("UPDATE messages SET zip_path = ? WHERE id = ?", (stored, message_id))
+        return message_id
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due messages as sending and return them."""
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT id, payload, zip_path, attempts FROM messages "
+                "WHERE state = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+            self._db.executemany("UPDATE messages SET state = 'sending' WHERE id = ?",
+                                 [(row[0],) for row in rows])
+        return [{"id": row[0], "payload": json.loads(row[1]), "zip_path": row[2], "attempts": row[3]}
+                for row in rows]
+
+    def mark_sent(self, messages):
+        with self._lock, self._db:
+            self._db.executemany("UPDATE messages SET state = 'sent', last_error = NULL WHERE id = ?",
+                                 [(m["id"],) for m in messages])
+        for message in messages:
+            if message["zip_path"] and os.path.exists(message["zip_path"]):
+                os.remove(message["zip_path"])
+                folder = os.path.dirname(message["zip_path"])
+                if folder != self.files_dir and not os.listdir(folder):
+                    os.rmdir(folder)
+
+    def mark_failed(self, messages, error, retry=True, delay=None):
+        now = time.time()
+        updates = []
+        for message in messages:
+            attempts = message["attempts"] + 1
+            if retry and attempts < self.max_attempts:
+                wait = delay if delay is not None else backoff(attempts)
+                updates.append(("pending", attempts, now + wait, error, message["id"]))
+            else:
+                updates.append(("dead", attempts, now, error, message["id"]))
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE messages SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                updates,
+            )
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall())
+
+    def next_due(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM messages WHERE state = 'pending'").fetchone()
+        return row[0]
+
+
+def backoff(attempts, base=BASE_DELAY, cap=MAX_DELAY):
+    # Exponential with jitter so retries from many messages don't arrive together
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` requests per second, shared by all senders."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DeliveryWorker:
+    """Background thread that drains an Outbox into the webhook.
+
+    Up to ``concurrency`` requests are in flight, ``rate`` caps requests per
+    second, and ``batch_size`` > 1 sends several pages in one request (a
+    JSON ``bundles`` list plus ``zip_file_<n>`` attachments). Failed
+    deliveries are retried with exponential backoff. ``on_sent`` is called
+    with each message once the webhook has accepted it.
+    """
+
+    def __init__(self, outbox, webhook_url, concurrency=2, rate=None, batch_size=1,
+                 session=None, timeout=30, poll_interval=0.5, metrics=NULL_METRICS, on_sent=None):
+        self.outbox = outbox
+        self.on_sent = on_sent
+        self.metrics = metrics
+        self.webhook_url = webhook_url
+        self.concurrency = concurrency
+        self.batch_size = max(1, batch_size)
+        self.limiter = RateLimiter(rate) if rate else None
+        self.session = session or make_session(pool_size=concurrency)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._drain = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox-delivery", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, drain=True, timeout=None):
+        """Stop the worker; with ``drain`` it first delivers everything that is due."""
+        self._drain = drain
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = set()
+            while True:
+                in_flight = {f for f in in_flight if not f.done()}
+                free = self.concurrency - len(in_flight)
+                messages = self.outbox.claim(free * self.batch_size) if free > 0 else []
+                for i in range(0, len(messages), self.batch_size):
+                    in_flight.add(pool.submit(self.deliver, messages[i:i + self.batch_size]))
+                if self._stop.is_set():
+                    if not self._drain:
+                        break
+                    # Draining ends once nothing is in flight and nothing is due right now
+                    next_due = self.outbox.next_due()
+                    if not in_flight and not messages and (next_due is None or next_due > time.time()):
+                        break
+                if not messages:
+                    if self._stop.is_set():
+                        time.sleep(0.05)
+                    else:
+                        self._stop.wait(self.poll_interval)
+
+    def deliver(self, messages):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        files = []
+        try:
+            multipart = self.build_multipart(messages, files)
+            with self.metrics.stage("webhook", messages[0]["payload"].get("permalink")):
+                response = self.session.post(self.webhook_url, files=multipart, timeout=self.timeout)
+        except Exception as e:
+            self.outbox.mark_failed(messages, str(e))
+            return False
+        finally:
+            for f in files:
+                f.close()
+        self.metrics.incr("bytes_total", len(response.request.body or b""), direction="upload", kind="bundle")
+        if 200 <= response.status_code < 300:
+            self.outbox.mark_sent(messages)
+            if self.on_sent is not None:
+                for message in messages:
+                    self.on_sent(message)
+            return True
+        self.metrics.incr("errors_total", stage="webhook")
+        error = f"HTTP {response.status_code}"
+        retry = response.status_code >= 500 or response.status_code in RETRYABLE_4XX
+        self.outbox.mark_failed(messages, error, retry=retry, delay=retry_after_seconds(response))
+        return False
+
+    def build_multipart(self, messages, open_files):
+        if len(messages) == 1:
+            # Same fields as make.send_bundle, so the receiver sees no difference.
+            # requests leaves out fields whose value is None, so they are left out here too
+            message = messages[0]
+            multipart = {key: (None, value if isinstance(value, str) else json.dumps(value, ensure_ascii=False),
+                               "text/plain")
+                         for key, value in message["payload"].items() if value is not None}
+            zip_names = {0: "zip_file"}
+        else:
+            multipart = {"bundles": (None, json.dumps([m["payload"] for m in messages], ensure_ascii=False),
+                                     "application/json")}
+            zip_names = {i: f"zip_file_{i}" for i in range(len(messages))}
+        for i, message in enumerate(messages):
+            if message["zip_path"]:
+                f_zip = open(message["zip_path"], "rb")
+                open_files.append(f_zip)
+                multipart[zip_names[i]] = (os.path.basename(message["zip_path"]), f_zip, "application/zip")
+        return multipart
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver everything waiting in the outbox, then exit.")
+    parser.add_argument("webhook_url")
+    parser.add_argument("--outbox", default=DEFAULT_OUTBOX)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--rate", type=float, help="maximum requests per second")
+    parser.add_argument("--batch-size", type=int, default=1, help="pages per webhook request")
+    args = parser.parse_args()
+
+    outbox = Outbox(args.outbox)
+    worker = DeliveryWorker(outbox, args.webhook_url, concurrency=args.concurrency,
+                            rate=args.rate, batch_size=args.batch_size).start()
+    worker.stop(drain=True)
+    print(outbox.counts())
+    outbox.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import warnings
+
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+# html.parser ships with Python and is what the scrapers always used. lxml is
+# faster but repairs broken markup differently, so it is opt-in (--parser lxml)
+PARSERS = ("html.parser", "lxml", "html5lib")
+DEFAULT_PARSER = "html.parser"
+FALLBACK_PARSER = "html.parser"
+
+# Restricted parses for jobs that only look at part of the page
+LINKS_ONLY = SoupStrainer("a")
+CONTENT_ONLY = SoupStrainer(["h1", "p", "a", "ul", "ol", "li", "img"])
+
+_resolved = {}
+
+
+def resolve_parser(parser=None):
+    """Return ``parser`` if its library is installed, otherwise html.parser."""
+    parser = parser or DEFAULT_PARSER
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser {parser!r}, expected one of {', '.join(PARSERS)}")
+    if parser not in _resolved:
+        try:
+            BeautifulSoup("", parser)
+            _resolved[parser] = parser
+        except FeatureNotFound:
+            warnings.warn(f"{parser} is not installed, falling back to {FALLBACK_PARSER}")
+            _resolved[parser] = FALLBACK_PARSER
+    return _resolved[parser]
+
+
+def make_soup(markup, parser=None, parse_only=None):
+    """Parse ``markup`` with the selected backend.
+
+    ``parse_only`` (e.g. LINKS_ONLY or CONTENT_ONLY) builds only the matching
+    tags and their contents. html5lib does not support it, so there the full
+    tree is built instead.
+    """
+    parser = resolve_parser(parser)
+    if parser == "html5lib":
+        parse_only = None
+    return BeautifulSoup(markup, parser, parse_only=parse_only)
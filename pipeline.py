@@ -0,0 +1,73 @@
+import asyncio
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import BatchResult
+
+# ``fn`` is a coroutine function for I/O stages; for CPU stages (``cpu=True``)
+# it is a picklable top-level function run in a process pool
+Stage = namedtuple("Stage", ["name", "fn", "workers", "cpu"])
+
+_DONE = object()
+
+
+async def run_pipeline(urls, stages, on_result, parse_workers=None):
+    """Push ``urls`` through ``stages`` with a bounded queue in front of each one.
+
+    Every stage runs ``workers`` tasks that take an item from their queue,
+    call ``fn(item)`` and put the result on the next stage's queue. A queue
+    holds at most twice as many items as its consumers, so a slow stage
+    makes the ones before it wait instead of piling pages up in memory.
+    The first stage receives the URL; ``on_result`` gets a BatchResult per
+    URL, with ``error`` set if any stage raised or returned None.
+    """
+    loop = asyncio.get_running_loop()
+    cpu_pool = None
+    if any(stage.cpu for stage in stages):
+        cpu_pool = ProcessPoolExecutor(max_workers=parse_workers or os.cpu_count() or 1)
+    queues = [asyncio.Queue(maxsize=stage.workers * 2) for stage in stages]
+
+    async def call(stage, item):
+        if stage.cpu:
+            return await loop.run_in_executor(cpu_pool, stage.fn, item)
+        return await stage.fn(item)
+
+    async def worker(index, stage):
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            entry = await inbox.get()
+            if entry is _DONE:
+                return
+            url, item = entry
+            try:
+                result = await call(stage, item)
+                if result is None:
+                    raise RuntimeError(f"{stage.name} returned nothing for {url}")
+            except Exception as e:
+                on_result(BatchResult(url, None, e))
+                continue
+            if outbox is None:
+                on_result(BatchResult(url, result, None))
+            else:
+                await outbox.put((url, result))
+
+    async def run_stage(index, stage):
+        await asyncio.gather(*(worker(index, stage) for _ in range(stage.workers)))
+        # Only once every worker here is done can the next stage be told to stop
+        if index + 1 < len(stages):
+            for _ in range(stages[index + 1].workers):
+                await queues[index + 1].put(_DONE)
+
+    async def feed():
+        for url in urls:
+            await queues[0].put((url, url))
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    try:
+        await asyncio.gather(feed(), *(run_stage(i, stage) for i, stage in enumerate(stages)))
+    finally:
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
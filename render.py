@@ -0,0 +1,176 @@
+import html
+import os
+import re
+import zipfile
+from urllib.parse import urlparse
+
+from archive import STORED_EXTENSIONS
+
+_PLACEHOLDER = re.compile(r"\{\{(!?)(\w+)\}\}")
+
+
+class Template:
+    """A template compiled once into literal text and placeholders.
+
+    ``{{name}}`` is HTML-escaped (quotes included, so it is safe inside
+    attributes) and ``{{!name}}`` is inserted as-is. Rendering appends
+    to a list of parts instead of building intermediate strings.
+    """
+
+    def __init__(self, source):
+        self.ops = []
+        pos = 0
+        for match in _PLACEHOLDER.finditer(source):
+            self.ops.append((source[pos:match.start()], match.group(2), match.group(1) == "!"))
+            pos = match.end()
+        self.ops.append((source[pos:], None, False))
+
+    def render_into(self, parts, **context):
+        for literal, name, raw in self.ops:
+            if literal:
+                parts.append(literal)
+            if name is not None:
+                value = str(context[name])
+                parts.append(value if raw else html.escape(value))
+        return parts
+
+    def render(self, **context):
+        return "".join(self.render_into([], **context))
+
+
+STYLE = """    <style>
+        body {
+            font-family: Arial, sans-serif;
+            line-height: 1.6;
+            margin: 20px;
+        }
+        .meta-info {
+            background-color: #f4f4f4;
+            padding: 10px;
+            margin-bottom: 20px;
+            border: 1px solid #ddd;
+        }
+        .meta-info h2 {
+            margin-top: 0;
+        }
+        .gallery ul {
+            list-style-type: none;
+            padding: 0;
+        }
+        .gallery li {
+            display: inline-block;
+            margin-right: 10px;
+        }
+        .gallery img {
+            max-width: 150px;
+            height: auto;
+        }
+    </style>
+"""
+
+PAGE_HEAD = Template("""<!DOCTYPE html>
+<html lang="tr">
+<head>
+    <meta charset="UTF-8">
+    <title>{{page_title}}</title>
+""" + STYLE + """</head>
+<body>
+    <div class="meta-info">
+        <h2>Meta Bilgileri</h2>
+        <p><strong>Permalink:</strong> <a href="{{permalink}}">{{permalink}}</a></p>
+        <ul>
+""")
+META_ITEM = Template("            <li><strong>{{key}}:</strong> {{value}}</li>\n")
+PAGE_CONTENT = Template("""        </ul>
+    </div>
+    <div class="page-content">
+{{!content}}
+    </div>
+    <!-- Galeri -->
+<div class='gallery'><h2>Gallery</h2><ul>""")
+GALLERY_ITEM = Template("<li><img src='{{src}}' alt='Görsel'></li>\n")
+PAGE_FOOT = Template("""</ul></div>
+</body>
+</html>
+""")
+
+INDEX_HEAD = Template("""<!DOCTYPE html>
+<html lang="tr">
+<head>
+    <meta charset="UTF-8">
+    <title>{{title}}</title>
+""" + STYLE + """</head>
+<body>
+    <h1>{{title}}</h1>
+    <ul>
+""")
+INDEX_ITEM = Template("        <li><a href=\"{{href}}\">{{page_title}}</a> <small>{{permalink}}</small></li>\n")
+INDEX_FOOT = Template("""    </ul>
+</body>
+</html>
+""")
+
+
+def render_page(parts, page_title, meta_details, content_html, gallery_images, permalink):
+    """Append the final HTML of one page to ``parts``; ``content_html`` is inserted unescaped."""
+    PAGE_HEAD.render_into(parts, page_title=page_title, permalink=permalink)
+    for key, value in meta_details.items():
+        META_ITEM.render_into(parts, key=key, value=value)
+    PAGE_CONTENT.render_into(parts, content=content_html)
+    for img_path in gallery_images:
+        GALLERY_ITEM.render_into(parts, src=img_path)
+    PAGE_FOOT.render_into(parts)
+    return parts
+
+
+def write_page(output_filename, page_title, meta_details, content_html, gallery_images, permalink):
+    parts = render_page([], page_title, meta_details, content_html, gallery_images, permalink)
+    with open(output_filename, "w", encoding="utf-8") as f:
+        f.writelines(parts)
+
+
+def page_filename(permalink, taken):
+    path = re.sub(r"\.html?$", "", urlparse(permalink).path.strip("/"))
+    stem = re.sub(r"[^\w.-]+", "_", path) or "home"
+    name = f"{stem}.html"
+    n = 1
+    # index.html is the archive's own table of contents
+    while name in taken or name == "index.html":
+        name = f"{stem}-{n}.html"
+        n += 1
+    taken.add(name)
+    return name
+
+
+def write_site(pages, archive_path, title="Site"):
+    """Write ``pages`` into one ZIP with an index.html linking every page.
+
+    ``pages`` is any iterable of dicts with the save_final_html arguments
+    (page_title, meta_details, content_html, gallery_images, permalink);
+    it is consumed once, so a generator that scrapes as it goes works.
+    Gallery images with relative paths are stored next to the pages.
+    Returns the number of pages written.
+    """
+    taken = set()
+    stored_images = set()
+    index = []
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for page in pages:
+            name = page_filename(page["permalink"], taken)
+            parts = render_page([], **page)
+            zf.writestr(name, "".join(parts))
+            index.append((name, page["page_title"], page["permalink"]))
+            for img_path in page["gallery_images"]:
+                arcname = os.path.normpath(img_path).replace(os.sep, "/")
+                if os.path.isabs(img_path) or arcname.startswith("..") or arcname in stored_images:
+                    continue
+                stored_images.add(arcname)
+                ext = os.path.splitext(arcname)[1].lower()
+                compress = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                zf.write(img_path, arcname, compress_type=compress)
+        parts = INDEX_HEAD.render_into([], title=title)
+        for name, page_title, permalink in index:
+            INDEX_ITEM.render_into(parts, href=name, page_title=page_title, permalink=permalink)
+        INDEX_FOOT.render_into(parts)
+        zf.writestr("index.html", "".join(parts))
+    return len(index)
@@ -0,0 +1,91 @@
+import re
+
+from bs4.dammit import EntitySubstitution
+from bs4.element import NavigableString, Tag
+
+ALLOWED_TAGS = frozenset(["p", "a", "ul", "ol", "li"])
+SKIPPED_TAGS = frozenset(["script", "style"])
+# Tags whose strings bs4 writes out unescaped while they are still inside them
+_CDATA_TAGS = frozenset(["script", "style"])
+
+# Shared with streaming.py, which has to serialize exactly like sanitize()
+WHITESPACE = re.compile(r"\s+")
+escape = EntitySubstitution.substitute_xml
+
+
+def opening_tag(tag):
+    """Return the ``(opening, closing)`` markup bs4 writes for ``tag``, without its contents."""
+    # Let bs4 format the attributes on an empty stand-in so nothing is copied
+    shell = Tag(name=tag.name, attrs=tag.attrs, can_be_empty_element=False)
+    return shell.decode()[:-len(f"</{tag.name}>")], f"</{tag.name}>"
+
+
+def sanitize(root, allowed_tags=ALLOWED_TAGS, skip_tags=SKIPPED_TAGS, collapse_whitespace=True):
+    """Serialize ``root`` keeping only ``allowed_tags``, without modifying the tree.
+
+    Produces the same string as deep-copying ``root``, unwrapping every
+    other descendant tag, clearing the attributes of the allowed ones and
+    serializing it: the root keeps its own tag and attributes, ``skip_tags``
+    are dropped with their contents, and with ``collapse_whitespace`` runs
+    of whitespace become one space and the result is stripped. The tree is
+    walked once and the output is built in a single list of parts.
+    """
+    out = []
+    last_space = True
+
+    def write_text(text):
+        nonlocal last_space
+        if not collapse_whitespace:
+            out.append(text)
+            return
+        text = WHITESPACE.sub(" ", text)
+        if last_space and text.startswith(" "):
+            text = text[1:]
+        if text:
+            out.append(text)
+            last_space = text.endswith(" ")
+
+    def write_markup(markup):
+        nonlocal last_space
+        out.append(markup)
+        last_space = False
+
+    closing_root = None
+    if isinstance(root, Tag) and root.name != "[document]":
+        opening, closing_root = opening_tag(root)
+        write_markup(WHITESPACE.sub(" ", opening) if collapse_whitespace else opening)
+
+    # Iterative walk: each stack entry is the children iterator of an open tag
+    # plus the closing markup to write when it is exhausted and whether the tag is kept
+    stack = [(iter(root.contents), None, True)]
+    while stack:
+        children, closing, kept = stack[-1]
+        for node in children:
+            name = node.name
+            if name is None:
+                if type(node) is NavigableString:
+                    write_text(escape(node))
+                elif not kept and node.parent.name in _CDATA_TAGS:
+                    # An unwrapped <script>/<style> no longer protects its text
+                    write_text(node.PREFIX + escape(node) + node.SUFFIX)
+                else:
+                    write_text(node.output_ready("minimal"))
+            elif name in skip_tags:
+                continue
+            elif name in allowed_tags:
+                write_markup(f"<{name}>")
+                stack.append((iter(node.contents), f"</{name}>", True))
+                break
+            else:
+                stack.append((iter(node.contents), None, False))
+                break
+        else:
+            stack.pop()
+            if closing:
+                write_markup(closing)
+
+    if closing_root:
+        write_markup(closing_root)
+    if collapse_whitespace and out and out[-1].endswith(" "):
+        out[-1] = out[-1][:-1]
+    return "".join(out)
@@ -0,0 +1,295 @@
+import asyncio
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+from downloader import DEFAULT_PER_HOST, DEFAULT_WORKERS, make_session
+from metrics import NULL_METRICS
+
+MAX_PER_HOST = 16
+# Retry-After values beyond this are treated as a sign to give up on the host for now, not to wait
+MAX_RETRY_AFTER = 600.0
+# Statuses that mean "slow down": always cut the host's concurrency, and retried for GET/HEAD
+THROTTLE_STATUSES = frozenset([429, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+DEFAULT_RETRIES = 2
+RETRY_DELAY = 1.0
+# Latency smoothing, and how far the smoothed latency may rise above the best seen before it counts as overload
+LATENCY_ALPHA = 0.2
+LATENCY_FACTOR = 2.0
+# Latencies below this are never treated as overload, however much they grow relative to the baseline
+MIN_SLOW_LATENCY = 0.25
+ROBOTS_TIMEOUT = 10
+ASYNC_POLL = 0.05
+
+
+def retry_after_seconds(response):
+    """Seconds the server asked us to wait in Retry-After (delta or HTTP date), or None."""
+    value = response.headers.get("Retry-After", "").strip()
+    if value.isdigit():
+        return float(value)
+    if value:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class _Host:
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.interval = 0.0  # robots.txt Crawl-delay / Request-rate spacing
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.robots = None  # None: not fetched yet; an Event while another thread fetches it
+
+
+class HostScheduler:
+    """Per-host concurrency and politeness for every request a run makes.
+
+    Each host starts at ``initial`` requests in flight and adapts with
+    AIMD: a request that comes back quickly raises its limit by 1/limit
+    (about one more slot per round of requests), while a 429/5xx, a
+    connection error or a latency above LATENCY_FACTOR times the best
+    seen halves it, at most once per round trip. Retry-After holds back
+    every request to the host until it has passed, and a robots.txt
+    Crawl-delay (or Request-rate) spaces request starts. Thread-safe;
+    coroutines use acquire_async().
+    """
+
+    def __init__(self, initial=DEFAULT_PER_HOST, max_per_host=MAX_PER_HOST, robots=True,
+                 user_agent="*", headers=None, metrics=NULL_METRICS):
+        self.initial = max(1, initial)
+        self.max_per_host = max(self.initial, max_per_host)
+        self.robots = robots
+        self.user_agent = user_agent
+        self.headers = headers or {}
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._hosts = {}
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _Host(self.initial)
+        return state
+
+    def prepare(self, url, method="GET"):
+        """Read the host's robots.txt before its first GET; a no-op afterwards."""
+        if not self.robots or method not in IDEMPOTENT_METHODS:
+            return
+        parts = urlsplit(url)
+        with self._cond:
+            state = self._host(parts.netloc)
+            if state.robots is True:
+                return
+            pending = state.robots
+            if pending is None:
+                state.robots = threading.Event()
+        if pending is not None:
+            # Another thread is already fetching it
+            pending.wait(ROBOTS_TIMEOUT)
+            return
+        interval = self._robots_interval(f"{parts.scheme}://{parts.netloc}/robots.txt")
+        with self._cond:
+            done, state.robots = state.robots, True
+            state.interval = interval
+        done.set()
+
+    def _robots_interval(self, robots_url):
+        # Fetched outside the scheduler; a missing or broken robots.txt means no delay.
+        # urllib.robotparser only understands whole-second Crawl-delay values
+        try:
+            response = requests.get(robots_url, headers=self.headers, timeout=ROBOTS_TIMEOUT)
+        except requests.RequestException:
+            return 0.0
+        if response.status_code != 200:
+            return 0.0
+        parser = RobotFileParser()
+        parser.parse(response.text.splitlines())
+        parser.modified()  # crawl_delay() answers nothing for a parser that was never "read"
+        delay = parser.crawl_delay(self.user_agent) or 0
+        rate = parser.request_rate(self.user_agent)
+        if rate and rate.requests:
+            delay = max(delay, rate.seconds / rate.requests)
+        return float(delay)
+
+    def _try_start(self, state):
+        # 0 when a slot was taken; otherwise seconds to wait, or None to wait for a release
+        now = time.monotonic()
+        if state.in_flight >= int(state.limit):
+            return None
+        if now < state.next_start:
+            return state.next_start - now
+        state.in_flight += 1
+        state.next_start = max(state.next_start, now + state.interval)
+        return 0
+
+    def acquire(self, url, method="GET"):
+        """Block until a request to ``url``'s host may start; returns the host to release()."""
+        self.prepare(url, method)
+        host = urlsplit(url).netloc
+        with self._cond:
+            state = self._host(host)
+            while True:
+                wait = self._try_start(state)
+                if wait == 0:
+                    return host
+                self._cond.wait(wait)
+
+    async def acquire_async(self, url, method="GET"):
+        await asyncio.to_thread(self.prepare, url, method)
+        host = urlsplit(url).netloc
+        while True:
+            with self._cond:
+                wait = self._try_start(self._host(host))
+            if wait == 0:
+                return host
+            await asyncio.sleep(ASYNC_POLL if wait is None else wait)
+
+    def release(self, host, latency=None, status=None, error=False, retry_after=None):
+        """Free the slot taken by acquire() and adapt the host's limit to how the request went."""
+        now = time.monotonic()
+        with self._cond:
+            state = self._hosts[host]
+            state.in_flight -= 1
+            if retry_after is not None:
+                state.next_start = max(state.next_start, now + min(retry_after, MAX_RETRY_AFTER))
+            reason = None
+            if error:
+                reason = "error"
+            elif status in THROTTLE_STATUSES:
+                reason = str(status)
+            elif latency is not None:
+                state.latency = latency if state.latency is None else \
+                    state.latency + LATENCY_ALPHA * (latency - state.latency)
+                # The baseline follows improvements at once and degradations slowly
+                if state.baseline is None or state.latency < state.baseline:
+                    state.baseline = state.latency
+                else:
+                    state.baseline += 0.01 * (state.latency - state.baseline)
+                if state.latency > MIN_SLOW_LATENCY and state.latency > LATENCY_FACTOR * state.baseline:
+                    reason = "latency"
+            if reason is None:
+                state.limit = min(self.max_per_host, state.limit + 1 / state.limit)
+            elif now - state.last_decrease >= max(state.latency or 0.0, 1.0):
+                # Requests already in flight report the same overload; count it once
+                state.limit = max(1.0, state.limit / 2)
+                state.last_decrease = now
+                self.metrics.incr("throttled_total", reason=reason)
+            self._cond.notify_all()
+
+    def snapshot(self):
+        """``{host: (limit, in flight, crawl delay)}`` for progress reports."""
+        with self._cond:
+            return {host: (int(s.limit), s.in_flight, s.interval) for host, s in self._hosts.items()}
+
+
+class ScheduledAdapter(BaseAdapter):
+    """Sends every request through a HostScheduler, then through ``adapter``.
+
+    The slot is held until the body has been read (or, for streamed
+    responses, until the response is closed), so the limit covers the
+    whole transfer. Throttled GET/HEAD requests are retried up to
+    ``retries`` times after the server's Retry-After; other methods get
+    the throttled response back. Any adapter can be wrapped, e.g. a WARC
+    RecordingAdapter.
+    """
+
+    def __init__(self, scheduler, adapter=None, retries=DEFAULT_RETRIES):
+        super().__init__()
+        self.scheduler = scheduler
+        self.adapter = adapter or HTTPAdapter()
+        self.retries = retries
+
+    def send(self, request, stream=False, **kwargs):
+        retries = self.retries if request.method in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            host = self.scheduler.acquire(request.url, request.method)
+            start = time.monotonic()
+            try:
+                response = self.adapter.send(request, stream=True, **kwargs)
+                latency = time.monotonic() - start
+                if not stream:
+                    response.content
+            except Exception:
+                self.scheduler.release(host, error=True)
+                raise
+            throttled = response.status_code in THROTTLE_STATUSES
+            retry_after = retry_after_seconds(response)
+            if throttled and retry_after is None:
+                retry_after = RETRY_DELAY * 2 ** attempt
+            if stream and not (throttled and attempt < retries):
+                _release_on_close(response, self.scheduler, host, latency, retry_after)
+            else:
+                self.scheduler.release(host, latency, response.status_code, retry_after=retry_after)
+            if not throttled or attempt == retries or (retry_after or 0) > MAX_RETRY_AFTER:
+                return response
+            response.close()
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def _release_on_close(response, scheduler, host, latency, retry_after):
+    released = []
+    response_status = response.status_code
+
+    def release():
+        if not released:
+            released.append(True)
+            scheduler.release(host, latency, response_status, retry_after=retry_after)
+
+    # Neither function may hold the response itself: that would make a cycle through
+    # response.close, and the finalizer would wait for the cycle collector
+    response_ref = weakref.ref(response)
+    close = type(response).close
+
+    def close_and_release():
+        try:
+            target = response_ref()
+            if target is not None:
+                close(target)
+        finally:
+            release()
+    response.close = close_and_release
+    # A response that is dropped without being closed still gives its slot back
+    weakref.finalize(response, release)
+
+
+def scheduled_session(scheduler, headers=None, pool_size=DEFAULT_WORKERS, adapter=None, retries=DEFAULT_RETRIES):
+    """A pooled session (see downloader.make_session) whose requests go through ``scheduler``.
+
+    The pool holds at least ``scheduler.max_per_host`` connections, so a
+    host whose limit has grown never has its extra connections discarded.
+    """
+    pool_size = max(pool_size, scheduler.max_per_host)
+    adapter = adapter or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    return make_session(headers, adapter=ScheduledAdapter(scheduler, adapter, retries=retries))
+
+
+def add_scheduler_arguments(arg_parser):
+    arg_parser.add_argument("--no-scheduler", action="store_true",
+                            help="don't adapt per-host concurrency, honor Retry-After or read robots.txt")
+    arg_parser.add_argument("--max-per-host", type=int, default=MAX_PER_HOST, metavar="N",
+                            help="most requests in flight to one host once the scheduler has ramped up")
+    arg_parser.add_argument("--ignore-robots", action="store_true",
+                            help="don't read robots.txt for a Crawl-delay")
+
+
+def open_scheduler(args, headers=None, metrics=NULL_METRICS):
+    if args.no_scheduler:
+        return None
+    return HostScheduler(max_per_host=args.max_per_host, robots=not args.ignore_robots,
+                         headers=headers, metrics=metrics)
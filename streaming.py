@@ -0,0 +1,314 @@
+import codecs
+import hashlib
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from bs4.element import CData, Comment, Declaration, Doctype, ProcessingInstruction, Tag
+
+from downloader import make_session
+from sanitizer import ALLOWED_TAGS, SKIPPED_TAGS, WHITESPACE, escape, opening_tag
+
+DEFAULT_MAX_PAGE_BYTES = 20 * 1024 * 1024
+STREAM_CHUNK = 64 * 1024
+# Elements bs4 never expects a closing tag for, so they are never "open"
+VOID_TAGS = frozenset(["area", "base", "br", "col", "embed", "hr", "img", "input", "keygen",
+                       "link", "meta", "param", "source", "track", "wbr", "basefont", "bgsound",
+                       "command", "frame", "image", "isindex", "menuitem", "nextid", "spacer"])
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class PageTooLarge(Exception):
+    """Raised when a streamed page exceeds its byte limit."""
+
+
+class _Output:
+    """Serialized content, built with the same rules as sanitize() with collapse_whitespace."""
+
+    def __init__(self):
+        self.parts = []
+        self.last_space = True
+
+    def write_text(self, text):
+        text = WHITESPACE.sub(" ", text)
+        if self.last_space and text.startswith(" "):
+            text = text[1:]
+        if text:
+            self.parts.append(text)
+            self.last_space = text.endswith(" ")
+
+    def write_markup(self, markup):
+        self.parts.append(markup)
+        self.last_space = False
+
+    def value(self):
+        content = "".join(self.parts)
+        return content[:-1] if content.endswith(" ") else content
+
+
+class StreamingExtractor(HTMLParser):
+    """Pulls the extract_page fields out of HTML fed to it in pieces.
+
+    No tree is built: only the stack of open tag names, the first <title>
+    and <h1> text, the meta tags, image and link URLs and the cleaned body
+    are kept. The content follows sanitize(soup.body or soup) for
+    html.parser soups: allowed tags without attributes, script/style
+    dropped, other tags unwrapped, whitespace collapsed and end tags
+    closing everything opened after the matching start tag. Until a
+    <body> start tag arrives the whole document is cleaned as well, so a
+    page or fragment without one still has content.
+    """
+
+    def __init__(self, allowed_tags=ALLOWED_TAGS, skip_tags=SKIPPED_TAGS):
+        super().__init__(convert_charrefs=True)
+        self.allowed_tags = allowed_tags
+        self.skip_tags = skip_tags
+        self.open_tags = []
+        self.skipping = 0
+        self.title_parts = None
+        self.h1_parts = None
+        self.capture = None
+        self.pending = []
+        self.meta_tags = {}
+        self.og_title = self.name_title = self.description = None
+        self.image_srcs = []
+        self.links = []
+        self.body_attrs = None
+        self.body_closed = False
+        self.body = _Output()
+        # The soup itself, for documents that turn out to have no <body>; dropped once one starts
+        self.document = _Output()
+
+    # Content output
+
+    def in_content(self):
+        return self.body_attrs is not None and not self.body_closed and not self.skipping
+
+    def outputs(self):
+        if self.skipping:
+            return ()
+        if self.document is not None:
+            return (self.document,)
+        return (self.body,) if self.in_content() else ()
+
+    def write_text(self, text):
+        for output in self.outputs():
+            output.write_text(text)
+
+    def write_markup(self, markup):
+        for output in self.outputs():
+            output.write_markup(markup)
+
+    # Parser callbacks
+
+    def flush_capture(self):
+        # The parser may split one string across calls; bs4 strips the joined string
+        if self.pending:
+            part = "".join(self.pending).strip()
+            self.pending = []
+            if part and self.capture is not None:
+                (self.title_parts if self.capture[0] == "title" else self.h1_parts).append(part)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_capture()
+        attrs = {name: value or "" for name, value in attrs}
+        if tag == "meta":
+            self.handle_meta(attrs)
+        elif tag == "img":
+            if attrs.get("src"):
+                self.image_srcs.append(attrs["src"])
+        elif tag == "a" and "href" in attrs:
+            self.links.append(attrs["href"])
+        elif tag == "title" and self.title_parts is None:
+            self.title_parts = []
+            self.capture = ("title", len(self.open_tags))
+        elif tag == "h1" and self.h1_parts is None:
+            self.h1_parts = []
+            self.capture = ("h1", len(self.open_tags))
+        elif tag == "body" and self.body_attrs is None:
+            self.body_attrs = attrs
+            self.document = None
+            opening, _ = opening_tag(Tag(name="body", attrs=attrs))
+            self.write_markup(WHITESPACE.sub(" ", opening))
+        if tag in VOID_TAGS:
+            return
+        if tag in self.skip_tags:
+            self.skipping += 1
+        elif tag in self.allowed_tags:
+            self.write_markup(f"<{tag}>")
+        self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self.flush_capture()
+        if tag not in self.open_tags:
+            return
+        # Like bs4, an end tag also closes everything opened inside the matching start tag
+        while self.open_tags:
+            name = self.open_tags.pop()
+            self.close(name)
+            if name == tag:
+                break
+
+    def close(self, name):
+        if self.capture is not None and len(self.open_tags) == self.capture[1]:
+            self.capture = None
+        if name in self.skip_tags:
+            self.skipping -= 1
+        elif name in self.allowed_tags:
+            self.write_markup(f"</{name}>")
+        elif name == "body" and self.in_content():
+            self.write_markup("</body>")
+            self.body_closed = True
+
+    def handle_data(self, data):
+        # get_text() leaves out script/style strings
+        if self.capture is not None and not self.skipping:
+            self.pending.append(data)
+        self.write_text(escape(data))
+
+    def handle_comment(self, data):
+        self.flush_capture()
+        self.write_text(Comment(data).output_ready("minimal"))
+
+    # Declarations become the same strings bs4's html.parser builder makes of them
+
+    def handle_decl(self, decl):
+        self.flush_capture()
+        self.write_text(Doctype(decl[len("DOCTYPE "):]).output_ready("minimal"))
+
+    def unknown_decl(self, data):
+        self.flush_capture()
+        if data.upper().startswith("CDATA["):
+            self.write_text(CData(data[len("CDATA["):]).output_ready("minimal"))
+        else:
+            self.write_text(Declaration(data).output_ready("minimal"))
+
+    def handle_pi(self, data):
+        self.flush_capture()
+        self.write_text(ProcessingInstruction(data).output_ready("minimal"))
+
+    def handle_meta(self, attrs):
+        meta_name = attrs.get("name")
+        meta_property = attrs.get("property")
+        if self.og_title is None and meta_property == "og:title":
+            self.og_title = attrs
+        if meta_name == "title" and self.name_title is None:
+            self.name_title = attrs
+        elif meta_name == "description" and self.description is None:
+            self.description = attrs
+        key = meta_name or meta_property
+        content = attrs.get("content")
+        if key and content:
+            self.meta_tags[key] = content.strip()
+
+    def finish(self, fallback_title="Title not found", fallback_description="Meta description not found"):
+        """Flush the parser and return the fields extractor.extract_fields() would."""
+        self.close_parser()
+        page_title = "".join(self.h1_parts or [])
+        if not page_title:
+            page_title = "".join(self.title_parts) if self.title_parts is not None else fallback_title
+        meta_title = None
+        if self.og_title is not None:
+            meta_title = self.og_title.get("content")
+        if not meta_title and self.name_title is not None:
+            meta_title = self.name_title.get("content")
+        meta_title = meta_title.strip() if meta_title else page_title
+        if self.description is not None:
+            meta_description = self.description.get("content", "").strip()
+        else:
+            meta_description = fallback_description
+        content = (self.body if self.document is None else self.document).value()
+        return {
+            "page_title": page_title,
+            "meta_title": meta_title,
+            "meta_description": meta_description,
+            "meta_tags": self.meta_tags,
+            "image_srcs": self.image_srcs,
+            "links": self.links,
+            "content": content,
+        }
+
+    def close_parser(self):
+        HTMLParser.close(self)
+        self.flush_capture()
+        while self.open_tags:
+            self.close(self.open_tags.pop())
+
+
+def sniff_encoding(response, first_chunk):
+    # The Content-Type charset wins, then a <meta charset> near the top, then UTF-8
+    if "charset" in response.headers.get("Content-Type", "").lower() and response.encoding:
+        return response.encoding
+    match = _META_CHARSET.search(first_chunk[:4096])
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def stream_page(url, headers=None, session=None, max_bytes=DEFAULT_MAX_PAGE_BYTES,
+                chunk_size=STREAM_CHUNK, state=None):
+    """Fetch ``url`` and extract its fields while the body is still arriving.
+
+    Each chunk is decoded with an incremental decoder and fed straight to a
+    StreamingExtractor, so memory holds one chunk plus the extracted fields
+    rather than the page and its tree. PageTooLarge is raised as soon as
+    the page is known to exceed ``max_bytes``. Returns a dict shaped like
+    make.extract_page()'s, plus ``sha256`` and ``size`` of the raw body.
+    With a fetch_state.FetchState the request is conditional; the caller
+    decides what an unchanged page means.
+    """
+    own_session = session is None
+    if own_session:
+        session = make_session(headers, pool_size=1)
+    try:
+        return _stream_page(url, headers, session, max_bytes, chunk_size, state)
+    finally:
+        if own_session:
+            session.close()
+
+
+def _stream_page(url, headers, session, max_bytes, chunk_size, state):
+    request_headers = dict(headers or {})
+    if state is not None:
+        request_headers.update(state.conditional_headers(url))
+    with session.get(url, headers=request_headers, timeout=30, stream=True) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length", "")
+        if max_bytes and length.isdigit() and int(length) > max_bytes:
+            raise PageTooLarge(f"{url}: {length} bytes exceeds limit of {max_bytes}")
+        extractor = StreamingExtractor()
+        digest = hashlib.sha256()
+        size = 0
+        decoder = None
+        for chunk in response.iter_content(chunk_size):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise PageTooLarge(f"{url}: body exceeds limit of {max_bytes} bytes")
+            digest.update(chunk)
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(sniff_encoding(response, chunk))(errors="replace")
+            extractor.feed(decoder.decode(chunk))
+        if decoder is not None:
+            extractor.feed(decoder.decode(b"", final=True))
+        fields = extractor.finish()
+        status, response_headers = response.status_code, response.headers
+    return {
+        "page_title": fields["page_title"],
+        "meta_title": fields["meta_title"],
+        "meta_description": fields["meta_description"],
+        "permalink": url,
+        "content": fields["content"],
+        "image_urls": [urljoin(url, src) for src in fields["image_srcs"]],
+        "status": status,
+        "headers": response_headers,
+        "sha256": digest.hexdigest(),
+        "size": size,
+    }
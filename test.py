@@ -1,5 +1,6 @@
 import requests
-from bs4 import BeautifulSoup
+from parsing import CONTENT_ONLY, make_soup
+from text_extract import extract_text
 
 # 🌟 Kullanıcı bilgilerini tarayıcı gibi göstermek için sahte User-Agent
 HEADERS = {
@@ -12,7 +13,7 @@ COOKIES = {
 }
 
 # 🌟 Web sayfasını kazıyan fonksiyon
-def scrape_and_save(url, filename):
+def scrape_and_save(url, filename, fmt="text"):
     session = requests.Session()
     session.headers.update(HEADERS)  # Headers güncelle
     session.cookies.update(COOKIES)  # Çerezleri ekle (varsa)
@@ -28,14 +29,14 @@ def scrape_and_save(url, filename):
             print(f"⚠️ Hata: Sayfa {response.status_code} ile yanıt verdi.")
             return
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+        # Sadece başlık, içerik ve görsel etiketleri ağaca alınır
+        soup = make_soup(response.text, parse_only=CONTENT_ONLY)
 
         # 🏆 Sayfa başlığı (H1)
         title = soup.find('h1').text.strip() if soup.find('h1') else "Başlık bulunamadı"
 
-        # 📜 Temel içerik (p, a, ul, ol, li)
-        content_tags = soup.find_all(['p', 'a', 'ul', 'ol', 'li'])
-        content = "\n".join(tag.get_text(strip=True) for tag in content_tags)
+        # 📜 Temel içerik (p, a, ul, ol, li): ağaç bir kez gezilir, iç içe etiketlerin metni tek sefer yazılır
+        content = extract_text(soup, fmt)
 
         # 🖼️ Medya içerikleri (img kaynakları)
         media = [img['src'] for img in soup.find_all('img') if 'src' in img.attrs]
@@ -57,6 +58,8 @@ def scrape_and_save(url, filename):
 # 🌍 Kullanılacak URL ve dosya adı
 URL = "https://www.ellindecoratie.nl/boomstam-bijzettafeltje"
 FILENAME = "ellindecoratie_verileri.txt"
+# 📝 İçerik biçimi: "text" (satır başına bir blok) veya "markdown" (liste işaretleri ve [metin](link))
+FORMAT = "text"
 
 # 🚀 Web sitesini kazı ve verileri dosyaya kaydet
-scrape_and_save(URL, FILENAME)
+scrape_and_save(URL, FILENAME, FORMAT)
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+
+from archive import ImageArchive
+from conftest import ROOT
+
+
+def write_images(folder, count, size=200_000):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(folder, f"{i}.bin"), "wb") as f:
+            f.write(os.urandom(size))
+
+
+def test_threads_take_turns_on_one_archive(tmp_path):
+    folders = [str(tmp_path / f"images_{n}") for n in range(4)]
+    for folder in folders:
+        write_images(folder, 5)
+    zip_path = str(tmp_path / "images.zip")
+    inside = []
+    overlaps = []
+
+    def sync(folder):
+        with ImageArchive(zip_path) as archive:
+            inside.append(folder)
+            if len(inside) > 1:
+                overlaps.append(list(inside))
+            archive.sync(folder)
+            time.sleep(0.01)
+            inside.remove(folder)
+
+    threads = [threading.Thread(target=sync, args=(folder,)) for folder in folders * 3]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == []
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == [f"{i}.bin" for i in range(5)]
+
+
+def test_another_process_waits_for_the_archive(tmp_path):
+    folder = str(tmp_path / "images")
+    write_images(folder, 2)
+    zip_path = str(tmp_path / "images.zip")
+    code = ("import sys; sys.path.insert(0, sys.argv[1]); from archive import ImageArchive\n"
+            "with ImageArchive(sys.argv[2]) as archive: archive.sync(sys.argv[3])\n")
+    with ImageArchive(zip_path) as archive:
+        archive.add(os.path.join(folder, "0.bin"))
+        other = subprocess.Popen([sys.executable, "-c", code, ROOT, zip_path, folder])
+        time.sleep(1)
+        assert other.poll() is None
+    assert other.wait(timeout=30) == 0
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == ["0.bin", "1.bin"]
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from server import CorpusHandler, serve
+
+import async_http
+from async_http import AsyncHttp
+from fetch_state import FetchState
+from image_store import ImageStore
+
+
+class StatusLog(CorpusHandler):
+    """Serves files (answering If-Modified-Since with 304) and logs each GET's status in ``statuses``."""
+
+    statuses = []
+
+    def log_request(self, code="-", size="-"):
+        self.statuses.append(int(code))
+
+
+@pytest.fixture(params=["aiohttp", "threads"])
+def mode(request, monkeypatch):
+    if request.param == "aiohttp":
+        pytest.importorskip("aiohttp")
+    else:
+        monkeypatch.setattr(async_http, "aiohttp", None)
+    return request.param
+
+
+@pytest.mark.filterwarnings("ignore:aiohttp is not installed")
+@pytest.mark.parametrize("use_store", [False, True])
+def test_pipeline_downloads_revalidate_stored_images(tmp_path, monkeypatch, mode, use_store):
+    monkeypatch.setattr(StatusLog, "statuses", [])
+    site = tmp_path / "site"
+    site.mkdir()
+    (site / "a.png").write_bytes(b"png" * 100)
+    state = FetchState(str(tmp_path / "state.sqlite"))
+    store = ImageStore(str(tmp_path / "store")) if use_store else None
+
+    async def download(base_url):
+        async with AsyncHttp() as http:
+            return await http.download_images([f"{base_url}/a.png"], str(tmp_path / "images"),
+                                              store=store, state=state)
+
+    with serve(str(site), handler=StatusLog) as base_url:
+        first = asyncio.run(download(base_url))
+        second = asyncio.run(download(base_url))
+
+    assert StatusLog.statuses == [200, 304]
+    assert first[0].ok and second[0].ok
+    assert second[0].sha256 == first[0].sha256 and second[0].size == 300
+    assert state.get(f"{base_url}/a.png")[2] == first[0].sha256
+    state.close()
+    if store is not None:
+        store.close()
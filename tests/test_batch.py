@@ -0,0 +1,102 @@
+import gzip
+import threading
+import time
+import zipfile
+
+import pytest
+
+from batch import read_url_list, run_batch
+from server import serve
+
+NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def urlset(*urls):
+    return f"<urlset {NS}>" + "".join(f"<url><loc>{url}</loc></url>" for url in urls) + "</urlset>"
+
+
+def sitemapindex(*locs):
+    return f"<sitemapindex {NS}>" + "".join(f"<sitemap><loc>{loc}</loc></sitemap>" for loc in locs) + \
+        "</sitemapindex>"
+
+
+def test_plain_list_and_urlset(tmp_path):
+    (tmp_path / "urls.txt").write_text("# pages\nhttps://a/1\n\nhttps://a/2\n")
+    (tmp_path / "sitemap.xml").write_text(urlset("https://a/1", "https://a/2"))
+    assert read_url_list(str(tmp_path / "urls.txt")) == ["https://a/1", "https://a/2"]
+    assert read_url_list(str(tmp_path / "sitemap.xml")) == ["https://a/1", "https://a/2"]
+
+
+def test_sitemap_index_expands_child_sitemaps(tmp_path):
+    (tmp_path / "pages.xml").write_text(urlset("https://a/1", "https://a/2"))
+    (tmp_path / "posts.xml.gz").write_bytes(gzip.compress(urlset("https://a/3").encode()))
+    with serve(str(tmp_path)) as base:
+        (tmp_path / "index.xml").write_text(sitemapindex(f"{base}/pages.xml", f"{base}/posts.xml.gz", "pages.xml"))
+        urls = read_url_list(str(tmp_path / "index.xml"))
+    # pages.xml is listed twice, once by URL and once by path; both are read
+    assert urls == ["https://a/1", "https://a/2", "https://a/3", "https://a/1", "https://a/2"]
+
+
+def test_sitemap_index_loops_and_deep_nesting(tmp_path):
+    (tmp_path / "loop.xml").write_text(sitemapindex("loop.xml"))
+    assert read_url_list(str(tmp_path / "loop.xml")) == []
+    for i in range(4):
+        (tmp_path / f"index{i}.xml").write_text(sitemapindex(f"index{i + 1}.xml"))
+    (tmp_path / "index4.xml").write_text(urlset("https://a/1"))
+    with pytest.raises(ValueError):
+        read_url_list(str(tmp_path / "index0.xml"))
+
+
+def test_duplicated_sitemap_entry_is_processed_once(tmp_path):
+    (tmp_path / "sitemap.xml").write_text(urlset("https://a/page", "https://a/other", "https://a/page"))
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return {"permalink": url}
+
+    results = list(run_batch(read_url_list(str(tmp_path / "sitemap.xml")), fetch, None, fetch_workers=4))
+    assert sorted(fetched) == ["https://a/other", "https://a/page"]
+    assert sorted(result.url for result in results) == ["https://a/other", "https://a/page"]
+
+
+def test_pages_with_the_same_finish_key_never_finish_together():
+    lock = threading.Lock()
+    running = {}
+    overlaps = []
+
+    def finish(page):
+        key = page["key"]
+        with lock:
+            running[key] = running.get(key, 0) + 1
+            overlaps.append(running[key])
+        time.sleep(0.02)
+        with lock:
+            running[key] -= 1
+        return page
+
+    urls = [f"https://a/{key}?v={i}" for i in range(6) for key in ("x", "y")]
+    results = list(run_batch(urls, lambda url: {"key": url.split("/")[3].split("?")[0]}, None, finish,
+                             fetch_workers=8, finish_key=lambda url: url.split("?")[0]))
+    assert len(results) == 12 and all(result.error is None for result in results)
+    assert max(overlaps) == 1
+
+
+def test_make_batch_with_a_duplicated_sitemap_entry_builds_a_valid_zip(tmp_path, monkeypatch):
+    import make
+
+    site = tmp_path / "site"
+    site.mkdir()
+    images = "".join(f"<img src='/i{i}.jpg'>" for i in range(10))
+    (site / "page.html").write_text(f"<html><body><h1>P</h1>{images}</body></html>")
+    for i in range(10):
+        (site / f"i{i}.jpg").write_bytes(bytes([i]) * 20000)
+    monkeypatch.chdir(tmp_path)
+    with serve(str(site)) as base:
+        (tmp_path / "sitemap.xml").write_text(urlset(f"{base}/page.html", f"{base}/page.html?utm=1",
+                                                     f"{base}/page.html"))
+        make.run_batch_mode(read_url_list(str(tmp_path / "sitemap.xml")), {}, None, workers=4)
+    with zipfile.ZipFile(tmp_path / "page.html_images.zip") as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == sorted(f"i{i}.jpg" for i in range(10))
+    assert not list(tmp_path.glob("*.tmp")) and not list((tmp_path / "page.html_images").glob("*.part"))
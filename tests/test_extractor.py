@@ -0,0 +1,40 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from bench_extract import extract_meta
+from extractor import extract_fields
+
+OG = {"none": "", "bare": '<meta property="og:title">', "empty": '<meta property="og:title" content="">',
+      "blank": '<meta property="og:title" content="  ">', "set": '<meta property="og:title" content=" O ">'}
+NAME = {"none": "", "bare": '<meta name="title">', "empty": '<meta name="title" content="">',
+        "set": '<meta name="title" content=" N ">'}
+
+
+def soup_for(head):
+    return BeautifulSoup(f"<html><head><title>T</title>{head}</head><body></body></html>", "html.parser")
+
+
+@pytest.mark.parametrize("og", OG)
+@pytest.mark.parametrize("name", NAME)
+def test_meta_title_matches_the_old_extract_meta(og, name):
+    soup = soup_for(OG[og] + NAME[name])
+    try:
+        expected = extract_meta(soup, "T")[0]
+    except AttributeError:
+        pytest.skip("extract_meta() crashed on this page")
+    assert extract_fields(soup)["meta_title"] == expected
+
+
+def test_meta_title_where_extract_meta_crashed():
+    assert extract_fields(soup_for(NAME["set"]))["meta_title"] == "N"
+    assert extract_fields(soup_for(NAME["empty"]))["meta_title"] == ""
+    assert extract_fields(soup_for(OG["empty"]))["meta_title"] == "T"
+    assert extract_fields(soup_for(OG["bare"] + NAME["bare"]))["meta_title"] == "T"
+    # A blank og:title still wins over name="title", as before
+    assert extract_fields(soup_for(OG["blank"] + NAME["set"]))["meta_title"] == ""
+
+
+def test_meta_description_without_content():
+    fields = extract_fields(soup_for('<meta name="description">'))
+    assert fields["meta_description"] == ""
+    assert extract_fields(soup_for(""))["meta_description"] == "Meta description not found"
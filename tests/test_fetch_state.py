@@ -0,0 +1,25 @@
+from requests.structures import CaseInsensitiveDict
+
+from fetch_state import FetchState
+
+
+def test_staged_validators_survive_lower_case_headers(tmp_path):
+    state = FetchState(str(tmp_path / "state.sqlite"))
+    headers = {"etag": '"v1"', "last-modified": "Wed, 01 Jan 2025 00:00:00 GMT"}
+    state.stage("http://example.test/", CaseInsensitiveDict(headers), "abc")
+    state.stage("http://example.test/plain", headers, "def")
+    assert state.get("http://example.test/") is None
+    state.commit("http://example.test/")
+    state.commit("http://example.test/plain")
+    for url, sha256 in [("http://example.test/", "abc"), ("http://example.test/plain", "def")]:
+        assert state.get(url) == ('"v1"', "Wed, 01 Jan 2025 00:00:00 GMT", sha256)
+        assert state.conditional_headers(url) == {"If-None-Match": '"v1"',
+                                                  "If-Modified-Since": "Wed, 01 Jan 2025 00:00:00 GMT"}
+    state.close()
+
+
+def test_recorded_validators_ignore_header_case(tmp_path):
+    state = FetchState(str(tmp_path / "state.sqlite"))
+    state.record("http://example.test/a.png", {"ETAG": "x", "Last-Modified": "y"}, "abc")
+    assert state.get("http://example.test/a.png") == ("x", "y", "abc")
+    state.close()
@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+from jsonl import JsonlWriter, part_paths, read_records
+
+CRASHING_RUN = """
+import os, sys
+sys.path.insert(0, sys.argv[1])
+from jsonl import JsonlWriter
+writer = JsonlWriter(sys.argv[2], max_bytes=int(sys.argv[3]) or None)
+for i in range(int(sys.argv[4]), int(sys.argv[5])):
+    writer.write({"i": i})
+os._exit(0)  # killed before close(): the last gzip member has no end marker
+"""
+
+
+def crash_while_writing(path, start, stop, max_bytes=0):
+    subprocess.run([sys.executable, "-c", CRASHING_RUN, ROOT, path, str(max_bytes), str(start), str(stop)],
+                   check=True)
+
+
+def test_a_run_after_a_crash_starts_a_new_gzip_part(tmp_path):
+    path = str(tmp_path / "out.jsonl.gz")
+    crash_while_writing(path, 0, 100)
+    crash_while_writing(path, 100, 150)
+    with JsonlWriter(path) as writer:
+        writer.write({"i": 150})
+    assert part_paths(path) == [path] + [str(tmp_path / f"out-0000{n}.jsonl.gz") for n in (1, 2)]
+    assert [record["i"] for record in read_records(path)] == list(range(151))
+
+
+def test_rotated_gzip_parts_are_not_reopened_after_a_crash(tmp_path):
+    path = str(tmp_path / "out.jsonl.gz")
+    crash_while_writing(path, 0, 100, max_bytes=500)
+    parts = part_paths(path)
+    with JsonlWriter(path, max_bytes=500) as writer:
+        writer.write({"i": 100})
+    assert part_paths(path)[:-1] == parts
+    assert [record["i"] for record in read_records(path)] == list(range(101))
+
+
+def test_plain_output_is_appended_to(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    for i in range(2):
+        with JsonlWriter(path) as writer:
+            writer.write({"i": i})
+    assert part_paths(path) == [path]
+    assert [record["i"] for record in read_records(path)] == [0, 1]
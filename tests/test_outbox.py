@@ -0,0 +1,93 @@
+import email
+import os
+import sqlite3
+import zipfile
+
+from server import CorpusHandler, serve
+
+import make
+from fetch_state import FetchState
+from outbox import DeliveryWorker, Outbox
+
+
+class RecordingWebhook(CorpusHandler):
+    """Answers every POST with 200 and keeps its Content-Type and body in ``posts``."""
+
+    posts = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.posts.append((self.headers["Content-Type"], body))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def form_parts(content_type, body):
+    # [(field name, filename, content type, value)] in the order they were sent
+    message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    return [(part.get_param("name", header="Content-Disposition"), part.get_filename(),
+             part.get_content_type(), part.get_payload(decode=True))
+            for part in message.get_payload()]
+
+
+def make_bundle(tmp_path):
+    zip_path = str(tmp_path / "example.test_images.zip")
+    if not os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            archive.writestr("a.png", b"png")
+    return {"page_title": "Başlık", "meta_title": "Meta", "meta_description": "",
+            "permalink": "http://example.test/page", "content": "<p>x</p>", "zip_file_path": zip_path}
+
+
+def test_outbox_sends_what_send_bundle_sends(tmp_path, monkeypatch):
+    monkeypatch.setattr(RecordingWebhook, "posts", [])
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    with serve(str(tmp_path), handler=RecordingWebhook) as base_url:
+        webhook_url = f"{base_url}/webhook"
+        assert make.send_bundle(make_bundle(tmp_path), webhook_url)
+        outbox.put(make_bundle(tmp_path))
+        assert DeliveryWorker(outbox, webhook_url).deliver(outbox.claim(1))
+
+    direct, queued = (form_parts(*post) for post in RecordingWebhook.posts)
+    assert queued == direct
+    assert direct[-1][:3] == ("zip_file", "example.test_images.zip", "application/zip")
+    assert outbox.counts() == {"sent": 1}
+    assert os.listdir(outbox.files_dir) == []
+    outbox.close()
+
+
+class FailingWebhook(CorpusHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_fetch_state_is_committed_only_once_the_webhook_accepts_the_bundle(tmp_path, monkeypatch):
+    monkeypatch.setattr(RecordingWebhook, "posts", [])
+    state = FetchState(str(tmp_path / "state.sqlite"))
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    bundle = make_bundle(tmp_path)
+    state.stage(bundle["permalink"], {"etag": '"v1"'}, "abc")
+    assert make.deliver(bundle, "http://127.0.0.1:9/webhook", outbox=outbox, state=state)
+    # Queued is not delivered: the next run must still fetch the page
+    assert state.get(bundle["permalink"]) is None
+
+    with serve(str(tmp_path), handler=FailingWebhook) as base_url:
+        worker = DeliveryWorker(outbox, f"{base_url}/webhook", on_sent=make.commit_when_sent(state))
+        assert not worker.deliver(outbox.claim(1))
+    assert state.get(bundle["permalink"]) is None
+
+    # Retry now instead of after the backoff
+    db = sqlite3.connect(outbox.path)
+    with db:
+        db.execute("UPDATE messages SET next_attempt_at = 0")
+    db.close()
+    with serve(str(tmp_path), handler=RecordingWebhook) as base_url:
+        worker = DeliveryWorker(outbox, f"{base_url}/webhook", on_sent=make.commit_when_sent(state))
+        assert worker.deliver(outbox.claim(1))
+    assert state.get(bundle["permalink"]) == ('"v1"', None, "abc")
+    state.close()
+    outbox.close()
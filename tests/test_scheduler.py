@@ -0,0 +1,68 @@
+import gc
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+from downloader import download_images
+from scheduler import HostScheduler, scheduled_session
+from server import serve
+
+
+class SlowImages(BaseHTTPRequestHandler):
+    """Answers every GET with a small JPEG after 50 ms and tracks how many requests overlap."""
+
+    lock = threading.Lock()
+    in_flight = peak = 0
+
+    def __init__(self, *args, directory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+        try:
+            time.sleep(0.05)
+            body = b"\xff\xd8" + b"x" * 100
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_scheduled_downloads_grow_past_the_static_per_host_cap(tmp_path):
+    SlowImages.peak = 0
+    scheduler = HostScheduler(robots=False)
+    with serve(str(tmp_path), handler=SlowImages) as base:
+        session = scheduled_session(scheduler)
+        try:
+            results = download_images([f"{base}/img{i}.jpg" for i in range(300)], str(tmp_path / "images"),
+                                      session=session)
+        finally:
+            session.close()
+    assert all(result.ok for result in results)
+    assert SlowImages.peak > 4
+
+
+def test_dropped_stream_releases_its_slot_without_the_cycle_collector(tmp_path):
+    scheduler = HostScheduler(initial=1, max_per_host=1, robots=False)
+    with serve(str(tmp_path), handler=SlowImages) as base:
+        session = scheduled_session(scheduler)
+        gc.disable()
+        try:
+            response = session.get(f"{base}/a.jpg", stream=True)
+            host = next(iter(scheduler.snapshot()))
+            assert scheduler.snapshot()[host][1] == 1
+            del response
+            assert scheduler.snapshot()[host][1] == 0
+        finally:
+            gc.enable()
+            session.close()
@@ -0,0 +1,36 @@
+import pytest
+
+from make import extract_page
+from streaming import StreamingExtractor
+
+BODYLESS = "<html><head><title>X</title></head><p>Hello <a href='/x'>world</a></p></html>"
+FRAGMENT = "<p>Hello <b>big</b> <a href='/x'>world</a></p><ul><li>one<li>two</ul>"
+
+
+def stream_fields(html, split):
+    extractor = StreamingExtractor()
+    extractor.feed(html[:split])
+    extractor.feed(html[split:])
+    return extractor.finish()
+
+
+def test_bodyless_document_keeps_its_content():
+    assert stream_fields(BODYLESS, 20)["content"] == "X<p>Hello <a>world</a></p>"
+
+
+def test_fragment_keeps_its_content():
+    assert stream_fields(FRAGMENT, 7)["content"] == "<p>Hello big <a>world</a></p><ul><li>one<li>two</li></li></ul>"
+
+
+@pytest.mark.parametrize("html", [
+    BODYLESS,
+    FRAGMENT,
+    "<!DOCTYPE html><html><head><title>T</title></head><body class='b'><p>x</p></body></html>",
+    "<!DOCTYPE html><p>late</p><body><p>in body</p></body>",
+])
+def test_matches_extract_page(html):
+    expected = extract_page(html, "http://example.com/", "html.parser")
+    for split in range(0, len(html) + 1, 5):
+        fields = stream_fields(html, split)
+        assert {key: fields[key] for key in ("page_title", "meta_title", "meta_description", "content")} == \
+            {key: expected[key] for key in ("page_title", "meta_title", "meta_description", "content")}
@@ -0,0 +1,57 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+from downloader import make_session
+from image_store import ImageStore
+from server import serve
+from worker import JobQueue, Worker
+
+
+class SlowPage(BaseHTTPRequestHandler):
+    """Serves one page with an image, slowly, and records the most overlapping page requests."""
+
+    lock = threading.Lock()
+    in_flight = peak = 0
+
+    def __init__(self, *args, directory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.path.endswith(".jpg"):
+            self.reply(b"\xff\xd8" + b"x" * 100, "image/jpeg")
+            return
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+        try:
+            time.sleep(0.1)
+            self.reply(b"<html><body><h1>Page</h1><img src='/a.jpg'></body></html>", "text/html")
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_jobs_for_the_same_page_never_run_at_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    with serve(str(tmp_path), handler=SlowPage) as base:
+        queue.submit([f"{base}/page"] * 4 + [f"{base}/other"])
+        worker = Worker(queue, None, {}, threads=4, store=ImageStore(str(tmp_path / "store")),
+                        session=make_session())
+        worker.run(exit_when_idle=True)
+    assert queue.counts() == {"done": 5}
+    # The other page ran alongside one of the four, never two of the four together
+    assert SlowPage.peak <= 2
+    queue.close()
@@ -0,0 +1,147 @@
+import re
+from collections import namedtuple
+
+from bs4.element import NavigableString, PreformattedString, Tag
+
+from sanitizer import SKIPPED_TAGS
+
+FORMATS = ("text", "markdown")
+BLOCK_TAGS = frozenset(["p", "li"])
+LIST_TAGS = frozenset(["ul", "ol"])
+# Text is only taken from inside these, the same tags scrape_and_save always looked at
+CONTENT_TAGS = BLOCK_TAGS | LIST_TAGS | {"a"}
+_WHITESPACE = re.compile(r"\s+")
+
+# ``in_list`` tells markdown output to keep list lines together instead of spacing them out
+TextBlock = namedtuple("TextBlock", ["text", "in_list"])
+
+
+def iter_blocks(root, markdown=False, skip_tags=SKIPPED_TAGS):
+    """Yield the text blocks under ``root`` in document order, each one once.
+
+    ``<p>``, ``<li>`` and links that are not inside either become blocks;
+    nested tags only end the block around them, so an ``<a>`` in an
+    ``<li>`` in a ``<ul>`` is part of exactly one block instead of three.
+    Strings are joined as they appear and whitespace is collapsed. With
+    ``markdown`` list items get ``-``/``1.`` markers indented by nesting
+    depth and links inside blocks are written as ``[text](href)``. The
+    tree is walked once, iteratively, so deep menus cost no recursion.
+    """
+    parts = []
+    lists = []  # [tag name, items so far] of every open <ul>/<ol>
+    prefix = cont = ""  # marker for the next flushed line, and for the rest of the current block
+    active = 0  # open CONTENT_TAGS
+    blocks = 0  # open blocks
+
+    def flush():
+        nonlocal prefix
+        text = _WHITESPACE.sub(" ", "".join(parts)).strip()
+        parts.clear()
+        block = TextBlock(prefix + text, bool(lists)) if text else None
+        prefix = cont
+        return block
+
+    # Each stack entry is a children iterator and what to do once it is exhausted
+    stack = [(iter(root.contents), None)]
+    while stack:
+        children, on_close = stack[-1]
+        node = next(children, None)
+        if node is None:
+            stack.pop()
+            if on_close is not None:
+                block = on_close()
+                if block is not None:
+                    yield block
+            continue
+        if not isinstance(node, Tag):
+            # Comments, doctypes and the like are not text
+            if active and isinstance(node, NavigableString) and not isinstance(node, PreformattedString):
+                parts.append(str(node))
+            continue
+        name = node.name
+        if name in skip_tags:
+            continue
+        on_close = None
+        if name in CONTENT_TAGS:
+            active += 1
+        if name in LIST_TAGS:
+            block = flush()
+            if block is not None:
+                yield block
+            lists.append([name, 0])
+
+            def on_close():
+                nonlocal active
+                block = flush()
+                lists.pop()
+                active -= 1
+                return block
+        elif name in BLOCK_TAGS or (name == "a" and not blocks):
+            block = flush()
+            if block is not None:
+                yield block
+            saved = cont
+            if markdown and name == "li" and lists:
+                entry = lists[-1]
+                entry[1] += 1
+                indent = "  " * (len(lists) - 1)
+                prefix = indent + ("- " if entry[0] == "ul" else f"{entry[1]}. ")
+                cont = indent + "  "
+            else:
+                prefix = cont
+            blocks += 1
+            link_close = _link_closer(parts, node) if markdown and name == "a" else None
+
+            def on_close(saved=saved, link_close=link_close):
+                nonlocal active, blocks, prefix, cont
+                if link_close is not None:
+                    link_close()
+                block = flush()
+                prefix = cont = saved
+                active -= 1
+                blocks -= 1
+                return block
+        elif name == "a":
+            link_close = _link_closer(parts, node) if markdown else None
+
+            def on_close(link_close=link_close):
+                nonlocal active
+                if link_close is not None:
+                    link_close()
+                active -= 1
+        stack.append((iter(node.contents), on_close))
+
+
+def _link_closer(parts, node):
+    # Remembers where the link's text starts; the returned function wraps it as [text](href)
+    start = len(parts)
+    href = node.get("href")
+
+    def close():
+        inner = "".join(parts[start:])
+        text = _WHITESPACE.sub(" ", inner).strip()
+        if not text or not href:
+            return
+        lead = " " if inner[:1].isspace() else ""
+        trail = " " if inner[-1:].isspace() else ""
+        parts[start:] = [f"{lead}[{text}]({href}){trail}"]
+    return close
+
+
+def extract_text(root, fmt="text", skip_tags=SKIPPED_TAGS):
+    """Return the text blocks under ``root`` as one string, in ``fmt`` ("text" or "markdown").
+
+    Plain text puts one block per line. Markdown leaves a blank line
+    between paragraphs and keeps the lines of a list together.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    markdown = fmt == "markdown"
+    out = []
+    previous = None
+    for block in iter_blocks(root, markdown=markdown, skip_tags=skip_tags):
+        if previous is not None:
+            out.append("\n" if not markdown or (block.in_list and previous.in_list) else "\n\n")
+        out.append(block.text)
+        previous = block
+    return "".join(out)
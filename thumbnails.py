@@ -0,0 +1,144 @@
+import os
+import shutil
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: without Pillow the originals are used
+    Image = ImageOps = None
+
+DEFAULT_CACHE_ROOT = os.path.join(".image_store", "derived")
+# Twice the gallery's 150px so thumbnails stay sharp on high-DPI screens
+DEFAULT_MAX_SIZE = 300
+DEFAULT_FORMAT = "webp"
+DEFAULT_QUALITY = 80
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+
+def available():
+    return Image is not None
+
+
+def derive(src_path, cache_path, max_size, fmt, quality):
+    """Write a resized, recompressed copy of ``src_path`` to ``cache_path``.
+
+    Runs in a worker process. The image is rotated by its EXIF orientation,
+    shrunk to fit ``max_size`` x ``max_size`` (never enlarged) and saved in
+    ``fmt``; JPEG output is flattened to RGB.
+    """
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_size, max_size))
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{uuid.uuid4().hex}.part"
+        try:
+            img.save(tmp_path, FORMATS[fmt], quality=quality)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return cache_path
+
+
+class Thumbnailer:
+    """Makes small WebP/JPEG versions of downloaded images in a process pool.
+
+    Derivatives are cached under ``cache_root`` by the source's sha256 and
+    the output settings, so an image shared by many pages (or unchanged
+    since the last run) is only resized once. Without Pillow installed it
+    warns once and hands back the originals.
+    """
+
+    def __init__(self, cache_root=DEFAULT_CACHE_ROOT, max_size=DEFAULT_MAX_SIZE,
+                 fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY, workers=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+        self.cache_root = cache_root
+        self.max_size = max_size
+        self.fmt = fmt
+        self.quality = quality
+        self.enabled = available()
+        if not self.enabled:
+            warnings.warn("Pillow is not installed; thumbnails are disabled and originals are used")
+        self._executor = ProcessPoolExecutor(max_workers=workers) if self.enabled else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def cache_path(self, sha256):
+        ext = "jpg" if self.fmt == "jpeg" else self.fmt
+        name = f"{sha256}-{self.max_size}-q{self.quality}.{ext}"
+        return os.path.join(self.cache_root, sha256[:2], name)
+
+    def derive_all(self, results, dest_folder):
+        """Put a small version of every successful ImageResult into ``dest_folder``.
+
+        Returns ``{original path: derived path}``. Images that can't be
+        decoded (SVG, broken files) are copied over as they are.
+        """
+        os.makedirs(dest_folder, exist_ok=True)
+        unique = {}
+        for result in results:
+            if result.ok and result.path not in unique:
+                unique[result.path] = result.sha256
+        if not self.enabled:
+            return {path: path for path in unique}
+
+        futures = {}
+        for path, sha256 in unique.items():
+            cached = self.cache_path(sha256)
+            if not os.path.exists(cached) and cached not in futures.values():
+                futures[self._executor.submit(derive, path, cached, self.max_size, self.fmt,
+                                              self.quality)] = cached
+        failed = set()
+        for future, cached in futures.items():
+            if future.exception() is not None:
+                failed.add(cached)
+
+        derived = {}
+        taken = set()
+        ext = os.path.splitext(self.cache_path("0" * 64))[1]
+        for path, sha256 in unique.items():
+            cached = self.cache_path(sha256)
+            if cached in failed:
+                cached, name = path, os.path.basename(path)
+            else:
+                name = os.path.splitext(os.path.basename(path))[0] + ext
+            if name in taken:
+                # a.jpg and a.png would both become a.webp
+                name = os.path.basename(path) + ext
+            taken.add(name)
+            derived[path] = _link(cached, os.path.join(dest_folder, name))
+        return derived
+
+
+def _link(src, dest):
+    if os.path.exists(dest):
+        if os.path.samefile(src, dest):
+            return dest
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+    return dest
+
+
+def add_thumbnail_arguments(arg_parser):
+    arg_parser.add_argument("--thumbnails", choices=list(FORMATS), metavar="FORMAT",
+                            help="use resized webp/jpeg copies of images (needs Pillow)")
+    arg_parser.add_argument("--thumbnail-size", type=int, default=DEFAULT_MAX_SIZE, metavar="PX",
+                            help="longest side of the resized images")
@@ -0,0 +1,413 @@
+import argparse
+import base64
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+
+from downloader import CHUNK_SIZE, DEFAULT_WORKERS, make_session
+from scheduler import scheduled_session
+
+DEFAULT_WARC_ROOT = "warc"
+INDEX_NAME = "index.sqlite"
+# The customary WARC file size; recording moves on to a new file past it
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024 * 1024
+# Larger responses are passed through without being recorded
+MAX_RECORD_BYTES = 100 * 1024 * 1024
+# Bodies up to this size are spooled in memory while being recorded, larger ones on disk
+SPOOL_BYTES = 1024 * 1024
+_WARC_FILE = re.compile(r"^capture-(\d+)\.warc\.gz$")
+_HTTP_VERSIONS = {10: "HTTP/1.0", 11: "HTTP/1.1", 20: "HTTP/2"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    warc_file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_url ON records (url, method, id);
+"""
+
+
+class RecordTooLarge(requests.exceptions.RequestException):
+    """Raised when a response without Content-Length grows past the recording limit."""
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _digest(hasher):
+    return "sha1:" + base64.b32encode(hasher.digest()).decode("ascii")
+
+
+def _record_head(fields):
+    lines = ["WARC/1.0"] + [f"{name}: {value}" for name, value in fields]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+
+def _http_head(first_line, headers):
+    lines = [first_line] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1", errors="replace")
+
+
+def _parse_fields(head):
+    fields = {}
+    for line in head.decode("utf-8", errors="replace").split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        fields[name.strip().lower()] = value.strip()
+    return fields
+
+
+def parse_response(record):
+    """Split an uncompressed response record into ``(status, reason, headers, body)``."""
+    warc_head, _, block = record.partition(b"\r\n\r\n")
+    block = block[:int(_parse_fields(warc_head)["content-length"])]
+    http_head, _, body = block.partition(b"\r\n\r\n")
+    lines = http_head.decode("iso-8859-1").split("\r\n")
+    _, status, reason = (lines[0].split(" ", 2) + [""])[:3]
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers.append((name.strip(), value.strip()))
+    return int(status), reason, headers, body
+
+
+def _members(path):
+    """Yield ``(offset, length, data)`` for every gzip member of ``path``."""
+    with open(path, "rb") as f:
+        offset = 0
+        pending = b""
+        while True:
+            decompressor = zlib.decompressobj(31)
+            parts = []
+            consumed = 0
+            while not decompressor.eof:
+                chunk = pending or f.read(CHUNK_SIZE)
+                if not chunk:
+                    # The end of the file, or a member cut short by a crash
+                    return
+                parts.append(decompressor.decompress(chunk))
+                pending = decompressor.unused_data
+                consumed += len(chunk) - len(pending)
+            yield offset, consumed, b"".join(parts)
+            offset += consumed
+
+
+class WarcArchive:
+    """A directory of gzip-compressed WARC files and a SQLite index over them.
+
+    Every record is its own gzip member, the layout wget and Heritrix use,
+    so a response is read back by seeking to its offset and inflating that
+    one member. The index maps method and URL to the file, offset and
+    length of each response record. A recording run always starts a new
+    file; earlier captures are never rewritten.
+    """
+
+    def __init__(self, root=DEFAULT_WARC_ROOT, max_file_bytes=DEFAULT_MAX_FILE_BYTES):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_name = None
+        self._db = sqlite3.connect(os.path.join(root, INDEX_NAME), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def warc_files(self):
+        return sorted(name for name in os.listdir(self.root) if _WARC_FILE.match(name))
+
+    def _open_next(self):
+        if self._file is not None:
+            self._file.close()
+        names = self.warc_files()
+        part = int(_WARC_FILE.match(names[-1]).group(1)) + 1 if names else 0
+        self._file_name = f"capture-{part:05d}.warc.gz"
+        self._file = open(os.path.join(self.root, self._file_name), "xb")
+        info = b"software: Beautiful-Soup scraper\r\nformat: WARC File Format 1.0\r\n"
+        self._write_record([
+            ("WARC-Type", "warcinfo"),
+            ("WARC-Record-ID", f"<urn:uuid:{uuid.uuid4()}>"),
+            ("WARC-Date", _now()),
+            ("WARC-Filename", self._file_name),
+            ("Content-Type", "application/warc-fields"),
+            ("Content-Length", len(info)),
+        ], info)
+
+    def _write_record(self, fields, head, body=None):
+        offset = self._file.tell()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip framing
+        self._file.write(compressor.compress(_record_head(fields)) + compressor.compress(head))
+        if body is not None:
+            for chunk in iter(lambda: body.read(CHUNK_SIZE), b""):
+                self._file.write(compressor.compress(chunk))
+        self._file.write(compressor.compress(b"\r\n\r\n") + compressor.flush())
+        self._file.flush()
+        return offset, self._file.tell() - offset
+
+    def write_exchange(self, method, url, request_block, status, http_head, body, body_size,
+                       payload_digest, block_digest):
+        """Append a response record and its request record, and index the response.
+
+        ``http_head`` is the status line and headers as the server sent them
+        and ``body`` a file positioned at the raw, still content-encoded body
+        of ``body_size`` bytes.
+        """
+        date = _now()
+        response_id = f"<urn:uuid:{uuid.uuid4()}>"
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.max_file_bytes:
+                self._open_next()
+            offset, length = self._write_record([
+                ("WARC-Type", "response"),
+                ("WARC-Record-ID", response_id),
+                ("WARC-Date", date),
+                ("WARC-Target-URI", url),
+                ("Content-Type", "application/http; msgtype=response"),
+                ("WARC-Payload-Digest", payload_digest),
+                ("WARC-Block-Digest", block_digest),
+                ("Content-Length", len(http_head) + body_size),
+            ], http_head, body)
+            self._write_record([
+                ("WARC-Type", "request"),
+                ("WARC-Record-ID", f"<urn:uuid:{uuid.uuid4()}>"),
+                ("WARC-Date", date),
+                ("WARC-Target-URI", url),
+                ("WARC-Concurrent-To", response_id),
+                ("Content-Type", "application/http; msgtype=request"),
+                ("Content-Length", len(request_block)),
+            ], request_block)
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO records (method, url, status, warc_file, offset, length, recorded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (method, url, status, self._file_name, offset, length, date))
+
+    def lookup(self, url, method="GET"):
+        """Return ``(warc_file, offset, length)`` of the latest full response for ``url``, or None."""
+        # A 304 recorded by an incremental run is only used when nothing better exists
+        with self._lock:
+            return self._db.execute(
+                "SELECT warc_file, offset, length FROM records WHERE url = ? AND method = ? "
+                "ORDER BY status = 304, id DESC LIMIT 1", (url, method)).fetchone()
+
+    def read_response(self, url, method="GET"):
+        """Return ``(status, reason, headers, body)`` recorded for ``url``, or None."""
+        row = self.lookup(url, method)
+        if row is None:
+            return None
+        warc_file, offset, length = row
+        with open(os.path.join(self.root, warc_file), "rb") as f:
+            f.seek(offset)
+            return parse_response(zlib.decompress(f.read(length), 31))
+
+    def reindex(self):
+        """Rebuild the index from the WARC files in the directory; returns the record count."""
+        rows = []
+        for name in self.warc_files():
+            methods = {}
+            responses = []
+            for offset, length, data in _members(os.path.join(self.root, name)):
+                head, _, block = data.partition(b"\r\n\r\n")
+                fields = _parse_fields(head)
+                kind = fields.get("warc-type")
+                if kind == "request":
+                    method = block.split(b" ", 1)[0].decode("ascii", errors="replace")
+                    # Tools differ in which of the pair points at the other
+                    methods[fields.get("warc-record-id")] = method
+                    methods[fields.get("warc-concurrent-to")] = method
+                elif kind == "response":
+                    status = parse_response(data)[0]
+                    responses.append((fields, status, offset, length))
+            for fields, status, offset, length in responses:
+                method = methods.get(fields.get("warc-record-id")) or \
+                    methods.get(fields.get("warc-concurrent-to")) or "GET"
+                rows.append((method, fields.get("warc-target-uri"), status, name, offset, length,
+                             fields.get("warc-date")))
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM records")
+            self._db.executemany(
+                "INSERT INTO records (method, url, status, warc_file, offset, length, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COUNT(DISTINCT url) FROM records").fetchone()
+
+
+def _request_block(request):
+    parts = requests.utils.urlparse(request.url)
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    headers = [("Host", parts.netloc)] + [(k, v) for k, v in request.headers.items() if k.lower() != "host"]
+    block = _http_head(f"{request.method} {target} HTTP/1.1", headers)
+    body = request.body
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    # Streamed uploads (file objects, generators) are left out of the record
+    return block + body if isinstance(body, bytes) else block
+
+
+class RecordingAdapter(HTTPAdapter):
+    """An HTTPAdapter that writes every exchange it carries into a WarcArchive.
+
+    The raw body is read off the connection into a spooled temporary file,
+    written to the archive and then handed to requests as if it came from
+    the socket, so callers that stream, decode or check sizes behave as
+    they would without recording. Responses announced as larger than
+    ``max_record_bytes`` pass through unrecorded.
+    """
+
+    def __init__(self, archive, max_record_bytes=MAX_RECORD_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+        self.max_record_bytes = max_record_bytes
+
+    def send(self, request, stream=False, **kwargs):
+        response = super().send(request, stream=True, **kwargs)
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > self.max_record_bytes:
+            return response
+        raw = response.raw
+        # The body is stored de-chunked, so the record can't claim chunked framing
+        headers = [(k, v) for k, v in raw.headers.items() if k.lower() != "transfer-encoding"]
+        first_line = f"{_HTTP_VERSIONS.get(raw.version, 'HTTP/1.1')} {response.status_code} {response.reason or ''}"
+        http_head = _http_head(first_line.rstrip(), headers)
+        payload, block = hashlib.sha1(), hashlib.sha1(http_head)
+        body = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        size = 0
+        try:
+            for chunk in raw.stream(CHUNK_SIZE, decode_content=False):
+                size += len(chunk)
+                if size > self.max_record_bytes:
+                    raise RecordTooLarge(f"{request.url}: body exceeds recording limit of "
+                                         f"{self.max_record_bytes} bytes", request=request)
+                payload.update(chunk)
+                block.update(chunk)
+                body.write(chunk)
+            raw.release_conn()
+            body.seek(0)
+            self.archive.write_exchange(request.method, request.url, _request_block(request),
+                                        response.status_code, http_head, body, size,
+                                        _digest(payload), _digest(block))
+        except BaseException:
+            body.close()
+            response.close()
+            raise
+        body.seek(0)
+        response.raw = HTTPResponse(body=body, headers=HTTPHeaderDict(headers), status=response.status_code,
+                                    reason=response.reason, version=raw.version,
+                                    preload_content=False, decode_content=True)
+        return response
+
+    def close(self):
+        super().close()
+        self.archive.close()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Answers requests from a WarcArchive instead of the network.
+
+    Responses come back exactly as recorded, redirects and content
+    encoding included. A URL that was never recorded fails the way an
+    unreachable host does (requests.ConnectionError), so callers report
+    it and move on.
+    """
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        recorded = self.archive.read_response(request.url, request.method)
+        if recorded is None:
+            raise requests.ConnectionError(f"{request.method} {request.url} is not in the archive",
+                                           request=request)
+        status, reason, headers, body = recorded
+        raw = HTTPResponse(body=io.BytesIO(body), headers=HTTPHeaderDict(headers), status=status,
+                           reason=reason, version=11, preload_content=False, decode_content=True)
+        return self.build_response(request, raw)
+
+    def close(self):
+        super().close()
+        self.archive.close()
+
+
+def add_warc_arguments(arg_parser):
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument("--record", nargs="?", const=DEFAULT_WARC_ROOT, metavar="DIR",
+                       help="write every HTTP request and response into WARC files in DIR")
+    group.add_argument("--replay", nargs="?", const=DEFAULT_WARC_ROOT, metavar="DIR",
+                       help="answer HTTP requests from the WARC files in DIR instead of the network")
+
+
+def open_session(args, headers=None, pool_size=DEFAULT_WORKERS, scheduler=None):
+    """The session --record/--replay ask for, or None when neither is given.
+
+    With a scheduler.HostScheduler live requests (recorded or not) go
+    through it, and a session is always returned; replayed ones never
+    touch the network, so they are not scheduled. Closing the session
+    closes the archive.
+    """
+    if args.replay:
+        if not os.path.exists(os.path.join(args.replay, INDEX_NAME)):
+            raise FileNotFoundError(f"no WARC index in {args.replay}; record with --record first")
+        return make_session(headers, adapter=ReplayAdapter(WarcArchive(args.replay)))
+    adapter = None
+    if scheduler is not None:
+        pool_size = max(pool_size, scheduler.max_per_host)
+    if args.record:
+        adapter = RecordingAdapter(WarcArchive(args.record), pool_connections=pool_size, pool_maxsize=pool_size)
+    if scheduler is not None:
+        return scheduled_session(scheduler, headers, pool_size=pool_size, adapter=adapter)
+    return make_session(headers, adapter=adapter) if adapter is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or re-index a directory of recorded WARC files.")
+    parser.add_argument("command", choices=["stats", "reindex"])
+    parser.add_argument("root", nargs="?", default=DEFAULT_WARC_ROOT)
+    args = parser.parse_args()
+    with WarcArchive(args.root) as archive:
+        if args.command == "reindex":
+            print(f"Indexed {archive.reindex()} responses.")
+        records, urls = archive.stats()
+        print(f"{len(archive.warc_files())} WARC files, {records} responses for {urls} URLs.")
+
+
+if __name__ == "__main__":
+    main()
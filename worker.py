@@ -0,0 +1,336 @@
+import argparse
+import json
+import signal
+import sqlite3
+import sys
+import threading
+import time
+
+from batch import read_url_list
+from downloader import DEFAULT_WORKERS, make_session
+from fetch_state import DEFAULT_STATE_PATH, FetchState, PageUnchanged
+from image_store import ImageStore
+from jsonl import add_output_arguments, open_output
+from make import HEADERS, WEBHOOK_URL, commit_when_sent, deliver, get_image_folder, process_url
+from metrics import NULL_METRICS, add_metrics_arguments, metrics_session
+from outbox import DEFAULT_OUTBOX, DeliveryWorker, Outbox
+from parsing import DEFAULT_PARSER, PARSERS, make_soup, resolve_parser
+from scheduler import add_scheduler_arguments, open_scheduler, scheduled_session
+from streaming import DEFAULT_MAX_PAGE_BYTES
+from thumbnails import Thumbnailer, add_thumbnail_arguments
+from warc import add_warc_arguments, open_session
+
+DEFAULT_QUEUE = "jobs.sqlite"
+POLL_INTERVAL = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+class JobQueue:
+    """URLs waiting for the worker, and what became of the ones it took.
+
+    A job goes queued -> running -> done, unchanged or failed. Jobs that
+    were running when a worker died are queued again when the next one
+    starts.
+    Any number of processes can submit while a worker runs.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def requeue_running(self):
+        with self._lock, self._db:
+            return self._db.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'").rowcount
+
+    def submit(self, urls):
+        now = time.time()
+        ids = []
+        with self._lock, self._db:
+            for url in urls:
+                ids.append(self._db.execute("INSERT INTO jobs (url, created_at) VALUES (?, ?)",
+                                            (url, now)).lastrowid)
+        return ids
+
+    def claim(self, skip=None):
+        """Mark the oldest queued job as running and return ``(id, url)``, or None.
+
+        Jobs whose URL ``skip(url)`` is true for are passed over and stay queued.
+        """
+        with self._lock, self._db:
+            row = None
+            for candidate in self._db.execute("SELECT id, url FROM jobs WHERE state = 'queued' ORDER BY id"):
+                if skip is None or not skip(candidate[1]):
+                    row = candidate
+                    break
+            if row is not None:
+                self._db.execute("UPDATE jobs SET state = 'running', started_at = ? WHERE id = ?",
+                                 (time.time(), row[0]))
+        return row
+
+    def finish(self, job_id, state, error=None):
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE id = ?",
+                             (state, time.time(), error, job_id))
+
+    def get(self, job_ids):
+        marks = ",".join("?" * len(job_ids))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, url, state, created_at, started_at, finished_at, error FROM jobs "
+                f"WHERE id IN ({marks}) ORDER BY id", list(job_ids)).fetchall()
+        return [_job(row) for row in rows]
+
+    def recent(self, limit=20):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, url, state, created_at, started_at, finished_at, error FROM jobs "
+                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [_job(row) for row in reversed(rows)]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+
+def _job(row):
+    job_id, url, state, created_at, started_at, finished_at, error = row
+    job = {"id": job_id, "url": url, "state": state, "error": error}
+    if started_at is not None:
+        job["waited"] = round(started_at - created_at, 3)
+    if finished_at is not None and started_at is not None:
+        job["seconds"] = round(finished_at - started_at, 3)
+    return job
+
+
+class Worker:
+    """Runs make.process_url for every queued job in one long-lived process.
+
+    Everything a run normally sets up again per page stays warm between
+    jobs: the pooled (and scheduled) HTTP sessions with their open
+    connections, the image store, the parser backend, the thumbnail
+    pool and, when used, the fetch state and outbox. ``threads`` jobs run
+    at a time. Results are written to ``output`` and delivered like
+    make.py does.
+    """
+
+    def __init__(self, queue, webhook_url, headers, threads=2, parser=None, store=None, session=None,
+                 webhook_session=None, state=None, outbox=None, output=None, thumbnailer=None,
+                 stream=False, max_page_bytes=DEFAULT_MAX_PAGE_BYTES, metrics=NULL_METRICS):
+        self.queue = queue
+        self.webhook_url = webhook_url
+        self.headers = headers
+        self.threads = max(1, threads)
+        self.parser = resolve_parser(parser)
+        self.store = store
+        self.session = session
+        self.webhook_session = webhook_session
+        self.state = state
+        self.outbox = outbox
+        self.output = output
+        self.thumbnailer = thumbnailer
+        self.stream = stream
+        self.max_page_bytes = max_page_bytes
+        self.metrics = metrics
+        self.stopping = threading.Event()
+        self._output_lock = threading.Lock()
+        # Image folders (and ZIPs) of the jobs being processed; two jobs never share one at a time
+        self._claim_lock = threading.Lock()
+        self._busy_folders = set()
+        # Import and initialise the parser backend now rather than on the first job
+        make_soup("<p></p>", self.parser)
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, exit_when_idle=False):
+        """Work through the queue until stop() is called (or it is empty, with ``exit_when_idle``)."""
+        requeued = self.queue.requeue_running()
+        if requeued:
+            print(f"🔁 Requeued {requeued} jobs left running by an earlier worker.")
+        threads = [threading.Thread(target=self._loop, args=(exit_when_idle,), daemon=True)
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        # Joining with a timeout keeps the main thread free to run signal handlers
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+
+    def _loop(self, exit_when_idle):
+        while not self.stopping.is_set():
+            with self._claim_lock:
+                job = self.queue.claim(skip=lambda url: get_image_folder(url) in self._busy_folders)
+                if job is not None:
+                    folder = get_image_folder(job[1])
+                    self._busy_folders.add(folder)
+            if job is None:
+                # Jobs held back for a busy folder are taken by the thread working on it
+                if exit_when_idle:
+                    return
+                self.stopping.wait(POLL_INTERVAL)
+                continue
+            try:
+                self.handle(*job)
+            finally:
+                with self._claim_lock:
+                    self._busy_folders.discard(folder)
+
+    def handle(self, job_id, url):
+        started = time.monotonic()
+        try:
+            bundle = process_url(url, self.headers, store=self.store, parser=self.parser, metrics=self.metrics,
+                                 state=self.state, thumbnailer=self.thumbnailer, stream=self.stream,
+                                 max_page_bytes=self.max_page_bytes, session=self.session)
+            if not bundle:
+                raise RuntimeError(f"could not fetch {url}")
+            if self.output is not None:
+                with self._output_lock:
+                    self.output.write({k: v for k, v in bundle.items() if k != "zip_file_path"})
+            sent = deliver(bundle, self.webhook_url, outbox=self.outbox, metrics=self.metrics,
+                           session=self.webhook_session, state=self.state)
+            if not sent and self.webhook_url is not None:
+                raise RuntimeError("webhook delivery failed")
+        except PageUnchanged:
+            self.queue.finish(job_id, "unchanged")
+            print(f"⏭️ Job #{job_id} unchanged since last run: {url}")
+        except Exception as e:
+            self.metrics.incr("errors_total", stage="worker")
+            self.queue.finish(job_id, "failed", str(e))
+            print(f"❌ Job #{job_id} failed: {url}. Error: {e}")
+        else:
+            self.queue.finish(job_id, "done")
+            print(f"✅ Job #{job_id} done in {time.monotonic() - started:.2f}s: {url}")
+
+
+def read_submissions(lines):
+    # Plain URLs or JSON lines like {"url": "..."}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        yield json.loads(line)["url"] if line.startswith("{") else line
+
+
+def run(args):
+    webhook_url = None if args.replay else WEBHOOK_URL
+    store = ImageStore()
+    state = FetchState(args.incremental) if args.incremental else None
+    thumbnailer = Thumbnailer(fmt=args.thumbnails, max_size=args.thumbnail_size) if args.thumbnails else None
+    queue = JobQueue(args.queue)
+    with metrics_session(args.metrics_log, args.metrics_prom) as metrics, open_output(args) as output:
+        scheduler = open_scheduler(args, HEADERS, metrics=metrics)
+        pool_size = max(args.threads, DEFAULT_WORKERS)
+        # Without --record/--replay or the scheduler there is still one pooled session, kept open between jobs
+        session = open_session(args, HEADERS, pool_size=pool_size, scheduler=scheduler) or \
+            make_session(HEADERS, pool_size=pool_size)
+        webhook_session = scheduled_session(scheduler, pool_size=2) if scheduler is not None else make_session()
+        outbox = delivery = None
+        if args.outbox and webhook_url:
+            outbox = Outbox(args.outbox)
+            delivery = DeliveryWorker(outbox, webhook_url, session=webhook_session, metrics=metrics,
+                                      on_sent=commit_when_sent(state)).start()
+        worker = Worker(queue, webhook_url, HEADERS, threads=args.threads, parser=args.parser, store=store,
+                        session=session, webhook_session=webhook_session, state=state, outbox=outbox,
+                        output=output, thumbnailer=thumbnailer, stream=args.stream,
+                        max_page_bytes=int(args.max_page_mb * 1024 * 1024), metrics=metrics)
+
+        def stop(*_):
+            print("🛑 Stopping after the running jobs...")
+            worker.stop()
+        # Ctrl+C and SIGTERM (e.g. from systemd) let running jobs finish instead of abandoning them
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        print(f"👷 Worker ready: {args.threads} threads, queue {args.queue}, {queue.counts()}")
+        try:
+            worker.run(exit_when_idle=args.exit_when_idle)
+        finally:
+            if delivery is not None:
+                delivery.stop(drain=True)
+                outbox.close()
+            for resource in (session, webhook_session, state, thumbnailer, store):
+                if resource is not None:
+                    resource.close()
+            print(f"👷 Worker stopped: {queue.counts()}")
+            queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape queued URLs in a long-running worker process.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE, metavar="FILE", help="SQLite job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="process jobs as they are queued")
+    run_parser.add_argument("--threads", type=int, default=2, help="jobs processed at the same time")
+    run_parser.add_argument("--exit-when-idle", action="store_true", help="stop once the queue is empty")
+    run_parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER)
+    run_parser.add_argument("--stream", action="store_true",
+                            help="extract pages while they download instead of parsing the whole page")
+    run_parser.add_argument("--max-page-mb", type=float, default=DEFAULT_MAX_PAGE_BYTES / 1024 / 1024)
+    run_parser.add_argument("--outbox", nargs="?", const=DEFAULT_OUTBOX, metavar="FILE",
+                            help="queue bundles in FILE and deliver them in the background, with retries")
+    run_parser.add_argument("--incremental", nargs="?", const=DEFAULT_STATE_PATH, metavar="FILE",
+                            help="remember ETag/Last-Modified/content hashes in FILE and skip unchanged pages")
+    add_warc_arguments(run_parser)
+    add_scheduler_arguments(run_parser)
+    add_thumbnail_arguments(run_parser)
+    add_output_arguments(run_parser)
+    add_metrics_arguments(run_parser)
+
+    submit_parser = commands.add_parser("submit", help="queue URLs for the worker")
+    submit_parser.add_argument("urls", nargs="*",
+                               help="URLs to queue; '-' reads URLs or {\"url\": ...} JSON lines from stdin")
+    submit_parser.add_argument("--batch", metavar="FILE", help="queue every URL in FILE (or a sitemap.xml)")
+
+    status_parser = commands.add_parser("status", help="show queue counts and job states")
+    status_parser.add_argument("ids", nargs="*", type=int, help="jobs to show (default: the latest 20)")
+    status_parser.add_argument("--json", action="store_true", help="one JSON object per job")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+        return
+    queue = JobQueue(args.queue)
+    try:
+        if args.command == "submit":
+            urls = [url for url in args.urls if url != "-"]
+            if "-" in args.urls:
+                urls.extend(read_submissions(sys.stdin))
+            if args.batch:
+                urls.extend(read_url_list(args.batch, HEADERS))
+            ids = queue.submit(urls)
+            print(f"Queued {len(ids)} jobs" + (f" (#{ids[0]}-#{ids[-1]})" if ids else "") + ".")
+        else:
+            jobs = queue.get(args.ids) if args.ids else queue.recent()
+            for job in jobs:
+                if args.json:
+                    print(json.dumps(job, ensure_ascii=False))
+                else:
+                    took = f" {job['seconds']}s" if "seconds" in job else ""
+                    error = f" ({job['error']})" if job["error"] else ""
+                    print(f"#{job['id']} {job['state']}{took} {job['url']}{error}")
+            if not args.json:
+                print(queue.counts())
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()